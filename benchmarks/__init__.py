@@ -0,0 +1 @@
+""" Synthetic projects for measuring how fast python-combiner is """
@@ -0,0 +1,142 @@
+import argparse
+import json
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections.abc import Callable
+
+from python_combiner import Compiler, CompilerOptions, plugin
+from python_combiner.stats import CompilerStats
+
+from . import generators
+
+
+def _default_options() -> CompilerOptions:
+    return CompilerOptions()
+
+
+def _folding_options() -> CompilerOptions:
+    return CompilerOptions(plugins=[
+        plugin.ConstantsPlugin(constants={"__DEBUG__": False, "__LEVEL__": 3}),
+        plugin.SimplifyIfPlugin(),
+    ])
+
+
+def _minify_options() -> CompilerOptions:
+    return CompilerOptions(plugins=[plugin.MinifyPlugin()])
+
+
+# name -> (generator, default size, options)
+BENCHMARKS: dict[str, tuple[Callable[[str, int], str], int, Callable[[], CompilerOptions]]] = {
+    "wide_fan_out": (generators.wide_fan_out, 300, _default_options),
+    "deep_chain": (generators.deep_chain, 300, _default_options),
+    "diamonds": (generators.diamonds, 200, _default_options),
+    "huge_module": (generators.huge_module, 3000, _default_options),
+    "constant_folds": (generators.constant_folds, 2000, _folding_options),
+    "constant_tables": (generators.constant_tables, 5000, _folding_options),
+}
+if hasattr(plugin, "MinifyPlugin"):
+    # only available if python-minifier is installed
+    BENCHMARKS["minify"] = (generators.wide_fan_out, 100, _minify_options)
+
+
+def compile_project(main_path: str, options: CompilerOptions, stats: CompilerStats | None = None) -> str:
+    with open(main_path, "r") as file:
+        source = file.read()
+    return Compiler(source, main_path, options, stats=stats)()
+
+
+def run_benchmark(name: str, size: int, repeat: int) -> dict:
+    generator, _, make_options = BENCHMARKS[name]
+    with tempfile.TemporaryDirectory(prefix=f"python-combiner-{name}-") as directory:
+        main_path = generator(directory, size)
+        times: list[float] = []
+        stats = CompilerStats()
+        for i in range(repeat):
+            start = time.perf_counter()
+            compile_project(main_path, make_options(),
+                            stats if i == 0 else None)
+            times.append(time.perf_counter() - start)
+
+        # measure memory separately since tracing slows everything down
+        tracemalloc.start()
+        try:
+            compile_project(main_path, make_options())
+            _, peak_memory = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return {
+        "size": size,
+        "time": statistics.median(times),
+        "peak_memory": peak_memory,
+        "phases": {phase: stats.phases[phase].time for phase in stats.phases},
+    }
+
+
+def compare(results: dict[str, dict], baseline: dict[str, dict], threshold: float) -> list[str]:
+    """ returns a description of each result which regressed past `threshold` compared to `baseline` """
+    regressions: list[str] = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous is None or previous["size"] != result["size"]:
+            continue
+        for metric in ["time", "peak_memory"]:
+            if previous[metric] > 0 and result[metric] > previous[metric] * (1 + threshold):
+                regressions.append(
+                    f"{name}: {metric} went from {previous[metric]:.6g} to {result[metric]:.6g} "
+                    f"(+{(result[metric] / previous[metric] - 1) * 100:.1f}%)")
+    return regressions
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(
+        prog="benchmarks",
+        description="Measures how long python-combiner takes to compile synthetic projects.")
+    parser.add_argument("benchmarks", nargs="*",
+                        help=f"the benchmarks to run, out of {', '.join(BENCHMARKS.keys())}. defaults to all of them")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="multiplies the size of every generated project")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="how many times to compile each project. the median time is reported")
+    parser.add_argument("--phases", action=argparse.BooleanOptionalAction,
+                        help="prints the time spent in each phase of the compiler")
+    parser.add_argument("--output", type=argparse.FileType("w"), default=None,
+                        help="writes the results to a file as json, for use with --baseline")
+    parser.add_argument("--baseline", type=argparse.FileType("r"), default=None,
+                        help="compares the results to ones written with --output and fails if any regressed")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="how much slower or bigger than the baseline a result can be before it's a regression, as a fraction")
+    args = parser.parse_args(argv)
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error(f"unknown benchmark {name}")
+
+    results: dict[str, dict] = {}
+    for name in args.benchmarks or BENCHMARKS.keys():
+        size = max(int(BENCHMARKS[name][1] * args.scale), 1)
+        result = run_benchmark(name, size, args.repeat)
+        results[name] = result
+        print(f"{name:<16} size {size:>6} {result['time'] * 1000:>10.1f}ms "
+              f"{result['peak_memory'] / 1024 / 1024:>8.1f}MiB peak")
+        if args.phases:
+            for phase, phase_time in sorted(result["phases"].items(), key=lambda item: -item[1]):
+                print(f"    {phase:<54} {phase_time * 1000:>10.1f}ms")
+
+    if args.output is not None:
+        with args.output as output:
+            json.dump(results, output, indent=2)
+
+    if args.baseline is not None:
+        with args.baseline as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f"regression: {regression}", file=sys.stderr)
+        if len(regressions) > 0:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import os
+
+# each generator writes a synthetic project of roughly `size` units (modules,
+# functions, ...) into `directory` and returns the path of its main module
+
+
+def _write(directory: str, name: str, source: str) -> str:
+    path = os.path.join(directory, f"{name}.py")
+    with open(path, "w") as file:
+        file.write(source)
+    return path
+
+
+def _functions(prefix: str, count: int) -> str:
+    return "".join(
+        f"def {prefix}_{i}(x):\n"
+        f"    y = x * {i} + len(str(x))\n"
+        f"    return [y + j for j in range({i % 7 + 1})]\n\n\n"
+        for i in range(count))
+
+
+def wide_fan_out(directory: str, size: int) -> str:
+    """ a main module importing `size` independent modules """
+    for i in range(size):
+        _write(directory, f"leaf_{i}", _functions(f"leaf_{i}", 5))
+    imports = "".join(f"import leaf_{i}\n" for i in range(size))
+    calls = "".join(f"print(leaf_{i}.leaf_{i}_0({i}))\n" for i in range(size))
+    return _write(directory, "main", imports + "\n" + calls)
+
+
+def deep_chain(directory: str, size: int) -> str:
+    """ `size` modules each importing the next one """
+    for i in range(size):
+        source = _functions(f"link_{i}", 3)
+        if i + 1 < size:
+            source = f"import link_{i + 1}\n\n\n" + source + \
+                f"def call():\n    return link_{i + 1}.call()\n"
+        else:
+            source += "def call():\n    return 0\n"
+        _write(directory, f"link_{i}", source)
+    return _write(directory, "main", "import link_0\n\nprint(link_0.call())\n")
+
+
+def diamonds(directory: str, size: int) -> str:
+    """
+    layers of modules where every module imports every module in the layer
+    below, so most modules are imported many times
+    """
+    width = 4
+    layers = max(size // width, 1)
+    for layer in range(layers):
+        for i in range(width):
+            imports = "".join(
+                f"import diamond_{layer + 1}_{j}\n" for j in range(width)) if layer + 1 < layers else ""
+            _write(directory, f"diamond_{layer}_{i}",
+                   imports + "\n\n" + _functions(f"diamond_{layer}_{i}", 3))
+    imports = "".join(f"import diamond_0_{i}\n" for i in range(width))
+    return _write(directory, "main", imports + "\nprint(diamond_0_0.diamond_0_0_0(1))\n")
+
+
+def huge_module(directory: str, size: int) -> str:
+    """ a single module with `size` functions and `size` classes """
+    classes = "".join(
+        f"class Class{i}:\n"
+        f"    value = {i}\n\n"
+        f"    def method(self, x):\n"
+        f"        return huge_{i}(x) + self.value\n\n\n"
+        for i in range(size))
+    source = _functions("huge", size) + classes + "print(Class0().method(1))\n"
+    return _write(directory, "main", source)
+
+
+def constant_folds(directory: str, size: int) -> str:
+    """
+    a module with `size` functions full of compile-time constants and `if`
+    statements for `ConstantsPlugin` and `SimplifyIfPlugin` to fold
+    """
+    functions = "".join(
+        f"def folded_{i}(x):\n"
+        f"    if __DEBUG__ and {i} % 2 == 0:\n"
+        f"        print('debugging', {i})\n"
+        f"    elif not __DEBUG__ or __LEVEL__ > {i % 5}:\n"
+        f"        x = x + __LEVEL__ * {i} - (1 + 2 * 3)\n"
+        f"    else:\n"
+        f"        x = -x\n"
+        f"    return x if __LEVEL__ > 2 else x + 1\n\n\n"
+        for i in range(size))
+    _write(directory, "folds", functions)
+    return _write(directory, "main", "import folds\n\nprint(folds.folded_0(1))\n")
+
+
+def constant_tables(directory: str, size: int) -> str:
+    """
+    a module with `size` top-level assignments built from compile-time
+    constants (like a generated lookup table) for `ConstantsPlugin`
+    """
+    assignments = "".join(
+        f"TABLE_{i} = [__LEVEL__ * {i}, __DEBUG__, {i}]\n" for i in range(size))
+    _write(directory, "tables", assignments)
+    return _write(directory, "main", "import tables\n\nprint(tables.TABLE_0)\n")
@@ -1,5 +1,28 @@
-from . import errors, plugin
-from .compiler import Compiler
-from .options import CompilerOptions
+import importlib
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from . import errors, plugin
+    from .compiler import Compiler
+    from .options import CompilerOptions
 
 __all__ = ["plugin", "errors", "Compiler", "CompilerOptions"]
+
+# the exports are imported when they're first used so small entry points (like
+# the client for `python-combiner serve`) don't pay for importing the compiler
+_EXPORT_MODULES = {
+    "plugin": ".plugin",
+    "errors": ".errors",
+    "Compiler": ".compiler",
+    "CompilerOptions": ".options",
+}
+
+
+def __getattr__(name: str):
+    module_name = _EXPORT_MODULES.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module = importlib.import_module(module_name, __name__)
+    value = module if module_name == f".{name}" else getattr(module, name)
+    globals()[name] = value
+    return value
@@ -0,0 +1,99 @@
+import asyncio
+from concurrent.futures import Executor
+
+from .errors import CompilerError
+from .options import CompilerOptions
+from .processedmodule import (ModuleLocation, ProcessedModule,
+                              ResolutionCache, resolution_key)
+from .stats import CompilerStats, measure
+
+
+def _read(location: ModuleLocation, options: CompilerOptions, collect_stats: bool) -> tuple[str | None, CompilerStats | None]:
+    """ returns the source of `location` (or None if it can't be read) and the stats of reading it """
+    stats = CompilerStats() if collect_stats else None
+    try:
+        with measure(stats, "read"):
+            return location.read(options.source_provider), stats
+    except CompilerError:
+        return None, stats
+
+
+def _process(source: str, location: ModuleLocation, options: CompilerOptions, collect_stats: bool) -> tuple[ProcessedModule | None, CompilerStats | None]:
+    """ returns the processed module (or None if it failed) and the stats of processing it """
+    stats = CompilerStats() if collect_stats else None
+    try:
+        return ProcessedModule(source, location.path, location.module, options, stats=stats), stats
+    except CompilerError:
+        return None, stats
+
+
+async def prefetch_dependencies(main_processed_module: ProcessedModule, options: CompilerOptions, cache: ResolutionCache, executor: Executor | None, process_executor: Executor) -> None:
+    """
+    processes every module reachable from `main_processed_module` and stores
+    them in `cache`.
+
+    each import is handled by its own task: it's located with
+    `ProcessedModule.locate_async`, its file is read in `executor` concurrently
+    with the other imports, and it's parsed and passed through the plugins in
+    `process_executor`, whose tasks shouldn't run concurrently since plugins
+    may keep state. modules which fail to be processed are skipped, and their
+    locations are kept in `cache` so the serial discovery which follows raises
+    the error without resolving them again (plugins may only resolve them
+    asynchronously).
+    """
+    loop = asyncio.get_running_loop()
+    stats = cache.stats
+    collect_stats = stats is not None
+    # the processed paths which are (or were) being processed, so a module
+    # imported by several others is only read once, to the other keys which
+    # resolved to them while they were processed
+    started: dict[str, list[tuple[str, str]]] = {}
+
+    def merge(task_stats: CompilerStats | None) -> None:
+        if stats is not None and task_stats is not None:
+            stats.merge(task_stats)
+
+    async def prefetch(module: ProcessedModule, name: str) -> None:
+        key = resolution_key(name, module.path, options)
+        resolved_path = cache.resolved_paths.get(key)
+        if resolved_path is not None and resolved_path in cache.modules:
+            return
+        try:
+            location = await ProcessedModule.locate_async(
+                name, module.path, options, cache, executor)
+        except CompilerError:
+            return
+        path = location.processed_path
+        if path in cache.modules:
+            cache.resolved_paths[key] = path
+            return
+        if path in started:
+            # the discovery finds the module through this key once it's stored
+            started[path].append(key)
+            return
+        started[path] = []
+
+        if location.origin is None and location.source is None:
+            processed_module = cache.get_or_create(key, path, lambda: ProcessedModule(
+                None, location.path, location.module, options, stats=stats))
+        else:
+            source, read_stats = await loop.run_in_executor(executor, _read, location, options, collect_stats)
+            merge(read_stats)
+            if source is None:
+                cache.locations[key] = location
+                return
+            result, process_stats = await loop.run_in_executor(
+                process_executor, _process, source, location, options, collect_stats)
+            merge(process_stats)
+            if result is None:
+                cache.locations[key] = location
+                return
+            processed_module = cache.get_or_create(key, path, lambda: result)
+        for other_key in started[path]:
+            cache.resolved_paths[other_key] = path
+        for item in processed_module.imports:
+            group.create_task(prefetch(processed_module, item.module))
+
+    async with asyncio.TaskGroup() as group:
+        for item in main_processed_module.imports:
+            group.create_task(prefetch(main_processed_module, item.module))
@@ -0,0 +1,108 @@
+import os
+import tempfile
+import unittest
+from collections.abc import Callable, Iterator
+from types import CodeType
+from typing import TextIO
+
+from .compiler import Compiler
+from .options import CompilerOptions
+from .processedmodule import ResolutionCache
+from .stats import CompilerStats, measure
+
+
+class BatchCompiler:
+    """ Compiles several entry points which share modules into one bundle each
+
+    Every entry point is compiled with the same `ResolutionCache`, so a module
+    imported by many of them is only resolved, parsed and transformed once and
+    its generated factory is reused by every bundle including it. Building many
+    bundles from the same source tree costs about as much as building the union
+    of their modules.
+
+    Tree shaking removes different parts of a module depending on the entry
+    point, so when it's enabled only resolution is shared between them.
+    """
+    entry_points: dict[str, str]
+    options: CompilerOptions
+    cache: ResolutionCache
+
+    def __init__(self, entry_points: dict[str, str], options: CompilerOptions = CompilerOptions(), cache: ResolutionCache | None = None, stats: CompilerStats | None = None) -> None:
+        """ `entry_points` maps the path of each main module to its source """
+        self.entry_points = entry_points
+        self.options = options
+        self.cache = cache if cache is not None else ResolutionCache(
+            source_provider=options.source_provider)
+        if stats is not None:
+            self.cache.stats = stats
+
+    @property
+    def stats(self) -> CompilerStats | None:
+        return self.cache.stats
+
+    def _compilers(self) -> Iterator[tuple[str, Compiler]]:
+        for path, source in self.entry_points.items():
+            cache = self.cache
+            if self.options.tree_shaking or self.options.constant_propagation:
+                cache = ResolutionCache(self.cache.stats)
+                cache.resolver = self.cache.resolver
+            yield path, Compiler(source, path, self.options, cache)
+
+    def __call__(self) -> dict[str, str]:
+        """ returns the bundle of each entry point, keyed by its path """
+        outputs: dict[str, str] = {}
+        with measure(self.stats, "batch"):
+            for path, compiler in self._compilers():
+                outputs[path] = compiler()
+        return outputs
+
+    def compile(self) -> dict[str, CodeType]:
+        """ returns the bundle of each entry point compiled to a code object (see `Compiler.compile`) """
+        outputs: dict[str, CodeType] = {}
+        with measure(self.stats, "batch"):
+            for path, compiler in self._compilers():
+                outputs[path] = compiler.compile()
+        return outputs
+
+    def write(self, open_output: Callable[[str], TextIO]) -> None:
+        """
+        writes the bundle of each entry point to the stream returned by
+        `open_output` with its path (see `Compiler.write`), closing it
+        afterwards. the bundles are written as they're generated.
+        """
+        with measure(self.stats, "batch"):
+            for path, compiler in self._compilers():
+                with open_output(path) as output:
+                    compiler.write(output)
+
+
+class BatchCompilerTestMethods(unittest.TestCase):
+    def test_shared_modules_processed_once(self):
+        from .testing import VirtualModulesPlugin
+        options = CompilerOptions(plugins=[VirtualModulesPlugin({
+            "shared": "import other\nx = other.y",
+            "other": "y = 1",
+        })])
+        entry_points = {
+            "/virtual/a.py": "import shared\nprint(shared.x)",
+            "/virtual/b.py": "import shared\nimport other\nprint(other.y)",
+        }
+        batch = BatchCompiler(entry_points, options)
+        outputs = batch()
+        self.assertEqual(batch.cache.parse_count, 2)
+        for path, source in entry_points.items():
+            self.assertEqual(outputs[path], Compiler(source, path, options)())
+
+        with tempfile.TemporaryDirectory() as directory:
+            def output_path(path: str) -> str:
+                return os.path.join(directory, os.path.basename(path))
+
+            BatchCompiler(entry_points, options).write(
+                lambda path: open(output_path(path), "w"))
+            for path in entry_points:
+                with open(output_path(path)) as file:
+                    self.assertEqual(file.read(), outputs[path])
+
+
+if __name__ == "__main__":
+    unittest.main()
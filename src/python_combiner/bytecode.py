@@ -0,0 +1,70 @@
+import importlib.util
+import marshal
+import sys
+import zipfile
+from types import CodeType
+from typing import BinaryIO
+
+# bytecode only runs on the Python version which compiled it
+DEFAULT_INTERPRETER = f"/usr/bin/env python{sys.version_info.major}.{sys.version_info.minor}"
+# PEP 552 flags of a hash-based .pyc which isn't checked against its source
+_UNCHECKED_HASH_BASED_FLAGS = 0b01
+# the earliest date a zip file can hold, so archives are the same every build
+_ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+
+def _with_filename(code: CodeType, filename: str) -> CodeType:
+    return code.replace(
+        co_filename=filename,
+        co_consts=tuple(
+            _with_filename(const, filename) if isinstance(
+                const, CodeType) else const
+            for const in code.co_consts
+        ))
+
+
+def replace_filenames(code: CodeType, filenames: dict[str, str]) -> CodeType:
+    """
+    sets the filename of the functions defined at the top level of `code`
+    whose name is in `filenames` (and of all the code inside them) to the name
+    it's mapped to.
+    """
+    return code.replace(co_consts=tuple(
+        _with_filename(const, filenames[const.co_name])
+        if isinstance(const, CodeType) and const.co_name in filenames else const
+        for const in code.co_consts
+    ))
+
+
+def pyc_data(code: CodeType) -> bytes:
+    """
+    returns the contents of a `.pyc` file holding `code`. the file is
+    hash-based and unchecked (see PEP 552) since there's no source file to
+    check it against, so building the same code always gives the same file. it
+    can only be run by the Python version which wrote it.
+    """
+    data = marshal.dumps(code)
+    return (importlib.util.MAGIC_NUMBER
+            + _UNCHECKED_HASH_BASED_FLAGS.to_bytes(4, "little")
+            + importlib.util.source_hash(data)
+            + data)
+
+
+def write_pyc(code: CodeType, stream: BinaryIO) -> None:
+    """ writes `code` to `stream` as a `.pyc` file, which can be run with `python file.pyc` """
+    stream.write(pyc_data(code))
+
+
+def write_zipapp(code: CodeType, stream: BinaryIO, interpreter: str | None = DEFAULT_INTERPRETER) -> None:
+    """
+    writes an executable zip archive (like the `zipapp` module creates) which
+    runs `code` as its `__main__` module. the archive starts with a shebang
+    line for `interpreter` unless it's None.
+    """
+    if interpreter is not None:
+        stream.write(b"#!" + interpreter.encode(sys.getfilesystemencoding())
+                     + b"\n")
+    with zipfile.ZipFile(stream, "w") as archive:
+        # stored uncompressed so it's loaded as quickly as possible
+        archive.writestr(zipfile.ZipInfo("__main__.pyc", _ZIP_DATE_TIME),
+                         pyc_data(code))
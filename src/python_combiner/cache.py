@@ -0,0 +1,360 @@
+import ast
+import functools
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
+import unittest
+import unittest.mock
+from collections import OrderedDict
+from importlib import metadata
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    # only import these for the types because `options.py` depends on this file
+    from .plugin import Plugin
+
+CACHE_FILE_EXTENSION = ".pickle"
+DEFAULT_CACHE_MAX_SIZE = 256 * 1024 * 1024
+
+
+@functools.cache
+def get_compiler_version() -> str:
+    """
+    returns the installed version of the compiler along with a hash of its
+    sources, so cached entries don't outlive changes to a checkout or an
+    editable install, which keep the same version (or have none). the sources
+    are only hashed the first time a cache key is computed, so builds without
+    a cache don't read them.
+    """
+    try:
+        version = metadata.version("python-combiner")
+    except metadata.PackageNotFoundError:
+        version = "unknown"
+    digest = hashlib.sha256(usedforsecurity=False)
+    package_directory = os.path.dirname(os.path.abspath(__file__))
+    for directory, subdirectories, files in os.walk(package_directory):
+        subdirectories.sort()
+        for name in sorted(files):
+            if not name.endswith(".py"):
+                continue
+            path = os.path.join(directory, name)
+            digest.update(os.path.relpath(
+                path, package_directory).encode("utf-8", "surrogatepass"))
+            digest.update(b"\0")
+            try:
+                with open(path, "rb") as file:
+                    digest.update(file.read())
+            except OSError:
+                pass
+            digest.update(b"\0")
+    return f"{version}+{digest.hexdigest()[:16]}"
+
+
+def get_default_cache_dir() -> str:
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "python-combiner")
+
+
+def plugins_fingerprint(plugins: "list[Plugin]") -> str | None:
+    """
+    combines the cache keys of all plugins into one string, or returns None if
+    any of the plugins can't be cached.
+    """
+    parts: list[str] = []
+    for plugin in plugins:
+        key = plugin.cache_key()
+        if key is None:
+            return None
+        parts.append(
+            f"{type(plugin).__module__}.{type(plugin).__qualname__}:{key}")
+    return "\n".join(parts)
+
+
+def module_cache_key(source: str, path: str, plugins: "list[Plugin]") -> str | None:
+    """
+    computes the key a processed module is stored under. this covers the
+    module's source and path, the compiler's version and sources, the Python
+    version (since the AST format changes between versions), and the plugin
+    configuration.
+    """
+    fingerprint = plugins_fingerprint(plugins)
+    if fingerprint is None:
+        return None
+    digest = hashlib.sha256(usedforsecurity=False)
+    for part in (get_compiler_version(), sys.version, fingerprint, path, source):
+        digest.update(part.encode("utf-8", "surrogatepass"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def factory_cache_key(module_key: str, *options: object) -> str:
+    """
+    computes the key the unparsed factory of the module stored under
+    `module_key` is stored under, given the compiler options the factory
+    depends on.
+    """
+    digest = hashlib.sha256(usedforsecurity=False)
+    for part in (module_key, *(repr(option) for option in options)):
+        digest.update(part.encode("utf-8", "surrogatepass"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class ParseCache:
+    """ Stores modules after they've been parsed and passed through `hook_module`
+
+    It also stores fragments of generated code (the unparsed factory of each
+    module), so they don't need to be generated again by later builds. The base
+    class doesn't cache anything.
+    """
+
+    def load(self, key: str) -> ast.Module | None:
+        return None
+
+    def store(self, key: str, module: ast.Module) -> None:
+        pass
+
+    def load_fragment(self, key: str) -> str | None:
+        return None
+
+    def store_fragment(self, key: str, fragment: str) -> None:
+        pass
+
+
+class MemoryParseCache(ParseCache):
+    """ A `ParseCache` keeping pickled ASTs in memory, in front of another cache
+
+    Modules are kept pickled since the compiler transforms the ASTs it gets in
+    place, so every load needs a fresh copy. Entries which aren't in memory are
+    loaded from `fallback` (if any), and stores go to both. The least recently
+    used entries are evicted to keep the cache under `max_size` bytes.
+    """
+    max_size: int
+    fallback: ParseCache | None
+    _entries: OrderedDict[str, bytes]
+    _size: int
+
+    def __init__(self, max_size: int = DEFAULT_CACHE_MAX_SIZE, fallback: ParseCache | None = None) -> None:
+        self.max_size = max_size
+        self.fallback = fallback
+        self._entries = OrderedDict()
+        self._size = 0
+
+    def load(self, key: str) -> ast.Module | None:
+        module = self._load(key)
+        if module is None and self.fallback is not None:
+            module = self.fallback.load(key)
+            if module is not None:
+                self._remember(key, module)
+        return module if isinstance(module, ast.Module) else None
+
+    def store(self, key: str, module: ast.Module) -> None:
+        self._remember(key, module)
+        if self.fallback is not None:
+            self.fallback.store(key, module)
+
+    def load_fragment(self, key: str) -> str | None:
+        fragment = self._load(key)
+        if fragment is None and self.fallback is not None:
+            fragment = self.fallback.load_fragment(key)
+            if fragment is not None:
+                self._remember(key, fragment)
+        return fragment if isinstance(fragment, str) else None
+
+    def store_fragment(self, key: str, fragment: str) -> None:
+        self._remember(key, fragment)
+        if self.fallback is not None:
+            self.fallback.store_fragment(key, fragment)
+
+    def _load(self, key: str) -> object:
+        data = self._entries.get(key)
+        if data is None:
+            return None
+        self._entries.move_to_end(key)
+        return pickle.loads(data)
+
+    def _remember(self, key: str, value: ast.Module | str) -> None:
+        try:
+            data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, RecursionError):
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._size -= len(previous)
+        self._entries[key] = data
+        self._size += len(data)
+        while self._size > self.max_size and len(self._entries) > 0:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._size = 0
+
+
+class DiskParseCache(ParseCache):
+    """ A `ParseCache` persisting pickled ASTs (and fragments) in a directory
+
+    The directory is kept under `max_size` bytes by evicting the least recently
+    used entries, using the file modification time as the last use time.
+    """
+    directory: str
+    max_size: int
+    _size: int | None
+
+    def __init__(self, directory: str, max_size: int = DEFAULT_CACHE_MAX_SIZE) -> None:
+        self.directory = directory
+        self.max_size = max_size
+        # the total size of the directory, computed when it's first needed
+        self._size = None
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.directory, key + CACHE_FILE_EXTENSION)
+
+    def load(self, key: str) -> ast.Module | None:
+        module = self._load(key)
+        return module if isinstance(module, ast.Module) else None
+
+    def store(self, key: str, module: ast.Module) -> None:
+        self._store(key, module)
+
+    def load_fragment(self, key: str) -> str | None:
+        fragment = self._load(key)
+        return fragment if isinstance(fragment, str) else None
+
+    def store_fragment(self, key: str, fragment: str) -> None:
+        self._store(key, fragment)
+
+    def _load(self, key: str) -> object:
+        path = self._entry_path(key)
+        try:
+            with open(path, "rb") as file:
+                value = pickle.load(file)
+            # mark the entry as recently used
+            os.utime(path)
+        except OSError:
+            return None
+        except Exception:
+            # the entry is corrupt or was written by an incompatible version
+            self._remove(path)
+            return None
+        return value
+
+    def _store(self, key: str, value: ast.Module | str) -> None:
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            # write to a temporary file first so concurrent builds never see a
+            # partially-written entry
+            fd, temp_path = tempfile.mkstemp(
+                dir=self.directory, suffix=".tmp")
+        except (OSError, pickle.PicklingError, RecursionError):
+            return
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(data)
+            os.replace(temp_path, self._entry_path(key))
+        except OSError:
+            self._remove(temp_path)
+            return
+        except BaseException:
+            # e.g. interrupted, so don't leave the temporary file behind either
+            self._remove(temp_path)
+            raise
+        if self._size is None:
+            self._size = self._directory_size()
+        else:
+            self._size += len(data)
+        if self._size > self.max_size:
+            self.evict()
+
+    def _remove(self, path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _entries(self) -> list[os.DirEntry]:
+        try:
+            with os.scandir(self.directory) as entries:
+                return [entry for entry in entries
+                        if entry.name.endswith(CACHE_FILE_EXTENSION) and entry.is_file()]
+        except OSError:
+            return []
+
+    def _entry_stats(self) -> list[tuple[float, int, str]]:
+        """ returns the modification time, size and path of each entry """
+        stats: list[tuple[float, int, str]] = []
+        for entry in self._entries():
+            try:
+                stat = entry.stat()
+            except OSError:
+                # removed by another build in the meantime
+                continue
+            stats.append((stat.st_mtime, stat.st_size, entry.path))
+        return stats
+
+    def _directory_size(self) -> int:
+        return sum(entry_size for _, entry_size, _ in self._entry_stats())
+
+    def evict(self) -> None:
+        """ removes the least recently used entries until the cache fits in `max_size` """
+        entries = sorted(self._entry_stats())
+        size = sum(entry_size for _, entry_size, _ in entries)
+        for _, entry_size, path in entries:
+            if size <= self.max_size:
+                break
+            self._remove(path)
+            size -= entry_size
+        self._size = size
+
+    def clear(self) -> None:
+        for entry in self._entries():
+            self._remove(entry.path)
+        self._size = 0
+
+
+class DiskParseCacheTestMethods(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_store_and_load(self):
+        cache = DiskParseCache(self.directory.name)
+        cache.store_fragment("key", "fragment")
+        self.assertEqual(cache.load_fragment("key"), "fragment")
+        self.assertIsNone(cache.load("key"))
+
+    def test_compiler_version(self):
+        # the sources are part of the version even when it isn't installed
+        self.assertNotEqual(get_compiler_version().split("+")[-1], "")
+        self.assertIs(get_compiler_version(), get_compiler_version())
+
+    def test_evict_removed_entry(self):
+        cache = DiskParseCache(self.directory.name)
+        cache.store_fragment("key", "fragment")
+        entries = cache._entries()
+        cache.max_size = 0
+        # another build removes the entry after it was listed
+        os.remove(entries[0].path)
+        with unittest.mock.patch.object(cache, "_entries", return_value=entries):
+            cache.evict()
+            self.assertEqual(cache._directory_size(), 0)
+
+    def test_failed_store(self):
+        cache = DiskParseCache(self.directory.name)
+        # the entry can't be replaced by a file
+        os.makedirs(os.path.join(self.directory.name,
+                    "key" + CACHE_FILE_EXTENSION, "child"))
+        cache.store_fragment("key", "fragment")
+        self.assertEqual([name for name in os.listdir(self.directory.name) if name.endswith(".tmp")],
+                         [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,13 +1,31 @@
 import argparse
+import io
 import json
 import os
+import stat
 import sys
 import time
+from collections.abc import Callable
+from types import CodeType
+from typing import TYPE_CHECKING, TextIO
 
-from python_combiner import Compiler, CompilerOptions, errors, plugin
+from python_combiner import (Compiler, CompilerOptions, bytecode, errors,
+                             plugin)
+from python_combiner.batch import BatchCompiler
+from python_combiner.cache import DiskParseCache, get_default_cache_dir
+from python_combiner.client import get_default_socket_path
+from python_combiner.incremental import IncrementalCompiler
+from python_combiner.stats import CompilerStats
+
+if TYPE_CHECKING:
+    from python_combiner.server import Session
 
 DEFAULT_FILE_NAME = "__stdin__.py"
 PROG_NAME = "python-combiner"
+OUTPUT_FORMAT_EXTENSIONS = {
+    "pyc": ".pyc",
+    "zipapp": ".pyz",
+}
 
 
 def format_error(name: str, msg: str, output_json: bool = False):
@@ -25,18 +43,176 @@ def format_compiler_error(error: errors.CompilerError, output_json: bool = False
     return format_error(error.errcode, str(error), output_json)
 
 
-def main(argv: list[str] | None = None):
+def format_status(msg: str, output_json: bool = False):
+    if output_json:
+        return json.dumps({
+            "error": False,
+            "msg": msg
+        })
+    else:
+        return f"{errors._terminal_colors.BOLD}{PROG_NAME}:{errors._terminal_colors.ENDC} {msg}"
+
+
+class JsonStringWriter(io.TextIOBase):
+    """ Writes what's written to it to `output` as the `output` string of a json object
+
+    The text is escaped as it's written, so the output doesn't need to be kept
+    in memory to be encoded. Nothing is written until the first write, and the
+    object is closed when the writer is (unless it's discarded).
+    """
+    output: TextIO
+    started: bool
+    discarded: bool
+
+    def __init__(self, output: TextIO) -> None:
+        self.output = output
+        self.started = False
+        self.discarded = False
+
+    def writable(self) -> bool:
+        return True
+
+    def _start(self) -> None:
+        if not self.started:
+            self.output.write('{"output": "')
+            self.started = True
+
+    def write(self, data: str) -> int:
+        self._start()
+        # the same escaping as `json.dumps`, without the quotes
+        self.output.write(json.dumps(data)[1:-1])
+        return len(data)
+
+    def close(self) -> None:
+        if not self.closed and not self.discarded:
+            self._start()
+            self.output.write('"}')
+        super().close()
+
+    def discard(self) -> None:
+        """ closes the writer without finishing the object """
+        self.discarded = True
+        self.close()
+
+
+def write_output(output: TextIO, write: Callable[[TextIO], None], output_json: bool = False):
+    """ calls `write` with the stream the output should be written to """
+    if output_json and output.name == "<stdout>":
+        json_output = JsonStringWriter(output)
+        try:
+            write(json_output)
+        except BaseException:
+            # only the error is printed if the build fails
+            json_output.discard()
+            raise
+        json_output.close()
+    else:
+        write(output)
+
+
+def write_code(path: str, code: CodeType, output_format: str):
+    """ writes compiled output to `path` as a .pyc file or an executable zipapp """
+    with open(path, "wb") as output:
+        if output_format == "zipapp":
+            bytecode.write_zipapp(code, output)
+        else:
+            bytecode.write_pyc(code, output)
+    if output_format == "zipapp":
+        # make it executable like `zipapp` does
+        os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+
+
+def get_output_name(input_name: str, output_format: str) -> str:
+    """ returns the name of the file the output of `input_name` is written to in --output-dir """
+    name = os.path.basename(input_name)
+    if output_format in OUTPUT_FORMAT_EXTENSIONS:
+        name = os.path.splitext(name)[0] + \
+            OUTPUT_FORMAT_EXTENSIONS[output_format]
+    return name
+
+
+def write_stats(stats: CompilerStats, profile: bool, stats_json: TextIO | None):
+    if profile:
+        print(stats.format_table(), file=sys.stderr)
+    if stats_json is not None:
+        with stats_json:
+            json.dump(stats.to_dict(), stats_json, indent=2)
+
+
+def watch(compiler: IncrementalCompiler, output: TextIO, interval: float, output_json: bool = False):
+    """ rebuilds whenever one of the compiled files changes, until interrupted """
+    while True:
+        start = time.perf_counter()
+        try:
+            merged = compiler()
+        except errors.CompilerError as err:
+            print(format_compiler_error(err, output_json), file=sys.stderr)
+        except plugin.constants.AssignmentToConstantError as err:
+            print(
+                format_error("assignment-to-constant", str(err), output_json),
+                file=sys.stderr)
+        else:
+            output.seek(0)
+            output.truncate()
+            output.write(merged)
+            output.flush()
+            print(
+                format_status(
+                    f"built {len(compiler.dependency_tree_modules)} modules in {(time.perf_counter() - start) * 1000:.0f}ms", output_json),
+                file=sys.stderr)
+        try:
+            while not compiler.poll():
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            return
+
+
+def serve_main(argv: list[str]):
+    from python_combiner.server import serve
+
+    parser = argparse.ArgumentParser(
+        prog=f"{PROG_NAME} serve",
+        description="Keeps a compiler running in the background so builds don't pay for starting up. "
+        "Run builds through it with python-combiner-client, which takes the same arguments as python-combiner.")
+    parser.add_argument("--socket",
+                        default=get_default_socket_path(),
+                        help="the path of the Unix socket to listen on")
+    args = parser.parse_args(argv)
+    try:
+        print(format_status(f"listening on {args.socket}"), file=sys.stderr)
+        serve(args.socket)
+    except OSError as err:
+        print(format_error("serve", str(err)), file=sys.stderr)
+        sys.exit(1)
+    except KeyboardInterrupt:
+        pass
+
+
+def main(argv: list[str] | None = None, session: "Session | None" = None):
+    """
+    runs the CLI. `session` is given when running in a server, to reuse its
+    caches between builds.
+    """
     if argv is None:
         argv = sys.argv[1:]
+    if len(argv) > 0 and argv[0] == "serve" and session is None:
+        return serve_main(argv[1:])
     parser = argparse.ArgumentParser(
         prog=PROG_NAME,
         description="Compiles/merges Python files.")
-    parser.add_argument("-i", "--input", required=True,
+    parser.add_argument("-i", "--input", required=True, nargs="+",
                         type=argparse.FileType('r'),
-                        help="the input file, can be - for stdin")
+                        help="the input file, can be - for stdin. several input files can be given along with --output-dir to compile each of them, sharing the work for the modules they have in common")
     parser.add_argument("-o", "--output", nargs="?",
                         type=argparse.FileType('w'), default=sys.stdout,
                         help="the output file. Defaults to stdout")
+    parser.add_argument("--output-dir",
+                        default=None,
+                        help="the directory to write the output of each input file to, named after the input file")
+    parser.add_argument("--output-format",
+                        default="source",
+                        choices=["source", "pyc", "zipapp"],
+                        help="'source' writes Python code. 'pyc' writes compiled bytecode which can be run with `python output.pyc` without being compiled on startup, and 'zipapp' writes an executable zip archive containing it. bytecode can only be run by the Python version which built it")
     parser.add_argument("--ignore-imports", nargs="+",
                         default=[],
                         help="modules for which to ignore transforming imports for (i.e., leave them untouched)")
@@ -56,6 +232,10 @@ def main(argv: list[str] | None = None):
                         help="equivalent to defining a constant to be 1 using --define-constant.")
     parser.add_argument("-m", "--minify", action=argparse.BooleanOptionalAction,
                         help="minifies the result")
+    parser.add_argument("--minify-jobs",
+                        type=int,
+                        default=None,
+                        help="with --minify, minifies each module separately using this many processes instead of minifying the whole result at once, which is much faster for large results. the result is slightly bigger since top-level names aren't shortened")
     parser.add_argument("-j", "--json", action=argparse.BooleanOptionalAction,
                         help="outputs messages as json")
     parser.add_argument("-t", "--time", action=argparse.BooleanOptionalAction,
@@ -76,6 +256,43 @@ def main(argv: list[str] | None = None):
                         default="locals",
                         choices=["locals", "static"],
                         help="how module exports are determined. use 'locals' for compatibility with existing code. forced to 'static' if --export-dictionary-mode is set to 'class' or 'class_instance'")
+    parser.add_argument("--evaluation-mode",
+                        default="eager",
+                        choices=["eager", "lazy"],
+                        help="when modules are run. 'eager' runs every module at startup like regular imports, 'lazy' only runs a module once something it exports is first used")
+    parser.add_argument("--circular-imports",
+                        default="error",
+                        choices=["error", "deferred"],
+                        help="what to do with modules which import each other. 'error' fails the build, 'deferred' bundles them by creating their modules up front and running each of them when it's first imported, like Python does")
+    parser.add_argument("--tree-shake", action=argparse.BooleanOptionalAction,
+                        help="removes top-level functions, classes and modules which are never used from the output")
+    parser.add_argument("--propagate-constants", action=argparse.BooleanOptionalAction,
+                        help="inlines module-level constants (like `DEBUG = False`) into the modules importing them, removing the branches which become dead")
+    parser.add_argument("--cache", action=argparse.BooleanOptionalAction,
+                        default=True,
+                        help="caches parsed modules and the code generated for them on disk to speed up later builds. --no-cache to always process modules from scratch")
+    parser.add_argument("--cache-dir",
+                        default=get_default_cache_dir(),
+                        help="the directory to store the module cache in")
+    parser.add_argument("--cache-size",
+                        type=int,
+                        default=256,
+                        help="the maximum size of the module cache in megabytes. the least recently used modules are evicted first")
+    parser.add_argument("--jobs",
+                        type=int,
+                        default=1,
+                        help="the number of processes to use for processing modules")
+    parser.add_argument("--profile", action=argparse.BooleanOptionalAction,
+                        help="prints how long each phase of the build took to stderr")
+    parser.add_argument("--stats-json",
+                        type=argparse.FileType('w'), default=None,
+                        help="writes the time spent in each phase of the build and the size of each module to a file as json")
+    parser.add_argument("-w", "--watch", action=argparse.BooleanOptionalAction,
+                        help="keeps running and rebuilds the output whenever one of the input files changes. requires an input and an output file")
+    parser.add_argument("--watch-interval",
+                        type=float,
+                        default=0.5,
+                        help="how often to check for changed files when watching, in seconds")
     args = parser.parse_args(argv)
     constants: dict[str, bool | str | int | float] = {
         "__COMPILED__": True
@@ -99,6 +316,12 @@ def main(argv: list[str] | None = None):
         "%a, %d %b %Y %H:%M:%S", time.localtime())) if args.time else ""
     if args.json:
         errors.set_json_output(True)
+    if args.minify_jobs is not None and not args.minify:
+        print(
+            format_error(
+                "minify", "--minify-jobs requires --minify", args.json),
+            file=sys.stderr)
+        sys.exit(1)
     if args.minify:
         try:
             import python_minifier  # type: ignore
@@ -108,46 +331,142 @@ def main(argv: list[str] | None = None):
                     "missing-dependency", "python-minifier is required for minification", args.json),
                 file=sys.stderr)
             sys.exit(1)
-    with args.input as input:
-        try:
-            plugins: list[plugin.Plugin] = []
-            plugins.append(plugin.ConstantsPlugin(constants=constants))
-            plugins.append(plugin.SimplifyIfPlugin())
-            if args.prelude is not None:
-                plugins.append(plugin.PreludePlugin(prelude=args.prelude))
-            if args.minify:
-                plugins.append(plugin.MinifyPlugin())
-            merged = Compiler(
-                source=input.read(),
-                path=os.path.join(os.getcwd(),
-                                  input.name if input.name != "<stdin>" else DEFAULT_FILE_NAME),
-                options=CompilerOptions(
-                    ignore_imports=args.ignore_imports,
-                    remove_imports=args.remove_imports,
-                    docstring=f""" Generated by {PROG_NAME}{
-                        current_time} """ if args.docstring else None,
-                    export_dictionary_mode=args.export_dictionary_mode,
-                    export_names_mode=args.export_names_mode,
-                    short_generated_names=args.minify,
-                    hash_length=args.module_hash_length,
-                    plugins=plugins
-                ))()
-            if args.json:
-                if args.output.name == "<stdout>":
-                    args.output.write(json.dumps({
-                        "output": merged
-                    }))
-                else:
-                    args.output.write(merged)
-            else:
-                args.output.write(merged)
-        except errors.CompilerError as err:
+    if len(args.input) > 1 and args.output_dir is None:
+        print(
+            format_error(
+                "batch", "--output-dir is required when compiling several input files", args.json),
+            file=sys.stderr)
+        sys.exit(1)
+    if args.output_dir is not None:
+        output_names = [get_output_name(input.name, args.output_format)
+                        for input in args.input]
+        if any(input.name == "<stdin>" for input in args.input) or args.watch:
             print(
-                format_compiler_error(err, args.json),
+                format_error(
+                    "batch", "--output-dir can't be used with stdin or --watch", args.json),
                 file=sys.stderr)
             sys.exit(1)
-        except plugin.constants.AssignmentToConstantError as err:
+        if len(set(output_names)) < len(output_names):
             print(
-                format_error("assignment-to-constant", str(err), args.json),
+                format_error(
+                    "batch", "input files would be written to the same file in --output-dir since they have the same name", args.json),
                 file=sys.stderr)
             sys.exit(1)
+    input = args.input[0]
+    if args.watch and (input.name == "<stdin>" or args.output.name == "<stdout>"):
+        print(
+            format_error(
+                "watch", "--watch requires an input file and an output file", args.json),
+            file=sys.stderr)
+        sys.exit(1)
+    if args.watch and session is not None:
+        print(
+            format_error(
+                "watch", "--watch can't be used through the server", args.json),
+            file=sys.stderr)
+        sys.exit(1)
+    if args.watch and args.tree_shake:
+        print(
+            format_error(
+                "watch", "--watch can't be used with --tree-shake", args.json),
+            file=sys.stderr)
+        sys.exit(1)
+    if args.watch and args.propagate_constants:
+        print(
+            format_error(
+                "watch", "--watch can't be used with --propagate-constants", args.json),
+            file=sys.stderr)
+        sys.exit(1)
+    if args.watch and (args.profile or args.stats_json is not None):
+        print(
+            format_error(
+                "watch", "--watch can't be used with --profile or --stats-json", args.json),
+            file=sys.stderr)
+        sys.exit(1)
+    if args.output_format != "source" and (args.watch or (args.output_dir is None and args.output.name == "<stdout>")):
+        print(
+            format_error(
+                "output-format", f"--output-format {args.output_format} requires an output file or --output-dir, and can't be used with --watch", args.json),
+            file=sys.stderr)
+        sys.exit(1)
+    sources: dict[str, str] = {}
+    for input in args.input:
+        with input:
+            path = os.path.join(os.getcwd(),
+                                input.name if input.name != "<stdin>" else DEFAULT_FILE_NAME)
+            sources[path] = input.read()
+    try:
+        plugins: list[plugin.Plugin] = []
+        plugins.append(plugin.ConstantsPlugin(constants=constants))
+        plugins.append(plugin.SimplifyIfPlugin())
+        if args.prelude is not None:
+            plugins.append(plugin.PreludePlugin(prelude=args.prelude))
+        if args.minify:
+            plugins.append(plugin.MinifyPlugin(jobs=args.minify_jobs))
+        parse_cache = DiskParseCache(
+            args.cache_dir, args.cache_size * 1024 * 1024) if args.cache else None
+        cache = None
+        if session is not None:
+            if parse_cache is not None:
+                parse_cache = session.create_parse_cache(parse_cache)
+            cache = session.create_resolution_cache()
+        options = CompilerOptions(
+            ignore_imports=args.ignore_imports,
+            remove_imports=args.remove_imports,
+            docstring=f""" Generated by {PROG_NAME}{
+                current_time} """ if args.docstring else None,
+            export_dictionary_mode=args.export_dictionary_mode,
+            export_names_mode=args.export_names_mode,
+            evaluation_mode=args.evaluation_mode,
+            circular_imports=args.circular_imports,
+            tree_shaking=bool(args.tree_shake),
+            constant_propagation=bool(args.propagate_constants),
+            short_generated_names=args.minify,
+            hash_length=args.module_hash_length,
+            plugins=plugins,
+            jobs=args.jobs,
+            parse_cache=parse_cache
+        )
+        stats = CompilerStats() if args.profile or args.stats_json is not None else None
+        if args.watch:
+            watch(IncrementalCompiler(path, options, cache),
+                  args.output, args.watch_interval, args.json)
+        elif args.output_dir is not None:
+            os.makedirs(args.output_dir, exist_ok=True)
+            batch = BatchCompiler(sources, options, cache, stats)
+            if args.output_format == "source":
+                batch.write(lambda path: open(os.path.join(
+                    args.output_dir, get_output_name(path, args.output_format)), "w"))
+            else:
+                for path, code in batch.compile().items():
+                    write_code(os.path.join(args.output_dir, get_output_name(path, args.output_format)),
+                               code, args.output_format)
+        elif args.output_format != "source":
+            code = Compiler(
+                source=sources[path],
+                path=path,
+                options=options,
+                cache=cache,
+                stats=stats).compile()
+            # the file was opened for text by argparse
+            args.output.close()
+            write_code(args.output.name, code, args.output_format)
+        else:
+            write_output(args.output, Compiler(
+                source=sources[path],
+                path=path,
+                options=options,
+                cache=cache,
+                stats=stats).write, args.json)
+        if stats is not None:
+            write_stats(stats, args.profile, args.stats_json)
+    except errors.CompilerError as err:
+        print(
+            format_compiler_error(err, args.json),
+            file=sys.stderr)
+        sys.exit(1)
+    except plugin.constants.AssignmentToConstantError as err:
+        print(
+            format_error("assignment-to-constant", str(err), args.json),
+            file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,103 @@
+import json
+import os
+import socket
+import stat
+import sys
+import tempfile
+
+SOCKET_PATH_ENVIRONMENT_VARIABLE = "PYTHON_COMBINER_SOCKET"
+
+
+def get_default_socket_directory() -> str:
+    """ the directory, only accessible by the current user, holding the default socket """
+    base = os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir()
+    return os.path.join(base, f"python-combiner-{os.getuid()}")
+
+
+def get_default_socket_path() -> str:
+    path = os.environ.get(SOCKET_PATH_ENVIRONMENT_VARIABLE)
+    if path:
+        return path
+    return os.path.join(get_default_socket_directory(), "server.sock")
+
+
+def check_private(path: str, file_type: int) -> None:
+    """
+    raises an OSError unless `path` itself (not what it links to) is of
+    `file_type` (e.g. `stat.S_IFSOCK`), belongs to the current user and can't be
+    used by anyone else. other users could otherwise put a server there.
+    """
+    info = os.lstat(path)
+    if stat.S_IFMT(info.st_mode) != file_type:
+        raise OSError(f"{path} has the wrong file type")
+    if info.st_uid != os.getuid():
+        raise OSError(f"{path} belongs to another user")
+    if info.st_mode & 0o077:
+        raise OSError(f"{path} can be accessed by other users")
+
+
+def _reads_stdin(argv: list[str]) -> bool:
+    return any(arg == "-" or arg.endswith("=-") for arg in argv)
+
+
+def request(argv: list[str], socket_path: str | None = None) -> int | None:
+    """
+    runs the CLI with `argv` in the server listening at `socket_path`,
+    forwarding its output to this process's stdout and stderr. returns the exit
+    code, or None if no server is running.
+    """
+    if socket_path is None:
+        socket_path = get_default_socket_path()
+    try:
+        if os.path.dirname(socket_path) == get_default_socket_directory():
+            check_private(os.path.dirname(socket_path), stat.S_IFDIR)
+        check_private(socket_path, stat.S_IFSOCK)
+    except FileNotFoundError:
+        return None
+    except OSError as err:
+        print(f"not using the server: {err}", file=sys.stderr)
+        return None
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(socket_path)
+    except OSError:
+        connection.close()
+        return None
+    with connection, connection.makefile("rwb") as stream:
+        stdin = sys.stdin.read() if _reads_stdin(argv) else None
+        stream.write(json.dumps({
+            "argv": argv,
+            "cwd": os.getcwd(),
+            "stdin": stdin,
+            "isatty": sys.stdout.isatty(),
+            "search_path": sys.path[1:],
+        }).encode() + b"\n")
+        stream.flush()
+        for line in stream:
+            message = json.loads(line)
+            if "exit" in message:
+                return message["exit"]
+            output = sys.stdout if message["stream"] == "stdout" else sys.stderr
+            output.write(message["data"])
+            output.flush()
+    # the server went away without saying how the build ended
+    return 1
+
+
+def main(argv: list[str] | None = None):
+    """
+    runs the CLI through a running `python-combiner serve` process if there is
+    one, or in this process otherwise.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    exit_code = request(argv)
+    if exit_code is None:
+        from .cli import main as cli_main
+        cli_main(argv)
+    else:
+        sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,104 +1,999 @@
 import ast
+import asyncio
+import contextlib
+import copy
+import importlib.util
+import io
+import marshal
+import os
+import tempfile
+import traceback
+import unittest
 import warnings
+from collections.abc import Iterator
+from concurrent.futures import Executor, ThreadPoolExecutor
+from types import CodeType
+from typing import TextIO
 
-from . import exporthelper, graph
-from .errors import CircularDependencyError, NestedModuleRecursionError
+from . import (asynchronous, bytecode, constprop, exporthelper, graph,
+               parallel, transformers, treeshaker)
+from .cache import MemoryParseCache
+from .errors import (AsteriskImportError, CircularDependencyError,
+                     CompilerError, ModuleSyntaxError,
+                     NestedModuleRecursionError)
 from .options import CompilerOptions
-from .processedmodule import ProcessedModule
+from .plugin import Plugin, SimplifyIfPlugin
+from .processedmodule import ProcessedModule, ResolutionCache
+from .resolver import ModuleResolver
+from .sources import MemorySourceProvider
+from .stats import CompilerStats, measure
 
 
 class Compiler:
     source: str
     path: str
     options: CompilerOptions
+    cache: ResolutionCache
 
-    def __init__(self, source: str, path: str, options: CompilerOptions = CompilerOptions()) -> None:
+    def __init__(self, source: str, path: str, options: CompilerOptions = CompilerOptions(), cache: ResolutionCache | None = None, stats: CompilerStats | None = None) -> None:
+        """
+        `stats` collects the time spent in each phase of the compilation, and
+        is stored in `cache` (so it's shared by every compilation using it).
+        """
         self.source = source
         self.path = path
         self.options = options
+        self.cache = cache if cache is not None else ResolutionCache(
+            source_provider=options.source_provider)
+        if stats is not None:
+            self.cache.stats = stats
+
+    @property
+    def stats(self) -> CompilerStats | None:
+        return self.cache.stats
 
     def __call__(self) -> str:
         try:
+            with measure(self.stats, "total"):
+                dependency_tree_modules, dependency_tree_edges = self._build_dependency_tree(
+                    unparsed=True)
+                return self._generate_output(dependency_tree_modules, dependency_tree_edges)
+        except RecursionError:
+            raise NestedModuleRecursionError()
+
+    def write(self, stream: TextIO) -> None:
+        """ compiles the module like calling the compiler, writing the output to `stream`
+
+        Each statement of the output is written as soon as it's generated
+        instead of being joined into one string first, once the whole
+        dependency tree was checked for errors. Plugins overriding
+        `hook_output` or `hook_unparse` (like `MinifyPlugin`) need the whole
+        output, so when one is used the output is generated at once and then
+        written.
+
+        This doesn't bound memory usage by the size of the largest module: the
+        unparsed factory of every module is generated before anything is
+        written, so a failing build writes nothing, and is kept on its module
+        to be reused by later builds. What's saved is the joined output string
+        and, when factories can be unparsed during discovery, the ASTs of the
+        modules.
+        """
+        try:
+            with measure(self.stats, "total"):
+                dependency_tree_modules, dependency_tree_edges = self._build_dependency_tree(
+                    unparsed=True)
+                self._write_output(
+                    stream, dependency_tree_modules, dependency_tree_edges)
+        except RecursionError:
+            raise NestedModuleRecursionError()
+
+    def compile(self) -> CodeType:
+        """ compiles the module to a code object, e.g. to be written as a `.pyc` by `bytecode.write_pyc`
+
+        The output is compiled straight from its AST without being unparsed,
+        unless a plugin overrides `hook_unparse`. The code of each module's
+        factory keeps the path and line numbers of the module it came from, so
+        tracebacks point to the original source.
+        """
+        try:
+            with measure(self.stats, "total"):
+                dependency_tree_modules, dependency_tree_edges = self._build_dependency_tree()
+                return self._compile_output(dependency_tree_modules, dependency_tree_edges)
+        except RecursionError:
+            raise NestedModuleRecursionError()
+
+    async def generate_async(self, executor: Executor | None = None) -> str:
+        """ compiles the module like calling the compiler, without blocking the event loop
+
+        The imported files are read concurrently in `executor` (the event
+        loop's default executor if None), and plugins can resolve imports with
+        a coroutine by overriding `hook_import_resolution_async`. Parsing, the
+        plugins' other hooks and code generation run in a separate thread, one
+        module at a time. `options.jobs` is ignored.
+
+        Cancelling the task stops any more modules from being read or parsed.
+        A module which is being parsed, or the code generation if it already
+        started, is still finished by its thread in the background.
+        """
+        loop = asyncio.get_running_loop()
+        process_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="python_combiner")
+        try:
+            with measure(self.stats, "total"):
+                main_processed_module = await loop.run_in_executor(
+                    process_executor, lambda: ProcessedModule(
+                        self.source, self.path, "__main__", self.options, stats=self.stats))
+                with measure(self.stats, "prefetch"):
+                    await asynchronous.prefetch_dependencies(
+                        main_processed_module, self.options, self.cache, executor, process_executor)
+
+                def generate() -> str:
+                    dependency_tree_modules, dependency_tree_edges = self._build_dependency_tree(
+                        main_processed_module, unparsed=True)
+                    return self._generate_output(dependency_tree_modules, dependency_tree_edges)
+                return await loop.run_in_executor(process_executor, generate)
+        except RecursionError:
+            raise NestedModuleRecursionError()
+        finally:
+            process_executor.shutdown(wait=False, cancel_futures=True)
+
+    def _build_dependency_tree(self, main_processed_module: ProcessedModule | None = None, unparsed: bool = False) -> tuple[dict[str, ProcessedModule], dict[str, list[str]]]:
+        """
+        `main_processed_module` can be passed if the main module was already
+        processed, in which case its dependencies are expected to have been
+        prefetched too. `unparsed` tells whether the output will be unparsed
+        (instead of compiled), so factories can be unparsed as they're
+        discovered.
+        """
+        if main_processed_module is None:
             # get the main module
             main_processed_module = ProcessedModule(
-                self.source, self.path, "__main__", self.options)
-
-            # sort out all the dependencies and find a good linear order for them to
-            # be loaded in using `graph.py`
-            dependency_tree_edges: dict[str, list[str]] = {}
-            dependency_tree_modules: dict[str, ProcessedModule] = {}
-            dependency_queue: list[ProcessedModule] = [main_processed_module]
-            while len(dependency_queue) > 0:
-                module = dependency_queue.pop()
-                if module.path not in dependency_tree_modules:
-                    # Item hasn't been processed yet
-                    dependency_tree_modules[module.path] = module
-                    dependency_tree_edges[module.path] = []
-                    for item in module.imports:
-                        processed_module = ProcessedModule.resolve(
-                            item.module, module.path, self.options)
-                        dependency_tree_edges[module.path].append(
-                            processed_module.path)
-                        dependency_queue.append(processed_module)
+                self.source, self.path, "__main__", self.options, stats=self.stats)
+
+            if self.options.jobs > 1:
+                # process the modules in parallel up front so the discovery
+                # below only hits the cache
+                with measure(self.stats, "prefetch"):
+                    parallel.prefetch_dependencies(
+                        main_processed_module, self.options, self.cache, self.options.jobs)
+
+        dependency_tree_edges: dict[str, list[str]] = {}
+        dependency_tree_modules: dict[str, ProcessedModule] = {}
+        with measure(self.stats, "discover"):
+            self._discover_dependencies(
+                [main_processed_module], dependency_tree_modules, dependency_tree_edges,
+                generate_factories=unparsed and self._can_generate_factories_early())
+        if self.options.constant_propagation:
+            # before tree shaking, which can then remove the constants which
+            # are no longer used
+            with measure(self.stats, "propagate_constants"):
+                constprop.ConstantPropagator(
+                    dependency_tree_modules, dependency_tree_edges, self.options.plugins, self.stats).propagate()
+        if self.options.tree_shaking:
+            with measure(self.stats, "tree_shake"):
+                treeshaker.TreeShaker(
+                    self.path, dependency_tree_modules, dependency_tree_edges).shake()
+        return dependency_tree_modules, dependency_tree_edges
+
+    def _discover_dependencies(self, dependency_queue: list[ProcessedModule], dependency_tree_modules: dict[str, ProcessedModule], dependency_tree_edges: dict[str, list[str]], generate_factories: bool = False) -> None:
+        """
+        walks the imports of the modules in `dependency_queue`, adding every
+        module which hasn't been seen yet and its edges to the dependency tree.
+
+        with `generate_factories`, the factory of each module is unparsed as
+        soon as the module is resolved and its AST is released, so the ASTs of
+        all modules aren't in memory at once.
+        """
+        def generate_factory(module: ProcessedModule) -> None:
+            if module.factory_source is not None or module.factory_error is not None:
+                return
             try:
-                dependencies = list(reversed(graph.Graph(
-                    dependency_tree_edges).topological_sort()))
-            except graph.TopologicalSortError as err:
-                raise CircularDependencyError(err.remaining_modules)
-
-            output: list[ast.stmt] = []
-
-            # add helpers needed by the module factories for each mode
-            if self.options.export_dictionary_mode == "munch":
-                output.append(exporthelper.get_export_helper(use_munch=True))
-            elif self.options.export_dictionary_mode == "dict":
-                output.append(exporthelper.get_export_helper(use_munch=False))
-            else:
-                # export_dictionary_mode == "class", we don't need a helper
+                self._generate_factory_source(module)
+            except CompilerError:
+                # raised again when the factories are generated in order, so
+                # errors are raised in the same order
                 pass
 
-            # actually do the code generation
-            for dependency in dependencies:
-                module = dependency_tree_modules[dependency]
-                output.append(module.generate_factory_ast())
-                output.append(module.generate_evaluated_factory_ast(
-                    [
-                        dependency_tree_modules[module].name_generator.get_evaluated_factory(
-                        ) for module in dependency_tree_edges[module.path]
-                    ],
-                ))
-
-            # put the output into a Module
-            output_ast = ast.Module(
-                body=output,
-                type_ignores=[]
-            )
-
-            # let plugins do their thing
-            for plugin in self.options.plugins:
+        if generate_factories:
+            for module in dependency_queue:
+                generate_factory(module)
+        while len(dependency_queue) > 0:
+            module = dependency_queue.pop()
+            if module.path not in dependency_tree_modules:
+                # Item hasn't been processed yet
+                dependency_tree_modules[module.path] = module
+                dependency_tree_edges[module.path] = []
+                for item in module.imports:
+                    processed_module = ProcessedModule.resolve(
+                        item.module, module.path, self.options, self.cache)
+                    dependency_tree_edges[module.path].append(
+                        processed_module.path)
+                    dependency_queue.append(processed_module)
+                    if generate_factories and processed_module.path not in dependency_tree_modules:
+                        # right after the module is processed, since it may
+                        # wait in the queue for a while
+                        generate_factory(processed_module)
+
+    def _generate_factory(self, module: ProcessedModule) -> ast.stmt:
+        with measure(self.stats, "transform"):
+            return module.generate_factory_ast()
+
+    def _sort_dependencies(self, dependency_tree_edges: dict[str, list[str]]) -> tuple[list[str], dict[str, list[str]]]:
+        """
+        returns the modules in the order they run, and the groups of modules
+        which import each other (with deferred circular imports) keyed on the
+        first module of each group to run.
+        """
+        # sort out all the dependencies and find a good linear order for them to
+        # be loaded in using `graph.py`
+        dependency_graph = graph.Graph(dependency_tree_edges)
+        cycles: dict[str, list[str]] = {}
+        try:
+            with measure(self.stats, "topological_sort"):
+                dependencies = list(reversed(
+                    dependency_graph.topological_sort()))
+        except graph.TopologicalSortError as err:
+            if self.options.circular_imports != "deferred":
+                raise CircularDependencyError(
+                    err.remaining_modules, err.cycles)
+            with measure(self.stats, "topological_sort"):
+                # the modules of a cycle run in the order Python would run
+                # them in, starting from the main module
+                dependencies = list(reversed(dependency_graph.topological_sort(
+                    allow_cycles=True, start=self.path)))
+                positions = {path: i for i, path in enumerate(dependencies)}
+                for component in dependency_graph.strongly_connected_components():
+                    if len(component) > 1 or component[0] in dependency_tree_edges[component[0]]:
+                        component.sort(key=positions.__getitem__)
+                        cycles[component[0]] = component
+        if self.stats is not None:
+            self.stats.count("modules", len(dependencies))
+            if len(cycles) > 0:
+                self.stats.count("circular_modules", sum(
+                    len(component) for component in cycles.values()))
+        return dependencies, cycles
+
+    def _generate_helpers(self, has_cycles: bool = False) -> list[ast.stmt]:
+        """ returns the helpers needed by the module factories for each mode """
+        helpers: list[ast.stmt] = []
+        if self.options.export_dictionary_mode == "munch":
+            helpers.append(exporthelper.get_export_helper(use_munch=True))
+        elif self.options.export_dictionary_mode == "dict" or has_cycles:
+            # the module objects of cycles are created with it in the class
+            # modes
+            helpers.append(exporthelper.get_export_helper(use_munch=False))
+        else:
+            # export_dictionary_mode == "class", we don't need a helper
+            pass
+        if has_cycles:
+            helpers.append(exporthelper.get_populate_helper(
+                self.options.export_dictionary_mode))
+            helpers.append(exporthelper.get_sync_helper(
+                self.options.export_dictionary_mode))
+            helpers.extend(exporthelper.get_defer_helpers())
+        if self.options.evaluation_mode == "lazy":
+            helpers.append(exporthelper.get_lazy_helper())
+        return helpers
+
+    def _generate_evaluated_factory(self, module: ProcessedModule, dependency_tree_modules: dict[str, ProcessedModule], dependency_tree_edges: dict[str, list[str]], deferred: bool = False) -> ast.stmt:
+        return module.generate_evaluated_factory_ast(
+            [
+                dependency_tree_modules[module].name_generator.get_evaluated_factory(
+                ) for module in dependency_tree_edges[module.path]
+            ],
+            deferred
+        )
+
+    def _generate_evaluated_statements(self, module: ProcessedModule, dependency_tree_modules: dict[str, ProcessedModule], dependency_tree_edges: dict[str, list[str]], component: list[str] | None = None) -> list[ast.stmt]:
+        """
+        returns the statements running the factory of `module`, given the
+        group of modules it imports each other with if there is one
+        """
+        if component is None:
+            return [self._generate_evaluated_factory(
+                module, dependency_tree_modules, dependency_tree_edges)]
+        if module.path != component[-1]:
+            # run when it's first imported by a module of the group
+            return [module.generate_deferred_factory_ast([
+                dependency_tree_modules[path].name_generator.get_evaluated_factory()
+                for path in dependency_tree_edges[module.path]
+            ])]
+        # the group is entered through the module which runs last, like the
+        # first module of a cycle Python imports is the last to finish. the
+        # modules it didn't import while running run afterwards
+        return [
+            self._generate_evaluated_factory(
+                module, dependency_tree_modules, dependency_tree_edges, deferred=True),
+            *[dependency_tree_modules[path].generate_run_deferred_ast()
+              for path in component[:-1]]
+        ]
+
+    def _defer_imports(self, factory: ast.stmt, module: ProcessedModule, dependency_tree_edges: dict[str, list[str]], component: list[str]) -> ast.stmt:
+        """
+        makes the factory of a module in a group of modules which import each
+        other run them as it imports them. `factory` is modified.
+        """
+        if not isinstance(factory, ast.FunctionDef):
+            return factory
+        # the factory takes a module for each of the module's imports
+        deferred_arguments = {
+            argument.arg for argument, path in zip(factory.args.args, dependency_tree_edges[module.path])
+            if path in component}
+        return transformers.DeferredImportTransformer(
+            module.name_generator.get_evaluated_factory(), deferred_arguments).transform(factory)
+
+    def _generate_statements(self, dependency_tree_modules: dict[str, ProcessedModule], dependency_tree_edges: dict[str, list[str]]) -> list[ast.stmt]:
+        """ returns the statements of the output, without the docstring """
+        dependencies, cycles = self._sort_dependencies(dependency_tree_edges)
+        components = {path: component for component in cycles.values()
+                      for path in component}
+
+        output = self._generate_helpers(len(cycles) > 0)
+
+        # actually do the code generation
+        for dependency in dependencies:
+            # the module objects of a cycle are created before any of its
+            # modules runs
+            for path in cycles.get(dependency, []):
+                output.append(
+                    dependency_tree_modules[path].generate_preallocated_module_ast())
+            module = dependency_tree_modules[dependency]
+            component = components.get(dependency)
+            factory = self._generate_factory(module)
+            if component is not None:
+                # the factory is shared with other outputs
+                factory = self._defer_imports(
+                    copy.deepcopy(factory), module, dependency_tree_edges, component)
+            output.append(factory)
+            output.extend(self._generate_evaluated_statements(
+                module, dependency_tree_modules, dependency_tree_edges, component))
+        return output
+
+    def _generate_docstring(self) -> ast.stmt | None:
+        if self.options.docstring == None:
+            return None
+        return ast.Expr(
+            ast.Constant(
+                value=self.options.docstring)
+        )
+
+    def _generate_output_ast(self, dependency_tree_modules: dict[str, ProcessedModule], dependency_tree_edges: dict[str, list[str]]) -> ast.Module:
+        output = self._generate_statements(
+            dependency_tree_modules, dependency_tree_edges)
+
+        # put the output into a Module
+        output_ast = ast.Module(
+            body=output,
+            type_ignores=[]
+        )
+
+        # let plugins do their thing
+        for plugin in self.options.plugins:
+            with measure(self.stats, f"hook_output:{type(plugin).__name__}"):
                 output_ast = plugin.hook_output(output_ast)
 
-            # add the docstring at the top
-            if self.options.docstring != None:
-                output.insert(0, ast.Expr(
-                    ast.Constant(
-                        value=self.options.docstring)
-                ))
+        # add the docstring at the top
+        docstring = self._generate_docstring()
+        if docstring is not None:
+            output.insert(0, docstring)
+        return output_ast
 
-            # actually generate the output code string
-            output_str = None
-            for plugin in self.options.plugins:
+    def _run_unparse_hooks(self, output_ast: ast.Module) -> str | None:
+        """ returns what plugins unparsed the output to, or None if none of them did """
+        output_str = None
+        for plugin in self.options.plugins:
+            with measure(self.stats, f"hook_unparse:{type(plugin).__name__}"):
                 unparsed = plugin.hook_unparse(output_ast)
-                if unparsed is not None:
-                    if output_str is not None:
-                        warnings.warn(
-                            "The AST unparse operation was overwritten "
-                            "multiple times, resulting in only the last "
-                            "plugin's hook_unparse hook being used."
-                        )
-                    output_str = unparsed
-            if output_str is None:
-                output_str = ast.unparse(ast.fix_missing_locations(output_ast))
-            return output_str
-        except RecursionError:
-            raise NestedModuleRecursionError()
+            if unparsed is not None:
+                if output_str is not None:
+                    warnings.warn(
+                        "The AST unparse operation was overwritten "
+                        "multiple times, resulting in only the last "
+                        "plugin's hook_unparse hook being used."
+                    )
+                output_str = unparsed
+        return output_str
+
+    def _generate_output(self, dependency_tree_modules: dict[str, ProcessedModule], dependency_tree_edges: dict[str, list[str]]) -> str:
+        if self._can_stream():
+            return "".join(self._generate_fragments(
+                dependency_tree_modules, dependency_tree_edges))
+
+        output_ast = self._generate_output_ast(
+            dependency_tree_modules, dependency_tree_edges)
+
+        # actually generate the output code string
+        output_str = self._run_unparse_hooks(output_ast)
+        if output_str is None:
+            with measure(self.stats, "unparse"):
+                output_str = ast.unparse(
+                    ast.fix_missing_locations(output_ast))
+        if self.stats is not None:
+            self.stats.count("output_size", len(output_str.encode()))
+        return output_str
+
+    def _compile_output(self, dependency_tree_modules: dict[str, ProcessedModule], dependency_tree_edges: dict[str, list[str]]) -> CodeType:
+        output_ast = self._generate_output_ast(
+            dependency_tree_modules, dependency_tree_edges)
+        # if a plugin unparses the output, what it produces is what would run
+        source = self._run_unparse_hooks(output_ast)
+        with measure(self.stats, "compile"):
+            if source is not None:
+                return compile(source, self.path, "exec")
+            code = compile(ast.fix_missing_locations(
+                output_ast), self.path, "exec")
+        # the factories keep the line numbers of the modules they came from
+        return bytecode.replace_filenames(code, {
+            module.name_generator.get_factory(): module.path
+            for module in dependency_tree_modules.values()
+            if module.has_source
+        })
+
+    def _can_stream(self) -> bool:
+        """ whether the output can be unparsed a statement at a time """
+        return all(
+            type(plugin).hook_output is Plugin.hook_output
+            and type(plugin).hook_unparse is Plugin.hook_unparse
+            for plugin in self.options.plugins)
+
+    def _can_generate_factories_early(self) -> bool:
+        """
+        whether factories can be unparsed before the whole dependency tree is
+        known, which is when they only depend on their own module
+        """
+        return (self._can_stream()
+                and not self.options.tree_shaking
+                and not self.options.constant_propagation)
+
+    def _generate_factory_source(self, module: ProcessedModule) -> str:
+        with measure(self.stats, "factory_cache_load"):
+            source = module.load_factory_source(self.stats)
+        if source is None:
+            factory = self._generate_factory(module)
+            with measure(self.stats, "unparse"):
+                source = ast.unparse(ast.fix_missing_locations(factory))
+            with measure(self.stats, "factory_cache_store"):
+                module.store_factory_source(source)
+        module.release_ast()
+        return source
+
+    def _generate_fragments(self, dependency_tree_modules: dict[str, ProcessedModule], dependency_tree_edges: dict[str, list[str]]) -> Iterator[str]:
+        """
+        yields the output unparsed a statement at a time, for when no plugin
+        needs the whole output. the factory of each module is only unparsed
+        once (see `ProcessedModule.load_factory_source`), so most of the
+        output is reused between builds.
+
+        the modules are sorted and every factory is generated before the first
+        fragment is yielded, so errors are raised before any of the output is
+        written. the factories stay in memory until then (and afterwards, on
+        their modules), so only the joined output isn't built.
+        """
+        dependencies, cycles = self._sort_dependencies(dependency_tree_edges)
+        components = {path: component for component in cycles.values()
+                      for path in component}
+        for dependency in dependencies:
+            self._generate_factory_source(dependency_tree_modules[dependency])
+
+        def statements() -> Iterator[tuple[str, bool]]:
+            """ yields each statement unparsed, and whether it's a definition """
+            docstring = self._generate_docstring()
+            if docstring is not None:
+                with measure(self.stats, "unparse"):
+                    # unparsed as part of a module so it's written as a
+                    # docstring instead of a string expression
+                    source = ast.unparse(
+                        ast.Module(body=[docstring], type_ignores=[]))
+                yield source, False
+            for helper in self._generate_helpers(len(cycles) > 0):
+                with measure(self.stats, "unparse"):
+                    source = ast.unparse(ast.fix_missing_locations(helper))
+                yield source, isinstance(helper, (ast.FunctionDef, ast.ClassDef))
+            for dependency in dependencies:
+                module = dependency_tree_modules[dependency]
+                for path in cycles.get(dependency, []):
+                    preallocated_module = dependency_tree_modules[path].generate_preallocated_module_ast(
+                    )
+                    with measure(self.stats, "unparse"):
+                        source = ast.unparse(
+                            ast.fix_missing_locations(preallocated_module))
+                    yield source, False
+                # factories are always functions, and were unparsed above
+                source = self._generate_factory_source(module)
+                component = components.get(dependency)
+                if component is not None:
+                    with measure(self.stats, "unparse"):
+                        factory = self._defer_imports(
+                            ast.parse(source).body[0], module, dependency_tree_edges, component)
+                        source = ast.unparse(ast.fix_missing_locations(factory))
+                yield source, True
+                for statement in self._generate_evaluated_statements(
+                        module, dependency_tree_modules, dependency_tree_edges, component):
+                    with measure(self.stats, "unparse"):
+                        source = ast.unparse(
+                            ast.fix_missing_locations(statement))
+                    yield source, False
+
+        output_size = 0
+        for i, (statement, definition) in enumerate(statements()):
+            # separate the statements the same way unparsing them all at once
+            # would
+            if i > 0:
+                separator = "\n\n" if definition else "\n"
+                output_size += len(separator)
+                yield separator
+            output_size += len(statement.encode())
+            yield statement
+        if self.stats is not None:
+            self.stats.count("output_size", output_size)
+
+    def _write_output(self, stream: TextIO, dependency_tree_modules: dict[str, ProcessedModule], dependency_tree_edges: dict[str, list[str]]) -> None:
+        if not self._can_stream():
+            # plugins need the whole output at once
+            stream.write(self._generate_output(
+                dependency_tree_modules, dependency_tree_edges))
+            return
+        # each statement is written as soon as it's unparsed
+        for fragment in self._generate_fragments(dependency_tree_modules, dependency_tree_edges):
+            stream.write(fragment)
+
+
+class CompilerTestMethods(unittest.TestCase):
+    def test_shared_module_parsed_once(self):
+        from .testing import VirtualModulesPlugin
+        compiler = Compiler(
+            "import shared_a\nimport shared_b\nimport shared_c",
+            "/virtual/__main__.py",
+            CompilerOptions(plugins=[VirtualModulesPlugin({
+                "shared_a": "import shared_c",
+                "shared_b": "import shared_c\nimport shared_a",
+                "shared_c": "x = 1",
+            })]))
+        compiler()
+        self.assertEqual(compiler.cache.parse_count, 3)
+
+    def test_stats(self):
+        from .testing import VirtualModulesPlugin
+        stats = CompilerStats()
+        output = Compiler(
+            "import shared_a\nimport shared_b",
+            "/virtual/__main__.py",
+            CompilerOptions(plugins=[VirtualModulesPlugin({
+                "shared_a": "x = 1",
+                "shared_b": "import shared_a",
+            })]),
+            stats=stats)()
+        self.assertEqual(stats.phases["parse"].count, 3)
+        self.assertEqual(stats.phases["transform"].count, 3)
+        self.assertEqual(stats.counters["output_size"], len(output))
+        self.assertEqual(
+            stats.modules["/virtual/shared_a.py"].source_size, len("x = 1"))
+
+    def test_tree_shaking(self):
+        from .testing import VirtualModulesPlugin
+        output = Compiler(
+            "from lib import used\nimport effect\nimport unused\nprint(used())",
+            "/virtual/__main__.py",
+            CompilerOptions(tree_shaking=True, plugins=[VirtualModulesPlugin({
+                "lib": "import helper\ndef used():\n    return helper.f()\ndef unused_function():\n    pass",
+                "helper": "def f():\n    return 1\ndef g():\n    return 2",
+                "effect": "print('effect')",
+                "unused": "import helper\nX = 1",
+            })]))()
+        self.assertIn("def used", output)
+        self.assertIn("def f", output)
+        self.assertIn("print('effect')", output)
+        self.assertNotIn("unused_function", output)
+        self.assertNotIn("def g", output)
+        self.assertNotIn("X = 1", output)
+
+    def test_tree_shaking_side_effects(self):
+        from .testing import VirtualModulesPlugin
+        output = Compiler(
+            "import lib",
+            "/virtual/__main__.py",
+            CompilerOptions(tree_shaking=True, plugins=[VirtualModulesPlugin({
+                "lib": "import registry\n"
+                       "class Plain(object):\n    pass\n"
+                       "class Registered(registry.Base):\n    pass\n"
+                       "NEGATIVE = -1\n"
+                       "ATTRIBUTE = registry.value\n"
+                       "ITEM = registry.items[0]\n"
+                       "INVERTED = ~registry.value",
+                "registry": "class Base:\n    pass\nvalue = 1\nitems = [1]",
+            })]))()
+        # defining a subclass or reading an attribute or item can run code
+        self.assertNotIn("class Plain", output)
+        self.assertNotIn("NEGATIVE", output)
+        self.assertIn("class Registered", output)
+        self.assertIn("ATTRIBUTE = ", output)
+        self.assertIn("ITEM = ", output)
+        self.assertIn("INVERTED = ", output)
+
+    def test_tree_shaking_asterisk_import(self):
+        from .testing import VirtualModulesPlugin
+        with self.assertRaises(AsteriskImportError):
+            Compiler(
+                "from lib import *\nprint(f())",
+                "/virtual/__main__.py",
+                CompilerOptions(tree_shaking=True, plugins=[VirtualModulesPlugin({
+                    "lib": "def f():\n    return 1",
+                })]))()
+
+    def test_write_matches_call(self):
+        from .testing import VirtualModulesPlugin
+        for export_dictionary_mode in ["dict", "class"]:
+            for evaluation_mode in ["eager", "lazy"]:
+                options = CompilerOptions(
+                    export_dictionary_mode=export_dictionary_mode,
+                    evaluation_mode=evaluation_mode,
+                    plugins=[VirtualModulesPlugin({
+                        "lib": "import os\nclass A:\n    pass\ndef f():\n    return A()\nx = f()",
+                    })])
+                source = "'''docstring'''\nimport lib\nprint(lib.x)"
+                stream = io.StringIO()
+                Compiler(source, "/virtual/__main__.py", options).write(stream)
+                self.assertEqual(
+                    stream.getvalue(),
+                    Compiler(source, "/virtual/__main__.py", options)())
+
+    def test_write_streams(self):
+        from .testing import VirtualModulesPlugin
+        writes: list[str] = []
+
+        class Stream(io.StringIO):
+            def write(self, data: str) -> int:
+                writes.append(data)
+                return super().write(data)
+
+        options = CompilerOptions(plugins=[VirtualModulesPlugin({
+            "a": "import b",
+            "b": "import a",
+            "c": "x = 1",
+        })])
+        with self.assertRaises(CircularDependencyError):
+            Compiler("import c\nimport a", "/virtual/__main__.py",
+                     options).write(Stream())
+        # the error was raised before anything was written
+        self.assertEqual(writes, [])
+        Compiler("import c", "/virtual/__main__.py", options).write(Stream())
+        self.assertGreater(len(writes), 1)
+
+    def test_compile(self):
+        from .testing import VirtualModulesPlugin
+        options = CompilerOptions(plugins=[VirtualModulesPlugin({
+            "lib": "import os\n\ndef f():\n    raise ValueError(os.sep)",
+        })])
+        code = Compiler("import lib\nlib.f()",
+                        "/virtual/__main__.py", options).compile()
+        data = bytecode.pyc_data(code)
+        self.assertEqual(data[:4], importlib.util.MAGIC_NUMBER)
+        try:
+            # skip the rest of the header
+            exec(marshal.loads(data[16:]), {"__name__": "__main__"})
+        except ValueError as err:
+            frame = traceback.extract_tb(err.__traceback__)[-1]
+            self.assertEqual((frame.filename, frame.lineno),
+                             ("/virtual/lib.py", 4))
+        else:
+            self.fail("the compiled code didn't raise")
+
+    def test_factory_cache(self):
+        from .testing import VirtualModulesPlugin
+        options = CompilerOptions(
+            parse_cache=MemoryParseCache(),
+            plugins=[VirtualModulesPlugin({"lib": "import os\nx = 1"})])
+        source = "import lib\nprint(lib.x)"
+        output = Compiler(source, "/virtual/__main__.py", options)()
+        stats = CompilerStats()
+        self.assertEqual(
+            Compiler(source, "/virtual/__main__.py", options, stats=stats)(), output)
+        self.assertEqual(stats.counters["factory_cache_hits"], 2)
+        # only the factory of os is generated again, since it's built-in and
+        # has no source to be cached by
+        self.assertEqual(stats.phases["transform"].count, 1)
+
+    def test_constant_propagation(self):
+        from .testing import VirtualModulesPlugin
+        stats = CompilerStats()
+        output = Compiler(
+            "import lib\nprint(lib.f(), lib.LABEL)",
+            "/virtual/__main__.py",
+            CompilerOptions(constant_propagation=True, plugins=[
+                SimplifyIfPlugin(),
+                VirtualModulesPlugin({
+                    "config": "DEBUG = False\nLEVEL: int = 2",
+                    "lib": "from config import DEBUG\nimport config\nLABEL = 'debug' if DEBUG else 'release'\n"
+                           "def f():\n    if DEBUG:\n        print('debugging')\n    return config.LEVEL * 2",
+                })]),
+            stats=stats)()
+        self.assertNotIn("debugging", output)
+        self.assertIn("return 4", output)
+        self.assertEqual(stats.counters["inlined_constants"], 4)
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            exec(output, {"__name__": "__main__"})
+        self.assertEqual(stdout.getvalue(), "4 release\n")
+
+    def test_constant_propagation_mutated_module(self):
+        from .testing import VirtualModulesPlugin
+        output = Compiler(
+            "import config\nimport lib\nconfig.DEBUG = True\nlib.f()",
+            "/virtual/__main__.py",
+            CompilerOptions(constant_propagation=True, plugins=[
+                SimplifyIfPlugin(),
+                VirtualModulesPlugin({
+                    "config": "DEBUG = False",
+                    "lib": "import config\ndef f():\n    if config.DEBUG:\n        print('debugging')",
+                })]))()
+        # the attribute is assigned to elsewhere, so it isn't a constant
+        self.assertIn("print('debugging')", output)
+
+    def test_duplicate_imports(self):
+        from .testing import VirtualModulesPlugin
+        output = Compiler(
+            "import lib\nfrom lib import f\nimport lib as other\nprint(lib.f(), f(), other.f())",
+            "/virtual/__main__.py",
+            CompilerOptions(plugins=[VirtualModulesPlugin({
+                "lib": "import os\nimport os\ndef f():\n    return os.sep",
+            })]))()
+        # the module is passed to the factory only once
+        self.assertEqual(output.count("__generated_import_lib_"), 4)
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            exec(output, {"__name__": "__main__"})
+        self.assertEqual(stdout.getvalue(), f"{os.sep} {os.sep} {os.sep}\n")
+
+    def test_circular_imports(self):
+        from .testing import VirtualModulesPlugin
+        modules = {
+            "a": "import b\ndef f():\n    return b.g() + 1\ndef h():\n    return 1\nprint('a')",
+            # `a` is still being imported when `b` runs, but it's filled in
+            # by the time `g` is called
+            "b": "import a\ndef g():\n    return a.h()\nprint('b')",
+        }
+        source = "import a\nimport b\nprint(a.f(), b.g())"
+        with self.assertRaises(CircularDependencyError) as context:
+            Compiler(source, "/virtual/__main__.py",
+                     CompilerOptions(plugins=[VirtualModulesPlugin(modules)]))()
+        self.assertEqual(context.exception.cycles, [
+            ["/virtual/a.py", "/virtual/b.py", "/virtual/a.py"]])
+        cases = [
+            (source, modules, "b\na\n2 1\n"),
+            # `c` is partially imported when `d` runs, with the names it bound
+            # before importing `d`
+            ("import c\nprint(c.X, c.Y)", {
+                "c": "X = 1\nimport d\nY = d.Z",
+                "d": "from c import X\nZ = X + 1",
+            }, "1 2\n"),
+        ]
+        for source, modules, expected in cases:
+            for export_dictionary_mode in ["dict", "class", "class_instance"]:
+                for evaluation_mode in ["eager", "lazy"]:
+                    options = CompilerOptions(
+                        export_dictionary_mode=export_dictionary_mode,
+                        evaluation_mode=evaluation_mode,
+                        circular_imports="deferred",
+                        plugins=[VirtualModulesPlugin(modules)])
+                    output = Compiler(
+                        source, "/virtual/__main__.py", options)()
+                    stream = io.StringIO()
+                    Compiler(source, "/virtual/__main__.py",
+                             options).write(stream)
+                    self.assertEqual(stream.getvalue(), output)
+                    stdout = io.StringIO()
+                    with contextlib.redirect_stdout(stdout):
+                        exec(output, {"__name__": "__main__"})
+                    self.assertEqual(stdout.getvalue(), expected)
+                    stdout = io.StringIO()
+                    with contextlib.redirect_stdout(stdout):
+                        exec(Compiler(source, "/virtual/__main__.py", options).compile(),
+                             {"__name__": "__main__"})
+                    self.assertEqual(stdout.getvalue(), expected)
+
+    def test_refresh_resolution_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            app = os.path.join(directory, "app")
+            site = os.path.join(directory, "site")
+            os.mkdir(app)
+            os.mkdir(site)
+            with open(os.path.join(site, "lib.py"), "w"):
+                pass
+            cache = ResolutionCache()
+            cache.resolver = ModuleResolver([site])
+            main = os.path.join(app, "main.py")
+            options = CompilerOptions()
+            self.assertEqual(ProcessedModule.resolve("lib", main, options, cache).path,
+                             os.path.join(site, "lib.py"))
+            # a module added next to the importing one shadows the other one
+            with open(os.path.join(app, "lib.py"), "w"):
+                pass
+            os.utime(app, ns=(0, 0))
+            cache.refresh()
+            self.assertEqual(ProcessedModule.resolve("lib", main, options, cache).path,
+                             os.path.join(app, "lib.py"))
+
+    def test_resolution_depends_on_importer(self):
+        class ImporterPlugin(Plugin):
+            """ Resolves `lib` to a different module for each importing file """
+
+            def hook_import_resolution(self, path: str, module: str) -> tuple[str, str] | None:
+                if module == "lib":
+                    name = os.path.splitext(os.path.basename(path))[0]
+                    return f"x = {name!r}", f"/virtual/lib_{name}.py"
+                if module in ("a", "b"):
+                    return f"import lib\nx = lib.x", f"/virtual/{module}.py"
+                return None
+
+        output = Compiler("import a\nimport b\nprint(a.x, b.x)", "/virtual/__main__.py",
+                          CompilerOptions(plugins=[ImporterPlugin()]))()
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            exec(output, {"__name__": "__main__"})
+        self.assertEqual(stdout.getvalue(), "a b\n")
+
+    def test_release_ast(self):
+        from .testing import VirtualModulesPlugin
+        compiler = Compiler(
+            "import lib\nlib.f()",
+            "/virtual/__main__.py",
+            CompilerOptions(plugins=[VirtualModulesPlugin({
+                "lib": "def f():\n    print('called')",
+            })]))
+        output = compiler()
+        lib = compiler.cache.modules["/virtual/lib.py"]
+        # only the unparsed factory is kept
+        self.assertIsNone(lib.module)
+        self.assertIsNotNone(lib.factory_source)
+        self.assertEqual(compiler(), output)
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            exec(compiler.compile(), {"__name__": "__main__"})
+        self.assertEqual(stdout.getvalue(), "called\n")
+
+    def test_jobs(self):
+        with tempfile.TemporaryDirectory() as directory:
+            def write(name: str, source: str) -> str:
+                path = os.path.join(directory, name)
+                with open(path, "w") as file:
+                    file.write(source)
+                return path
+
+            write("a.py", "import shared\nimport c\nx = shared.y")
+            write("b.py", "import shared\ny = shared.y + 1")
+            write("c.py", "import shared\nz = 3")
+            write("shared.py", "y = 1")
+            main = write("main.py", "import a\nimport b\nprint(a.x, b.y)")
+            builds: dict[int, tuple[str, CompilerStats, Compiler]] = {}
+            for jobs in (1, 2):
+                stats = CompilerStats()
+                compiler = Compiler("import a\nimport b\nprint(a.x, b.y)", main,
+                                    CompilerOptions(jobs=jobs), stats=stats)
+                builds[jobs] = (compiler(), stats, compiler)
+            self.assertEqual(builds[2][0], builds[1][0])
+            self.assertIn("prefetch", builds[2][1].phases)
+            # the stats of the workers are merged back, and the module they
+            # share is only processed once
+            self.assertEqual(builds[2][1].phases["parse"].count,
+                             builds[1][1].phases["parse"].count)
+            self.assertEqual(builds[2][2].cache.parse_count,
+                             builds[1][2].cache.parse_count)
+
+            # the error of a module failing in a worker is raised by the serial
+            # discovery, so it's the same one a serial build raises
+            write("c.py", "import shared\nz = (")
+            write("b.py", "import shared\ny = )")
+            for jobs in (1, 2):
+                with self.assertRaises(ModuleSyntaxError) as context:
+                    Compiler("import a\nimport b\nprint(a.x, b.y)", main,
+                             CompilerOptions(jobs=jobs))()
+                self.assertEqual(context.exception.path, os.path.join(directory, "b.py"))
+
+    def test_memory_sources(self):
+        output = Compiler(
+            "from package.module import f\nprint(f())",
+            "/app/__main__.py",
+            CompilerOptions(source_provider=MemorySourceProvider({
+                "/app/package/__init__.py": "",
+                "/app/package/module.py": "import json\ndef f():\n    return json.dumps([1])",
+            })))()
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            exec(output, {"__name__": "__main__"})
+        self.assertEqual(stdout.getvalue(), "[1]\n")
+
+    def test_generate_async(self):
+        from .testing import AsyncVirtualModulesPlugin, VirtualModulesPlugin
+        sources = {
+            "shared_a": "import shared_c\ndef f():\n    return shared_c.x",
+            "shared_b": "import shared_c\nimport shared_a",
+            "shared_c": "import os\nx = os.sep",
+        }
+        main = "import shared_a\nimport shared_b\nprint(shared_a.f())"
+        expected = Compiler(main, "/virtual/__main__.py", CompilerOptions(
+            plugins=[VirtualModulesPlugin(sources)]))()
+        compiler = Compiler(main, "/virtual/__main__.py", CompilerOptions(
+            plugins=[AsyncVirtualModulesPlugin(sources)]))
+        self.assertEqual(asyncio.run(compiler.generate_async()), expected)
+        self.assertEqual(compiler.cache.parse_count, 3)
+
+    def test_generate_async_syntax_error(self):
+        from .testing import AsyncVirtualModulesPlugin
+        compiler = Compiler("import lib", "/virtual/__main__.py", CompilerOptions(
+            plugins=[AsyncVirtualModulesPlugin({"lib": "x = ("})]))
+        # the module only an async plugin can resolve isn't resolved again
+        with self.assertRaises(ModuleSyntaxError) as context:
+            asyncio.run(compiler.generate_async())
+        self.assertEqual(context.exception.path, "/virtual/lib.py")
+
+    def test_generate_async_cancelled(self):
+        from .testing import AsyncVirtualModulesPlugin
+        async def cancel() -> None:
+            compiler = Compiler("import lib", "/virtual/__main__.py", CompilerOptions(
+                plugins=[AsyncVirtualModulesPlugin({"lib": "x = 1"}, asyncio.Event())]))
+            task = asyncio.create_task(compiler.generate_async())
+            # let it block on the resolution
+            for _ in range(10):
+                await asyncio.sleep(0.01)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            self.assertEqual(compiler.cache.parse_count, 0)
+        asyncio.run(cancel())
+
+
+@unittest.skipIf(importlib.util.find_spec("python_minifier") is None,
+                 "python-minifier isn't installed")
+class MinifyPluginTestMethods(unittest.TestCase):
+    SOURCES = {
+        "lib": "class Base(object):\n    pass\n\n\nclass Point(Base):\n    def __init__(self, x: int, y: int) -> None:\n        self.x = x\n        self.y = y\n\n    def total(self) -> int:\n        'the sum of the coordinates'\n        if 1 + 1 == 2:\n            return self.x + self.y\n        return None\n",
+        "util": "import os\nimport sys\nSEPARATORS = [os.sep, os.sep, 'long literal', 'long literal']\ndef describe(values):\n    for value in values:\n        assert value is not None\n        yield f'{value!r} {SEPARATORS[0]}'\n",
+    }
+    MAIN = "import lib\nimport util\nprint(lib.Point(1, 2).total())\nprint(list(util.describe([1, 'a'])))"
+
+    def run_output(self, output: str) -> str:
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            exec(output, {"__name__": "__main__"})
+        return stdout.getvalue()
+
+    def test_ast_matches_minify(self):
+        from python_minifier import minify
+
+        from .plugin.minifier import MinifyPlugin, _minify, _minify_module
+        kwargs = MinifyPlugin()._get_minify_kwargs()
+        for source in [*self.SOURCES.values(), self.MAIN]:
+            with self.subTest(source=source):
+                expected = ast.dump(ast.parse(minify(source, **kwargs)))
+                # without falling back to `minify`
+                self.assertEqual(ast.dump(ast.parse(_minify_module(ast.parse(source), **kwargs))),
+                                 expected)
+                module = ast.parse(source)
+                dumped = ast.dump(module)
+                self.assertEqual(ast.dump(ast.parse(_minify(module, kwargs))),
+                                 expected)
+                # the module is copied rather than modified
+                self.assertEqual(ast.dump(module), dumped)
+
+    def test_jobs(self):
+        from .plugin.minifier import MinifyPlugin
+        from .testing import VirtualModulesPlugin
+        expected = self.run_output(Compiler(
+            self.MAIN, "/virtual/__main__.py",
+            CompilerOptions(plugins=[VirtualModulesPlugin(self.SOURCES)]))())
+        outputs: dict[int | None, str] = {}
+        for jobs in (None, 1, 2):
+            with self.subTest(jobs=jobs):
+                outputs[jobs] = Compiler(
+                    self.MAIN, "/virtual/__main__.py",
+                    CompilerOptions(short_generated_names=True, plugins=[
+                        VirtualModulesPlugin(self.SOURCES), MinifyPlugin(jobs=jobs)]))()
+                self.assertEqual(self.run_output(outputs[jobs]), expected)
+        # the names python-minifier generates depend on what the process
+        # minified before, so only the shape of the output is the same
+        self.assertEqual(len(ast.parse(outputs[2]).body),
+                         len(ast.parse(outputs[1]).body))
+
+
+if __name__ == "__main__":
+    unittest.main()
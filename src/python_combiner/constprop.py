@@ -0,0 +1,260 @@
+import ast
+
+from .plugin import Plugin
+from .plugin.simplify_if import SimplifyIfPlugin, SimplifyIfTransformer
+from .processedmodule import ProcessedModule
+from .stats import CompilerStats
+from .treeshaker import DYNAMIC_ACCESS_NAMES
+
+# the types of values which can be inlined. they're immutable, so every use of
+# a name bound to one sees the same value
+INLINED_TYPES = (bool, int, float, complex, str, bytes, type(None))
+# strings and bytes longer than this are left alone, since inlining them in
+# several places would make the output bigger
+MAX_INLINED_LENGTH = 64
+
+
+def _is_inlinable(node: ast.expr | None) -> bool:
+    if not isinstance(node, ast.Constant) or not isinstance(node.value, INLINED_TYPES):
+        return False
+    return not isinstance(node.value, (str, bytes)) or len(node.value) <= MAX_INLINED_LENGTH
+
+
+# the nodes which can bind names, besides `ast.Name`
+_BINDING_NODE_TYPES = (ast.arg, ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef,
+                       ast.Import, ast.ImportFrom, ast.Global, ast.Nonlocal,
+                       ast.ExceptHandler, ast.MatchAs, ast.MatchStar, ast.MatchMapping,
+                       ast.TypeVar, ast.ParamSpec, ast.TypeVarTuple)
+
+
+def _bound_names(node: ast.AST) -> list[str]:
+    """ returns the names `node` binds in the scope it's in (or the one it creates) """
+    if isinstance(node, ast.Name):
+        return [] if isinstance(node.ctx, ast.Load) else [node.id]
+    elif isinstance(node, ast.arg):
+        return [node.arg]
+    elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+        return [node.name]
+    elif isinstance(node, (ast.Import, ast.ImportFrom)):
+        return [alias.asname if alias.asname is not None else alias.name.partition(".")[0]
+                for alias in node.names]
+    elif isinstance(node, (ast.Global, ast.Nonlocal)):
+        return node.names
+    elif isinstance(node, (ast.ExceptHandler, ast.MatchAs, ast.MatchStar,
+                           ast.TypeVar, ast.ParamSpec, ast.TypeVarTuple)):
+        return [node.name] if node.name is not None else []
+    elif isinstance(node, ast.MatchMapping):
+        return [node.rest] if node.rest is not None else []
+    return []
+
+
+class _ConstantSubstituter(ast.NodeTransformer):
+    """ Replaces names and module attributes bound to constants with their values """
+    names: dict[str, ast.Constant]
+    # names bound to modules -> the constants of the module
+    module_constants: dict[str, dict[str, ast.Constant]]
+    count: int
+
+    def __init__(self, names: dict[str, ast.Constant], module_constants: dict[str, dict[str, ast.Constant]]) -> None:
+        self.names = names
+        self.module_constants = module_constants
+        self.count = 0
+        super().__init__()
+
+    def _substitute(self, value: ast.Constant, node: ast.expr) -> ast.Constant:
+        self.count += 1
+        return ast.copy_location(ast.Constant(value=value.value), node)
+
+    def visit_Name(self, node: ast.Name) -> ast.expr:
+        value = self.names.get(node.id)
+        if value is not None and isinstance(node.ctx, ast.Load):
+            return self._substitute(value, node)
+        return node
+
+    def visit_Attribute(self, node: ast.Attribute) -> ast.expr:
+        if isinstance(node.value, ast.Name) and isinstance(node.ctx, ast.Load):
+            value = self.module_constants.get(
+                node.value.id, {}).get(node.attr)
+            if value is not None:
+                return self._substitute(value, node)
+        return self.generic_visit(node)
+
+
+class _ModuleConstantsInfo:
+    module: ProcessedModule
+    # imported module names to the path of the module they resolve to
+    dependencies: dict[str, str]
+    # how many times each name is bound anywhere in the module, in any scope.
+    # a name bound only once can't be shadowed or reassigned
+    bindings: dict[str, int]
+    # whether the module may access its namespace without naming the variables
+    dynamic: bool
+    # the paths of the imported modules whose module object is used for
+    # anything other than reading an attribute, like assigning to one or
+    # passing it to a function. their attributes may change at any time
+    escaping_dependencies: set[str]
+
+    def __init__(self, module: ProcessedModule, dependency_paths: list[str]) -> None:
+        assert module.module is not None
+        self.module = module
+        self.dependencies = {item.module: path for item,
+                             path in zip(module.imports, dependency_paths)}
+        self.bindings = {}
+        self.dynamic = False
+
+        # names bound to modules by imports anywhere in the module
+        module_names: dict[str, str] = {}
+        read_attributes: set[int] = set()
+        names: list[ast.Name] = []
+        for node in ast.walk(module.module):
+            if isinstance(node, ast.Name):
+                names.append(node)
+                if not isinstance(node.ctx, ast.Load):
+                    self.bindings[node.id] = self.bindings.get(node.id, 0) + 1
+                elif node.id in DYNAMIC_ACCESS_NAMES:
+                    self.dynamic = True
+                continue
+            if isinstance(node, _BINDING_NODE_TYPES):
+                for name in _bound_names(node):
+                    self.bindings[name] = self.bindings.get(name, 0) + 1
+            if isinstance(node, ast.Attribute):
+                if node.attr == "__dict__":
+                    self.dynamic = True
+                if isinstance(node.ctx, ast.Load) and isinstance(node.value, ast.Name):
+                    read_attributes.add(id(node.value))
+            elif isinstance(node, ast.Import):
+                for alias in node.names:
+                    if alias.name in self.dependencies:
+                        name = alias.asname if alias.asname is not None else alias.name.partition(".")[
+                            0]
+                        module_names[name] = self.dependencies[alias.name]
+        self.escaping_dependencies = {
+            module_names[name.id] for name in names
+            if name.id in module_names and id(name) not in read_attributes}
+
+    def is_bound_once(self, name: str) -> bool:
+        return self.bindings.get(name, 0) == 1
+
+
+class ConstantPropagator:
+    """ Inlines module-level constants into the modules using them
+
+    A name bound once, at the top level of a module, to a number, string,
+    bytes, boolean or None (and never rebound in any scope) is a constant. Its
+    uses in the module itself, in modules importing it with `from module
+    import name` and as `module.name` in modules importing the module are
+    replaced with the value, transitively, following the dependency tree. If
+    `SimplifyIfPlugin` is used, the modules which changed are simplified again
+    so branches which became dead are removed.
+
+    Modules which access their namespace dynamically (`eval`, `globals()`,
+    ...) or whose module object is used as anything but `module.name` (so
+    their attributes may be changed from outside) have no constants. Modules
+    in an import cycle only see the constants of the modules in the cycle
+    which were handled first.
+    """
+    dependency_tree_modules: dict[str, ProcessedModule]
+    dependency_tree_edges: dict[str, list[str]]
+    simplify: bool
+    stats: CompilerStats | None
+    infos: dict[str, _ModuleConstantsInfo]
+    escaping: set[str]
+    constants: dict[str, dict[str, ast.Constant]]
+
+    def __init__(self, dependency_tree_modules: dict[str, ProcessedModule], dependency_tree_edges: dict[str, list[str]], plugins: list[Plugin], stats: CompilerStats | None = None) -> None:
+        self.dependency_tree_modules = dependency_tree_modules
+        self.dependency_tree_edges = dependency_tree_edges
+        self.simplify = any(isinstance(plugin, SimplifyIfPlugin)
+                            for plugin in plugins)
+        self.stats = stats
+        self.infos = {
+            path: _ModuleConstantsInfo(module, dependency_tree_edges[path])
+            for path, module in dependency_tree_modules.items()
+            if module.module is not None
+        }
+        self.escaping = set()
+        for info in self.infos.values():
+            self.escaping |= info.escaping_dependencies
+        self.constants = {}
+
+    def propagate(self) -> None:
+        """ inlines the constants of every module in the dependency tree, modifying the modules in place """
+        for path in self.infos:
+            self._propagate(path)
+
+    def _propagate(self, path: str) -> dict[str, ast.Constant]:
+        """ inlines the constants `path` uses and returns the ones it defines """
+        constants = self.constants.get(path)
+        if constants is not None:
+            return constants
+        # a module which (indirectly) imports itself sees none of its own
+        # constants through the cycle
+        self.constants[path] = {}
+        info = self.infos.get(path)
+        if info is None or info.dynamic or path in self.escaping:
+            return {}
+        assert info.module.module is not None
+
+        # the names bound by top-level imports to constants of other modules,
+        # and to modules with constants
+        names: dict[str, ast.Constant] = {}
+        module_constants: dict[str, dict[str, ast.Constant]] = {}
+        for stmt in info.module.module.body:
+            if isinstance(stmt, ast.ImportFrom) and stmt.module in info.dependencies:
+                dependency_constants = self._propagate(
+                    info.dependencies[stmt.module])
+                for alias in stmt.names:
+                    name = alias.asname if alias.asname is not None else alias.name
+                    if alias.name in dependency_constants and info.is_bound_once(name):
+                        names[name] = dependency_constants[alias.name]
+            elif isinstance(stmt, ast.Import):
+                for alias in stmt.names:
+                    # `import a.b` binds `a`, which isn't the imported module
+                    if (alias.name in info.dependencies
+                            and (alias.asname is not None or "." not in alias.name)):
+                        name = alias.asname if alias.asname is not None else alias.name
+                        dependency_constants = self._propagate(
+                            info.dependencies[alias.name])
+                        if len(dependency_constants) > 0 and info.is_bound_once(name):
+                            module_constants[name] = dependency_constants
+
+        if len(names) > 0 or len(module_constants) > 0:
+            self._substitute(info, names, module_constants)
+        # the module's own constants. inlining some of them can turn others
+        # into constants (e.g. `B = not A`), so repeat until nothing changes
+        while True:
+            own_names = {name: value for name, value in self._own_constants(info).items()
+                         if name not in names}
+            if len(own_names) == 0:
+                break
+            names.update(own_names)
+            self._substitute(info, own_names, {})
+        # names bound to imported constants are constants of this module too
+        self.constants[path] = names
+        return names
+
+    @staticmethod
+    def _own_constants(info: _ModuleConstantsInfo) -> dict[str, ast.Constant]:
+        assert info.module.module is not None
+        names: dict[str, ast.Constant] = {}
+        for stmt in info.module.module.body:
+            if isinstance(stmt, ast.Assign) and _is_inlinable(stmt.value):
+                for target in stmt.targets:
+                    if isinstance(target, ast.Name) and info.is_bound_once(target.id):
+                        names[target.id] = stmt.value  # type: ignore
+            elif (isinstance(stmt, ast.AnnAssign) and isinstance(stmt.target, ast.Name)
+                    and _is_inlinable(stmt.value) and info.is_bound_once(stmt.target.id)):
+                names[stmt.target.id] = stmt.value  # type: ignore
+        return names
+
+    def _substitute(self, info: _ModuleConstantsInfo, names: dict[str, ast.Constant], module_constants: dict[str, dict[str, ast.Constant]]) -> None:
+        module = info.module.module
+        assert module is not None
+        substituter = _ConstantSubstituter(names, module_constants)
+        substituter.visit(module)
+        if substituter.count == 0:
+            return
+        if self.stats is not None:
+            self.stats.count("inlined_constants", substituter.count)
+        if self.simplify:
+            info.module.module = SimplifyIfTransformer().visit(module)
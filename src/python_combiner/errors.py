@@ -135,14 +135,22 @@ class ImportResolutionError(CompilerError):
 
 class CircularDependencyError(CompilerError):
     modules: list[str]
+    # the path around each cycle, starting and ending with the same module
+    cycles: list[list[str]]
 
     errcode = "circular-deps"
 
-    def __init__(self, modules: list[str]) -> None:
+    def __init__(self, modules: list[str], cycles: list[list[str]] | None = None) -> None:
         self.modules = modules
+        self.cycles = cycles if cycles is not None else []
 
     def __str__(self) -> str:
-        return f"circular dependencies detected\n  {_terminal_colors.OKBLUE}{_terminal_colors.BOLD}note:{_terminal_colors.ENDC} normally this would fail at runtime\n  {_terminal_colors.OKBLUE}{_terminal_colors.BOLD}note:{_terminal_colors.ENDC} list of modules which may be involved:\n    {_terminal_colors.OKCYAN}{f'{_terminal_colors.ENDC}\n    {_terminal_colors.OKCYAN}'.join(self.modules)}{_terminal_colors.ENDC}"
+        if len(self.cycles) == 0:
+            return f"circular dependencies detected\n  {_terminal_colors.OKBLUE}{_terminal_colors.BOLD}note:{_terminal_colors.ENDC} normally this would fail at runtime\n  {_terminal_colors.OKBLUE}{_terminal_colors.BOLD}note:{_terminal_colors.ENDC} list of modules which may be involved:\n    {_terminal_colors.OKCYAN}{f'{_terminal_colors.ENDC}\n    {_terminal_colors.OKCYAN}'.join(self.modules)}{_terminal_colors.ENDC}"
+        cycles = "\n    ".join(
+            f"{_terminal_colors.OKCYAN}{f'{_terminal_colors.ENDC} -> {_terminal_colors.OKCYAN}'.join(cycle)}{_terminal_colors.ENDC}"
+            for cycle in self.cycles)
+        return f"circular dependencies detected\n  {_terminal_colors.OKBLUE}{_terminal_colors.BOLD}note:{_terminal_colors.ENDC} normally this would fail at runtime\n  {_terminal_colors.OKBLUE}{_terminal_colors.BOLD}note:{_terminal_colors.ENDC} the modules import each other like this:\n    {cycles}"
 
 
 class InternalCompilerError(CompilerError):
@@ -31,8 +31,93 @@ class {EXPORT_HELPER_NAME}(dict):
 		else:object.__delattr__(B,k)
 """
 
+LAZY_HELPER_NAME = "__generated_helper_lazy__"
+# Used in the lazy evaluation mode to only run a module factory once an attribute
+# of the module is first accessed
+LAZY_HELPER_CONTENTS = f"""
+class {LAZY_HELPER_NAME}:
+	__slots__='__generated_lazy_factory__','__generated_lazy_module__'
+	def __init__(A,f):object.__setattr__(A,'__generated_lazy_factory__',f)
+	def __generated_lazy_load__(A):
+		try:return object.__getattribute__(A,'__generated_lazy_module__')
+		except AttributeError:
+			m=object.__getattribute__(A,'__generated_lazy_factory__')();object.__setattr__(A,'__generated_lazy_module__',m);return m
+	def __getattr__(A,k):return getattr(A.__generated_lazy_load__(),k)
+	def __setattr__(A,k,v):setattr(A.__generated_lazy_load__(),k,v)
+	def __delattr__(A,k):delattr(A.__generated_lazy_load__(),k)
+	def __dir__(A):return dir(A.__generated_lazy_load__())
+	def __repr__(A):return repr(A.__generated_lazy_load__())
+"""
+
+POPULATE_HELPER_NAME = "__generated_helper_populate__"
+# Used with deferred circular imports to fill in the module object created up
+# front for a module in a cycle with the exports its factory returned. the
+# object is always an instance of the self dict export helper, or the munch one
+POPULATE_HELPER_CONTENTS_SELF_DICT = f"""
+def {POPULATE_HELPER_NAME}(A,B):A.__dict__.update(vars(B))
+"""
+POPULATE_HELPER_CONTENTS_MUNCH = f"""
+def {POPULATE_HELPER_NAME}(A,B):A.update(B)
+"""
+# the exports of the class mode are class attributes, among the class' own
+# attributes. exported names never start with an underscore
+POPULATE_HELPER_CONTENTS_CLASS = f"""
+def {POPULATE_HELPER_NAME}(A,B):A.__dict__.update((C,D)for(C,D)in vars(B).items()if C[0]!='_')
+"""
+
+SYNC_HELPER_NAME = "__generated_helper_sync__"
+# Used with deferred circular imports to copy the top-level names a module in a
+# cycle has bound so far into its module object before it imports another
+# module of the cycle, so that module sees it partially imported
+SYNC_HELPER_CONTENTS_SELF_DICT = f"""
+def {SYNC_HELPER_NAME}(A,B):A.__dict__.update((C,D)for(C,D)in B.items()if C[0]!='_')
+"""
+SYNC_HELPER_CONTENTS_MUNCH = f"""
+def {SYNC_HELPER_NAME}(A,B):A.update((C,D)for(C,D)in B.items()if C[0]!='_')
+"""
+
+DEFER_HELPER_NAME = "__generated_helper_defer__"
+RUN_HELPER_NAME = "__generated_helper_run__"
+DEFERRED_MODULES_NAME = "__generated_deferred_modules__"
+# Used with deferred circular imports to hold back the factories of the modules
+# of a cycle (other than the one the cycle is entered through) until they're
+# first imported. the factory and its arguments are kept by the id of the
+# module object, and forgotten before it runs so importing the module again
+# while it runs does nothing, like importing a partially imported module
+DEFER_HELPER_CONTENTS = f"""
+{DEFERRED_MODULES_NAME}={{}}
+def {DEFER_HELPER_NAME}(A,*B):{DEFERRED_MODULES_NAME}[id(A)]=B
+def {RUN_HELPER_NAME}(A):
+	B={DEFERRED_MODULES_NAME}.pop(id(A),None)
+	if B is not None:{POPULATE_HELPER_NAME}(A,B[0](*B[1:]))
+"""
+
 
 def get_export_helper(use_munch: bool = False):
     return ast.parse(
         EXPORT_HELPER_CONTENTS_MUNCH if use_munch else EXPORT_HELPER_CONTENTS_SELF_DICT,
         mode="exec").body[0]
+
+
+def get_lazy_helper():
+    return ast.parse(LAZY_HELPER_CONTENTS, mode="exec").body[0]
+
+
+def get_populate_helper(export_dictionary_mode: str):
+    if export_dictionary_mode == "munch":
+        contents = POPULATE_HELPER_CONTENTS_MUNCH
+    elif export_dictionary_mode == "class":
+        contents = POPULATE_HELPER_CONTENTS_CLASS
+    else:
+        contents = POPULATE_HELPER_CONTENTS_SELF_DICT
+    return ast.parse(contents, mode="exec").body[0]
+
+
+def get_sync_helper(export_dictionary_mode: str):
+    return ast.parse(
+        SYNC_HELPER_CONTENTS_MUNCH if export_dictionary_mode == "munch" else SYNC_HELPER_CONTENTS_SELF_DICT,
+        mode="exec").body[0]
+
+
+def get_defer_helpers():
+    return ast.parse(DEFER_HELPER_CONTENTS, mode="exec").body
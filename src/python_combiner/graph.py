@@ -1,52 +1,268 @@
 import unittest
+from collections import deque
+from collections.abc import Iterable
+from itertools import accumulate, chain, repeat
 
 
 class TopologicalSortError(Exception):
+    # the nodes which are part of a cycle, by name
     remaining_modules: list[str]
+    # the path around each cycle, starting and ending with the same node
+    cycles: list[list[str]]
 
-    def __init__(self, remaining_modules: list[str]) -> None:
+    def __init__(self, remaining_modules: list[str], cycles: list[list[str]] | None = None) -> None:
         self.remaining_modules = remaining_modules
+        self.cycles = cycles if cycles is not None else []
 
     def __str__(self) -> str:
         return "could not topologically sort: circular references"
 
-# I used https://mohammad-imran.medium.com/understanding-topological-sorting-with-kahns-algo-8af5a588dd0e
-# for a clear Kahn's algorithm description and implemented it by hand.
+
+class _NodeIndices(dict[str, int]):
+    """ Numbers the nodes which only appear as targets as they're looked up """
+    nodes: list[str]
+
+    def __init__(self, nodes: list[str]) -> None:
+        self.nodes = nodes
+
+    def __missing__(self, node: str) -> int:
+        index = self[node] = len(self.nodes)
+        self.nodes.append(node)
+        return index
 
 
 class Graph:
+    """ A directed graph of named nodes, stored as flat integer adjacency arrays
+
+    Nodes are numbered in the order they appear in `outgoing_edge_list` (its
+    keys first, then the nodes which only appear as targets), and the numbers
+    of the targets of every node are stored one after the other in `targets`,
+    in the order they're listed.
+
+    The orders returned only depend on the order each node lists its targets
+    in and on the names of the nodes, not on the order of the nodes in
+    `outgoing_edge_list`, so they're the same however the graph was
+    discovered.
+    """
     outgoing_edge_list: dict[str, list[str]]
+    nodes: list[str]
+    indices: dict[str, int]
+    # the targets of node `i` are `targets[offsets[i]:offsets[i + 1]]`
+    offsets: list[int]
+    targets: list[int]
 
     def __init__(self, outgoing_edge_list: dict[str, list[str]]) -> None:
         self.outgoing_edge_list = outgoing_edge_list
+        self.nodes = list(outgoing_edge_list)
+        self.indices = _NodeIndices(self.nodes)
+        self.indices.update(zip(self.nodes, range(len(self.nodes))))
+        self.targets = list(map(self.indices.__getitem__,
+                                chain.from_iterable(outgoing_edge_list.values())))
+        self.offsets = list(accumulate(
+            map(len, outgoing_edge_list.values()), initial=0))
+        # the nodes which only appear as targets have no edges
+        self.offsets.extend(repeat(len(self.targets),
+                                   len(self.nodes) - len(outgoing_edge_list)))
+
+    def _edges(self, node: int) -> list[int]:
+        return self.targets[self.offsets[node]:self.offsets[node + 1]]
 
-    def topological_sort(self):
-        indegree: dict[str, int] = {}
+    def _by_name(self, indices: Iterable[int]) -> list[int]:
+        return sorted(indices, key=self.nodes.__getitem__)
 
-        for start, end in self.outgoing_edge_list.items():
-            indegree.setdefault(start, 0)
-            for node in end:
-                indegree[node] = indegree.setdefault(node, 0) + 1
+    def _error(self) -> TopologicalSortError:
+        cycles = self.find_cycles()
+        return TopologicalSortError(
+            sorted({node for cycle in cycles for node in cycle}), cycles)
 
-        result: list[str] = []
-        queue: list[str] = []
-        for node in indegree:
-            if indegree[node] == 0:
-                queue.append(node)
+    def topological_sort(self, allow_cycles: bool = False, start: str | None = None) -> list[str]:
+        """
+        returns the nodes ordered so every node comes before the nodes it has
+        edges to, or raises `TopologicalSortError` if there's a cycle.
 
+        the nodes are visited depth first, starting from `start` and then the
+        nodes without incoming edges (by name), following the edges in order.
+        for an import graph, the reversed result is the order Python would run
+        the modules in.
+
+        with `allow_cycles`, the edges back to a node which is still being
+        visited are skipped instead, like Python does when a module imports
+        one which is still being imported, so the nodes of a cycle are only
+        ordered by when they're reached. nodes which can only be reached
+        through a cycle are visited last, by name.
+        """
+        targets, offsets = self.targets, self.offsets
+        count = len(self.nodes)
+        has_incoming = bytearray(count)
+        for target in targets:
+            has_incoming[target] = 1
+        roots = self._by_name(
+            node for node in range(count) if has_incoming[node] == 0)
+        if start is not None:
+            roots.insert(0, self.indices[start])
+        if allow_cycles:
+            roots.extend(self._by_name(range(count)))
+        # 0 if unvisited, 1 while its descendants are visited, 2 when done
+        states = bytearray(count)
+        postorder: list[int] = []
+        for root in roots:
+            if states[root] != 0:
+                continue
+            states[root] = 1
+            # the nodes being visited, and the iterators over their remaining
+            # targets
+            path = [root]
+            remaining = iter(targets[offsets[root]:offsets[root + 1]])
+            stack = [remaining]
+            while True:
+                for target in remaining:
+                    state = states[target]
+                    if state == 0:
+                        states[target] = 1
+                        path.append(target)
+                        remaining = iter(
+                            targets[offsets[target]:offsets[target + 1]])
+                        stack.append(remaining)
+                        break
+                    elif state == 1 and not allow_cycles:
+                        raise self._error()
+                else:
+                    stack.pop()
+                    node = path.pop()
+                    states[node] = 2
+                    postorder.append(node)
+                    if len(stack) == 0:
+                        break
+                    remaining = stack[-1]
+        if len(postorder) != count:
+            # some nodes can only be reached through a cycle
+            raise self._error()
+        return list(map(self.nodes.__getitem__, reversed(postorder)))
+
+    def strongly_connected_components(self) -> list[list[str]]:
+        """
+        returns the strongly connected components of the graph (found with
+        Tarjan's algorithm), each sorted by name, in an order where every
+        component comes after the components it has edges to.
+        """
+        count = len(self.nodes)
+        indices = [-1] * count
+        lowlinks = [0] * count
+        on_stack = bytearray(count)
+        stack: list[int] = []
+        components: list[list[str]] = []
+        next_index = 0
+        for start in self._by_name(range(count)):
+            if indices[start] != -1:
+                continue
+            indices[start] = lowlinks[start] = next_index
+            next_index += 1
+            stack.append(start)
+            on_stack[start] = 1
+            call_stack = [(start, iter(self._edges(start)))]
+            while len(call_stack) > 0:
+                node, remaining = call_stack[-1]
+                for target in remaining:
+                    if indices[target] == -1:
+                        indices[target] = lowlinks[target] = next_index
+                        next_index += 1
+                        stack.append(target)
+                        on_stack[target] = 1
+                        call_stack.append((target, iter(self._edges(target))))
+                        break
+                    elif on_stack[target]:
+                        lowlinks[node] = min(lowlinks[node], indices[target])
+                else:
+                    call_stack.pop()
+                    if len(call_stack) > 0:
+                        parent = call_stack[-1][0]
+                        lowlinks[parent] = min(
+                            lowlinks[parent], lowlinks[node])
+                    if lowlinks[node] == indices[node]:
+                        component: list[int] = []
+                        while True:
+                            member = stack.pop()
+                            on_stack[member] = 0
+                            component.append(member)
+                            if member == node:
+                                break
+                        components.append([self.nodes[i]
+                                          for i in self._by_name(component)])
+        return components
+
+    def _cycle_through(self, start: int, component: set[int]) -> list[str] | None:
+        """ returns the shortest path from `start` back to itself within `component` """
+        parents: dict[int, int] = {}
+        queue = deque([start])
         while len(queue) > 0:
-            item = queue.pop()
-            result.append(item)
-            for node in self.outgoing_edge_list[item]:
-                indegree[node] -= 1
-                if indegree[node] == 0:
-                    queue.append(node)
+            node = queue.popleft()
+            for target in self._edges(node):
+                if target not in component or target in parents:
+                    continue
+                parents[target] = node
+                if target == start:
+                    path = [start]
+                    node = parents[start]
+                    while node != start:
+                        path.append(node)
+                        node = parents[node]
+                    path.append(start)
+                    return [self.nodes[i] for i in reversed(path)]
+                queue.append(target)
+        return None
 
-        if len(result) != len(self.outgoing_edge_list):
-            raise TopologicalSortError(
-                list(self.outgoing_edge_list.keys() - result))
+    def find_cycles(self) -> list[list[str]]:
+        """
+        returns one cycle for each strongly connected component which has one,
+        as the path around it starting and ending at the component's first
+        node by name.
+        """
+        cycles: list[list[str]] = []
+        for component in self.strongly_connected_components():
+            start = self.indices[component[0]]
+            cycle = self._cycle_through(
+                start, {self.indices[node] for node in component})
+            if cycle is not None:
+                cycles.append(cycle)
+        return sorted(cycles)
 
-        return result
+    def levels(self) -> list[list[str]]:
+        """
+        groups the nodes into levels where every node only has edges to nodes
+        in earlier levels, so the nodes of a level can be processed
+        concurrently once the levels before it are done. for an import graph,
+        the first level is the modules which don't import anything. each
+        level is sorted by name. raises `TopologicalSortError` if there's a
+        cycle.
+        """
+        count = len(self.nodes)
+        incoming: list[list[int]] = [[] for _ in range(count)]
+        for node in range(count):
+            for target in self._edges(node):
+                incoming[target].append(node)
+        remaining = [self.offsets[node + 1] - self.offsets[node]
+                     for node in range(count)]
+        node_levels = [0] * count
+        queue = deque(i for i in range(count) if remaining[i] == 0)
+        done = 0
+        while len(queue) > 0:
+            node = queue.popleft()
+            done += 1
+            level = node_levels[node] + 1
+            for source in incoming[node]:
+                if node_levels[source] < level:
+                    node_levels[source] = level
+                remaining[source] -= 1
+                if remaining[source] == 0:
+                    queue.append(source)
+        if done != count:
+            raise self._error()
+
+        levels: list[list[int]] = [[]
+                                   for _ in range(max(node_levels, default=-1) + 1)]
+        for node in range(count):
+            levels[node_levels[node]].append(node)
+        return [[self.nodes[i] for i in self._by_name(level)] for level in levels]
 
 
 class GraphTestMethods(unittest.TestCase):
@@ -60,6 +276,22 @@ class GraphTestMethods(unittest.TestCase):
         })
         self.assertEqual(graph.topological_sort(), ["1", "2", "4", "5", "3"])
 
+    def test_stable_order(self):
+        edges = {
+            "main": ["b", "a"],
+            "a": ["shared"],
+            "b": ["shared", "c"],
+            "c": [],
+            "shared": [],
+            "other_root": ["c"],
+        }
+        expected = Graph(edges).topological_sort()
+        # the order the nodes were discovered in doesn't matter
+        self.assertEqual(
+            Graph(dict(reversed(edges.items()))).topological_sort(), expected)
+        self.assertEqual(list(reversed(expected)),
+                         ["shared", "c", "b", "a", "main", "other_root"])
+
     def test_circular(self):
         with self.assertRaises(TopologicalSortError):
             graph = Graph({
@@ -69,6 +301,51 @@ class GraphTestMethods(unittest.TestCase):
             })
             graph.topological_sort()
 
+    def test_cycle_paths(self):
+        graph = Graph({
+            "main": ["a", "x"],
+            "a": ["b"],
+            "b": ["c", "d"],
+            "c": ["a"],
+            "d": [],
+            "x": ["x"],
+        })
+        with self.assertRaises(TopologicalSortError) as context:
+            graph.topological_sort()
+        self.assertEqual(context.exception.cycles,
+                         [["a", "b", "c", "a"], ["x", "x"]])
+        self.assertEqual(context.exception.remaining_modules,
+                         ["a", "b", "c", "x"])
+        self.assertEqual(graph.strongly_connected_components(),
+                         [["d"], ["a", "b", "c"], ["x"], ["main"]])
+
+    def test_allow_cycles(self):
+        graph = Graph({
+            "a": ["b"],
+            "b": ["c", "a"],
+            "c": ["b"],
+        })
+        # like running `a`: it imports `b`, which imports `c`, and `c` and `b`
+        # get the modules still being imported
+        self.assertEqual(list(reversed(graph.topological_sort(allow_cycles=True, start="a"))),
+                         ["c", "b", "a"])
+        self.assertEqual(list(reversed(graph.topological_sort(allow_cycles=True, start="c"))),
+                         ["a", "b", "c"])
+        with self.assertRaises(TopologicalSortError):
+            graph.topological_sort(start="a")
+
+    def test_levels(self):
+        graph = Graph({
+            "main": ["a", "b"],
+            "a": ["shared"],
+            "b": ["shared", "c"],
+            "c": ["shared"],
+        })
+        self.assertEqual(graph.levels(), [
+            ["shared"], ["a", "c"], ["b"], ["main"]])
+        with self.assertRaises(TopologicalSortError):
+            Graph({"a": ["b"], "b": ["a"]}).levels()
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,316 @@
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+
+from .compiler import Compiler
+from .errors import (CompilerError, ImportResolutionError,
+                     ModuleSyntaxError, NestedModuleRecursionError,
+                     TransformError)
+from .options import CompilerOptions
+from .processedmodule import (ProcessedModule, ResolutionCache,
+                              resolution_key)
+from .resolver import ModuleResolver
+from .stats import measure
+
+
+class IncrementalCompiler(Compiler):
+    """ A long-lived compiler which only re-processes modules that changed
+
+    The dependency tree and the processed modules (along with their generated
+    factories) are kept between builds. Each call checks the modification times of the modules read
+    from disk and only re-processes the ones that changed. The factories of the
+    modules importing them don't depend on their contents, so only the calls
+    evaluating those factories are regenerated.
+
+    Tree shaking and constant propagation aren't supported, since what is
+    removed from or inlined into a module depends on the modules around it, so
+    the `tree_shaking` and `constant_propagation` options are ignored.
+    """
+    dependency_tree_modules: dict[str, ProcessedModule]
+    dependency_tree_edges: dict[str, list[str]]
+    file_stats: dict[str, tuple[int, int] | None]
+    _snapshot: dict[str, tuple[int, int] | None]
+
+    def __init__(self, path: str, options: CompilerOptions = CompilerOptions(), cache: ResolutionCache | None = None) -> None:
+        super().__init__("", path, options, cache)
+        self.file_stats = {path: self._stat(path)}
+        self.source = self._read("__main__", path)
+        self.dependency_tree_modules = {}
+        self.dependency_tree_edges = {}
+        self._snapshot = {}
+
+    def __call__(self) -> str:
+        try:
+            if len(self.dependency_tree_modules) == 0:
+                # nothing was built yet (or the first build failed), so start
+                # from scratch with the latest version of the main module
+                with measure(self.stats, "discover"):
+                    self._build()
+            else:
+                # files may have been added or removed since the last build,
+                # which can change what existing imports resolve to
+                dropped = self.cache.refresh()
+                with measure(self.stats, "update"):
+                    self._update(self.find_changed(), dropped)
+            self._track_files()
+            return self._generate_output(self.dependency_tree_modules, self.dependency_tree_edges)
+        except RecursionError:
+            raise NestedModuleRecursionError()
+        finally:
+            self._snapshot = self._take_snapshot()
+
+    def _build(self) -> None:
+        """ discovers the dependency tree from scratch """
+        self.cache.refresh()
+        changed = self.find_changed()
+        if self.path in changed:
+            self.file_stats[self.path] = self._stat(self.path)
+            self.source = self._read("__main__", self.path)
+        # don't reuse the modules of a failed build whose files changed since
+        for path in changed - {self.path}:
+            self.cache.forget(path)
+        self.file_stats = {self.path: self.file_stats[self.path]}
+
+        dependency_tree_modules: dict[str, ProcessedModule] = {}
+        dependency_tree_edges: dict[str, list[str]] = {}
+        try:
+            self._discover_dependencies(
+                [ProcessedModule(self.source, self.path,
+                                 "__main__", self.options, stats=self.stats)],
+                dependency_tree_modules, dependency_tree_edges)
+        except CompilerError as err:
+            # watch what the build got to, so fixing the file which failed
+            # (or adding a missing module next to its importer) is noticed
+            seen = list(dependency_tree_modules.keys())
+            if isinstance(err, TransformError):
+                seen.append(err.path)
+            elif isinstance(err, ImportResolutionError):
+                seen.append(err.os_error_read_path or os.path.dirname(err.path))
+            for path in seen:
+                if path not in self.file_stats:
+                    self.file_stats[path] = self._stat(path)
+            raise
+        self.dependency_tree_modules = dependency_tree_modules
+        self.dependency_tree_edges = dependency_tree_edges
+
+    def _read(self, module: str, path: str) -> str:
+        try:
+            return self.options.source_provider.read(path)
+        except OSError:
+            raise ImportResolutionError(
+                path=path, module=module, os_error_read_path=path)
+
+    def _stat(self, path: str) -> tuple[int, int] | None:
+        return self.options.source_provider.stat(path)
+
+    def _track_files(self) -> None:
+        # modules which aren't backed by a file (built-ins or ones resolved by
+        # plugins) are stored as None and never considered changed
+        for path in self.dependency_tree_modules:
+            if path not in self.file_stats:
+                self.file_stats[path] = self._stat(path)
+
+    def find_changed(self) -> set[str]:
+        """ returns the paths of the modules whose files changed since they were processed """
+        return {path for path, stat in self.file_stats.items()
+                if stat is not None and self._stat(path) != stat}
+
+    def _take_snapshot(self) -> dict[str, tuple[int, int] | None]:
+        return {path: self._stat(path) for path in self.file_stats}
+
+    def poll(self) -> bool:
+        """
+        returns whether any of the watched files changed since the last build or
+        poll. unlike `find_changed`, a change is only reported once even if the
+        build it triggers fails.
+        """
+        snapshot = self._take_snapshot()
+        changed = snapshot != self._snapshot
+        self._snapshot = snapshot
+        return changed
+
+    def _update(self, changed: set[str], dropped: set[tuple[str, str]]) -> None:
+        """
+        re-processes the `changed` modules, and re-resolves the imports whose
+        resolutions (keyed like `ResolutionCache.resolved_paths`) were
+        `dropped`, rediscovering the modules whose imports now resolve
+        elsewhere
+        """
+        if len(changed) == 0 and len(dropped) == 0:
+            return
+
+        # deleted modules can't be read, so the modules importing them are
+        # discovered again instead, which only fails if one of them still
+        # imports a deleted module. the main module can't be deleted
+        deleted = {path for path in changed
+                   if path != self.path and self._stat(path) is None}
+        changed = changed - deleted
+        importers = {path for path, edges in self.dependency_tree_edges.items()
+                     if path not in changed and path not in deleted and not deleted.isdisjoint(edges)}
+
+        # process the changed modules before touching any state so a module
+        # failing to parse leaves the previous build intact
+        reprocessed: list[ProcessedModule] = []
+        for path in changed:
+            name = self.dependency_tree_modules[path].name
+            source = self._read(name, path)
+            reprocessed.append(ProcessedModule(
+                source, path, name, self.options, stats=self.stats))
+            if name == "__main__":
+                self.source = source
+
+        # make sure modules importing a changed module get the new version,
+        # and that a deleted module is searched for again
+        for module in reprocessed:
+            if module.name != "__main__":
+                self.cache.modules[module.path] = module
+        for path in deleted:
+            self.cache.forget(path)
+
+        # a module added to the search path may shadow one an import resolved
+        # to before, e.g. one next to the importing module
+        for path, module in self.dependency_tree_modules.items():
+            if path in changed or path in deleted or path in importers:
+                continue
+            if all(resolution_key(item.module, path, self.options) not in dropped
+                   for item in module.imports):
+                continue
+            resolved = [ProcessedModule.resolve(item.module, path, self.options, self.cache).path
+                        for item in module.imports]
+            if resolved != self.dependency_tree_edges[path]:
+                importers.add(path)
+        if len(changed) == 0 and len(importers) == 0:
+            return
+
+        # rediscover the dependencies of the changed modules, which finds any
+        # modules they started importing
+        removed = changed | deleted | importers
+        dependency_tree_modules = {path: module for path, module in self.dependency_tree_modules.items()
+                                   if path not in removed}
+        dependency_tree_edges = {path: edges for path, edges in self.dependency_tree_edges.items()
+                                 if path not in removed}
+        self._discover_dependencies(
+            reprocessed + [self.dependency_tree_modules[path]
+                           for path in importers],
+            dependency_tree_modules, dependency_tree_edges)
+
+        # everything worked, so commit the new state
+        for path in changed | deleted:
+            self.file_stats.pop(path, None)
+        self.dependency_tree_modules = dependency_tree_modules
+        self.dependency_tree_edges = dependency_tree_edges
+        self._prune()
+
+    def _prune(self) -> None:
+        """ forgets modules which aren't imported anymore """
+        reachable: set[str] = set()
+        queue = [self.path]
+        while len(queue) > 0:
+            path = queue.pop()
+            if path not in reachable:
+                reachable.add(path)
+                queue.extend(self.dependency_tree_edges[path])
+        for path in list(self.dependency_tree_modules.keys()):
+            if path not in reachable:
+                del self.dependency_tree_modules[path]
+                del self.dependency_tree_edges[path]
+                self.file_stats.pop(path, None)
+                # the file isn't watched anymore, so don't let the cache hand
+                # out a possibly outdated version if it's imported again
+                self.cache.forget(path)
+
+
+class IncrementalCompilerTestMethods(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, name: str, source: str) -> None:
+        path = os.path.join(self.directory.name, name)
+        with open(path, "w") as file:
+            file.write(source)
+        # make sure the modification time changes
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    def test_deleted_module(self):
+        self.write("main.py", "import lib\nprint(lib.f())")
+        self.write("lib.py", "import helper\ndef f():\n    return helper.x")
+        self.write("helper.py", "x = 1")
+        compiler = IncrementalCompiler(
+            os.path.join(self.directory.name, "main.py"))
+        self.assertIn("x = 1", compiler())
+
+        os.remove(os.path.join(self.directory.name, "helper.py"))
+        with self.assertRaises(ImportResolutionError):
+            # `lib` still imports it
+            compiler()
+        self.write("lib.py", "def f():\n    return 2")
+        output = compiler()
+        self.assertNotIn("x = 1", output)
+        self.assertIn("return 2", output)
+        self.assertNotIn(os.path.join(self.directory.name, "helper.py"),
+                         compiler.dependency_tree_modules)
+
+    def test_failed_first_build(self):
+        self.write("main.py", "import lib\nprint(lib.f())")
+        self.write("lib.py", "import helper\ndef f():\n    return helper.x")
+        compiler = IncrementalCompiler(
+            os.path.join(self.directory.name, "main.py"))
+        with self.assertRaises(ImportResolutionError):
+            compiler()
+        self.assertFalse(compiler.poll())
+        # the missing module is added
+        self.write("helper.py", "x = (")
+        self.assertTrue(compiler.poll())
+        with self.assertRaises(ModuleSyntaxError):
+            compiler()
+        # the broken module is fixed
+        self.write("helper.py", "x = 1")
+        self.assertTrue(compiler.poll())
+        self.check_output(compiler(), "1\n")
+        # the module imported by the failed builds is changed
+        self.write("lib.py", "def f():\n    return 2")
+        self.assertTrue(compiler.poll())
+        self.check_output(compiler(), "2\n")
+
+    def check_output(self, output: str, expected: str) -> None:
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            exec(output, {"__name__": "__main__"})
+        self.assertEqual(stdout.getvalue(), expected)
+
+    def test_shadowing_module_added(self):
+        site = os.path.join(self.directory.name, "site")
+        os.mkdir(site)
+        with open(os.path.join(site, "lib.py"), "w") as file:
+            file.write("x = 'site'")
+        self.write("main.py", "import lib\nprint(lib.x)")
+        cache = ResolutionCache()
+        cache.resolver = ModuleResolver([site])
+        compiler = IncrementalCompiler(
+            os.path.join(self.directory.name, "main.py"), cache=cache)
+        self.assertIn("x = 'site'", compiler())
+
+        # a module added next to the importing one shadows the other one,
+        # even though the importing module didn't change
+        self.write("lib.py", "x = 'local'")
+        output = compiler()
+        self.assertIn("x = 'local'", output)
+        self.assertNotIn("x = 'site'", output)
+        self.assertNotIn(os.path.join(site, "lib.py"),
+                         compiler.dependency_tree_modules)
+
+        # and goes away again when it's deleted
+        os.remove(os.path.join(self.directory.name, "lib.py"))
+        output = compiler()
+        self.assertIn("x = 'site'", output)
+        self.assertNotIn("x = 'local'", output)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,9 @@
 from dataclasses import dataclass, field
 from typing import Literal
 
+from .cache import ParseCache
 from .plugin import Plugin
+from .sources import DiskSourceProvider, SourceProvider
 
 
 @dataclass
@@ -15,7 +17,38 @@ class CompilerOptions:
                              | Literal["class_instance"]) = "dict"
     export_names_mode: (Literal["locals"]
                         | Literal["static"]) = "locals"
+    evaluation_mode: (Literal["eager"]
+                      | Literal["lazy"]) = "eager"
+    # what to do with modules which import each other. "error" fails the
+    # build, "deferred" creates their module objects up front and runs each
+    # module when it's first imported, filling in its object with what it has
+    # bound so far before it imports another, like Python's partially imported
+    # modules
+    circular_imports: (Literal["error"]
+                       | Literal["deferred"]) = "error"
+    # remove unused top-level definitions and modules from the output
+    tree_shaking: bool = False
+    # inline module-level constants into the modules using them
+    constant_propagation: bool = False
     short_generated_names: bool = False
     hash_length: int = 8
 
     plugins: list[Plugin] = field(default_factory=lambda: [])
+    parse_cache: ParseCache | None = None
+    # where modules are searched for and read from
+    source_provider: SourceProvider = field(
+        default_factory=lambda: DiskSourceProvider())
+    # the number of processes used to process modules. 1 processes them all in
+    # the current process
+    jobs: int = 1
+
+    # `ignore_imports` and `remove_imports` as sets, since they're checked for
+    # every import. the lists shouldn't be changed after the options are created
+    ignore_imports_set: frozenset[str] = field(
+        init=False, repr=False, compare=False)
+    remove_imports_set: frozenset[str] = field(
+        init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        self.ignore_imports_set = frozenset(self.ignore_imports)
+        self.remove_imports_set = frozenset(self.remove_imports)
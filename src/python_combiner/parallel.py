@@ -0,0 +1,114 @@
+import ast
+import pickle
+import warnings
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from .errors import CompilerError
+from .options import CompilerOptions
+from .processedmodule import (ModuleLocation, ProcessedModule,
+                              ResolutionCache, parse_module, resolution_key)
+from .stats import CompilerStats, measure
+
+# the options of the compilation a worker process is working for, set once when
+# the worker starts so they aren't sent along with every module
+_worker_options: CompilerOptions | None = None
+_worker_collects_stats = False
+
+
+def _initialize_worker(options: CompilerOptions, collect_stats: bool) -> None:
+    global _worker_options, _worker_collects_stats
+    _worker_options = options
+    _worker_collects_stats = collect_stats
+
+
+def _parse_in_worker(location: ModuleLocation) -> tuple[tuple[ast.Module, str | None] | None, CompilerStats | None]:
+    """
+    returns the parsed module and its cache key (or None if it failed) and the
+    stats of parsing it
+    """
+    assert _worker_options is not None
+    stats = CompilerStats() if _worker_collects_stats else None
+    try:
+        with measure(stats, "read"):
+            source = location.read(_worker_options.source_provider)
+        if source is None:
+            return None, stats
+        return parse_module(
+            source,
+            location.processed_path,
+            ProcessedModule.module_name(location.path, location.module),
+            _worker_options,
+            stats), stats
+    except Exception:
+        # errors are reported when the module is processed again in the main
+        # process, so they're raised in the same order as a serial build
+        return None, stats
+
+
+def prefetch_dependencies(main_processed_module: ProcessedModule, options: CompilerOptions, cache: ResolutionCache, jobs: int) -> None:
+    """
+    processes every module reachable from `main_processed_module` in a pool of
+    `jobs` worker processes and stores them in `cache`.
+
+    modules are discovered one frontier at a time: the imports of all modules in
+    the frontier are located in this process, then read, parsed and passed
+    through `hook_module` by the workers. modules which fail to be processed
+    are skipped, so the serial discovery which follows raises the error.
+    """
+    try:
+        pickle.dumps(options)
+    except Exception:
+        warnings.warn(
+            "The compiler options (including plugins) can't be pickled, so "
+            "modules are processed serially.")
+        return
+
+    stats = cache.stats
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_initialize_worker, initargs=(options, stats is not None)) as executor:
+        frontier = [main_processed_module]
+        while len(frontier) > 0:
+            # locate every new import of the frontier
+            locations: dict[str, ModuleLocation] = {}
+            location_keys: dict[str, list[tuple[str, str]]] = {}
+            for module in frontier:
+                for item in module.imports:
+                    key = resolution_key(
+                        item.module, module.path, options)
+                    resolved_path = cache.resolved_paths.get(key)
+                    if resolved_path is not None and resolved_path in cache.modules:
+                        continue
+                    try:
+                        location = ProcessedModule.locate(
+                            item.module, module.path, options, cache)
+                    except CompilerError:
+                        continue
+                    if location.processed_path in cache.modules:
+                        cache.resolved_paths[key] = location.processed_path
+                        continue
+                    locations.setdefault(location.processed_path, location)
+                    location_keys.setdefault(
+                        location.processed_path, []).append(key)
+
+            # process them in parallel
+            futures: dict[str, Future[tuple[tuple[ast.Module, str | None] | None, CompilerStats | None]]] = {
+                path: executor.submit(_parse_in_worker, location)
+                for path, location in locations.items()
+                if location.origin is not None or location.source is not None
+            }
+            frontier = []
+            for path, location in locations.items():
+                parsed_module, cache_key = None, None
+                if path in futures:
+                    parsed, worker_stats = futures[path].result()
+                    if stats is not None and worker_stats is not None:
+                        stats.merge(worker_stats)
+                    if parsed is None:
+                        continue
+                    parsed_module, cache_key = parsed
+                processed_module = cache.get_or_create(
+                    location_keys[path][0], path,
+                    lambda: ProcessedModule(
+                        None, location.path, location.module, options, parsed_module, stats, cache_key))
+                for key in location_keys[path][1:]:
+                    cache.resolved_paths[key] = path
+                frontier.append(processed_module)
@@ -3,6 +3,7 @@ from ast import Module
 from typing import Any
 
 from ..errors import _terminal_colors
+from ..visitor import NodeCallbacks, VisitContext
 from .plugin import Plugin
 
 
@@ -24,61 +25,87 @@ class AssignmentToConstantError(Exception):
         return f"illegal assignment to a defined compiler constant\n  {_terminal_colors.OKBLUE}{_terminal_colors.BOLD}note:{_terminal_colors.ENDC} the identifier was named {_terminal_colors.OKCYAN}{self.ident}{_terminal_colors.ENDC}\n  at {self.path} {self.lineno}:{self.colno}"
 
 
+def substitute_constant(node: ast.Name, constants: dict[str, str | bool | int | float]) -> ast.expr:
+    if isinstance(node.ctx, ast.Load):
+        if node.id in constants:
+            return ast.Constant(value=constants[node.id])
+    return node
+
+
+def remove_constant_assignment(node: ast.Assign, constants: dict[str, str | bool | int | float], top_level: bool, path: str) -> ast.stmt | None:
+    # raises errors if a constant is assigned to outside of the top-level
+    # if it's top-level, silently deletes it
+    for target in node.targets.copy():
+        if (isinstance(target, ast.Name)
+            and isinstance(target.ctx, ast.Store)
+                and target.id in constants):
+            if top_level:
+                node.targets.remove(target)
+            else:
+                raise AssignmentToConstantError(
+                    target.id, path, node.lineno, node.col_offset)
+    # change the assignment to a expr if there's nothing it's assigning to
+    if len(node.targets) == 0:
+        # if it's a constant, we know for sure there are no side effects
+        if isinstance(node.value, ast.Constant):
+            return None
+        return ast.Expr(value=node.value)
+    return node
+
+
+def remove_constant_annotated_assignment(node: ast.AnnAssign, constants: dict[str, str | bool | int | float], top_level: bool, path: str) -> ast.stmt | None:
+    # raises errors if a constant is assigned to outside of the top-level
+    # if it's top-level, silently deletes it
+    if (isinstance(node.target, ast.Name)
+        and isinstance(node.target.ctx, ast.Store)
+            and node.target.id in constants):
+        if top_level:
+            return None
+        else:
+            raise AssignmentToConstantError(
+                node.target.id, path, node.lineno, node.col_offset)
+    return node
+
+
 class ConstantsTransformer(ast.NodeTransformer):
-    top_level_statements: list[ast.stmt]
+    # the ids of the statements at the top level of the module, since checking
+    # whether a node is in the module's body would scan all of it
+    top_level_statement_ids: set[int]
     constants: dict[str, str | bool | int | float]
     path: str
 
     def __init__(self, constants: dict[str, str | bool | int | float], path: str) -> None:
         self.constants = constants
-        self.top_level_statements = []
+        self.top_level_statement_ids = set()
         self.path = path
         super().__init__()
 
     def visit_Module(self, node: Module) -> Any:
-        self.top_level_statements = node.body
+        self.top_level_statement_ids = {id(statement)
+                                        for statement in node.body}
         return self.generic_visit(node)
 
     def visit_Name(self, node: ast.Name) -> Any:
-        if isinstance(node.ctx, ast.Load):
-            if node.id in self.constants:
-                return ast.Constant(value=self.constants[node.id])
+        result = substitute_constant(node, self.constants)
+        if result is not node:
+            return result
         return self.generic_visit(node)
 
     def visit_Assign(self, node: ast.Assign) -> Any:
-        top_level = node in self.top_level_statements
-        # raises errors if a constant is assigned to outside of the top-level
-        # if it's top-level, silently deletes it
-        for target in node.targets.copy():
-            if (isinstance(target, ast.Name)
-                and isinstance(target.ctx, ast.Store)
-                    and target.id in self.constants):
-                if top_level:
-                    node.targets.remove(target)
-                else:
-                    raise AssignmentToConstantError(
-                        target.id, self.path, node.lineno, node.col_offset)
-        # change the assignment to a expr if there's nothing it's assigning to
-        if len(node.targets) == 0:
-            # if it's a constant, we know for sure there are no side effects
-            if isinstance(node.value, ast.Constant):
-                return None
-            return self.generic_visit(ast.Expr(value=node.value))
-        return self.generic_visit(node)
+        top_level = id(node) in self.top_level_statement_ids
+        result = remove_constant_assignment(
+            node, self.constants, top_level, self.path)
+        if result is None:
+            return None
+        return self.generic_visit(result)
 
     def visit_AnnAssign(self, node: ast.AnnAssign) -> Any:
-        top_level = node in self.top_level_statements
-        # raises errors if a constant is assigned to outside of the top-level
-        # if it's top-level, silently deletes it
-        if (isinstance(node.target, ast.Name)
-            and isinstance(node.target.ctx, ast.Store)
-                and node.target.id in self.constants):
-            if top_level:
-                return None
-            else:
-                raise AssignmentToConstantError(
-                    node.target.id, self.path, node.lineno, node.col_offset)
-        return self.generic_visit(node)
+        top_level = id(node) in self.top_level_statement_ids
+        result = remove_constant_annotated_assignment(
+            node, self.constants, top_level, self.path)
+        if result is None:
+            return None
+        return self.generic_visit(result)
 
 
 class ConstantsPlugin(Plugin):
@@ -87,5 +114,28 @@ class ConstantsPlugin(Plugin):
     def __init__(self, constants: dict[str, str | bool | int | float]):
         self.constants = constants
 
+    def cache_key(self) -> str | None:
+        return repr(sorted(self.constants.items()))
+
     def hook_module(self, path: str, module: Module) -> Module:
         return ConstantsTransformer(self.constants, path).visit(module)
+
+    def hook_module_callbacks(self, path: str) -> NodeCallbacks:
+        constants = self.constants
+
+        def visit_Name(node: ast.Name, context: VisitContext) -> Any:
+            return substitute_constant(node, constants)
+
+        def visit_Assign(node: ast.Assign, context: VisitContext) -> Any:
+            return remove_constant_assignment(
+                node, constants, isinstance(context.parent, ast.Module), path)
+
+        def visit_AnnAssign(node: ast.AnnAssign, context: VisitContext) -> Any:
+            return remove_constant_annotated_assignment(
+                node, constants, isinstance(context.parent, ast.Module), path)
+
+        return {
+            ast.Name: visit_Name,
+            ast.Assign: visit_Assign,
+            ast.AnnAssign: visit_AnnAssign,
+        }
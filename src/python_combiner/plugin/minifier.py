@@ -1,21 +1,222 @@
-from ast import Module, fix_missing_locations, unparse
+import ast
+import inspect
+import pickle
+from ast import Module, fix_missing_locations
+from concurrent.futures import ProcessPoolExecutor
 from typing import Any
 
-from python_minifier import minify, unparse
+from python_minifier import minify
 
 from .plugin import Plugin
 
+try:
+    # the steps of `python_minifier.minify`, to minify the output's AST without
+    # unparsing it just for `minify` to parse it again. they aren't part of
+    # python-minifier's documented API, so if they can't be imported the
+    # output is minified through its source instead
+    from python_minifier import unparse as _minifier_unparse
+    from python_minifier.ast_annotation import add_parent
+    from python_minifier.rename import (add_namespace, allow_rename_globals,
+                                        allow_rename_locals, bind_names,
+                                        rename, rename_literals,
+                                        resolve_names)
+    from python_minifier.transforms.combine_imports import CombineImports
+    from python_minifier.transforms.constant_folding import FoldConstants
+    from python_minifier.transforms.remove_annotations import \
+        RemoveAnnotations
+    from python_minifier.transforms.remove_annotations_options import \
+        RemoveAnnotationsOptions
+    from python_minifier.transforms.remove_asserts import RemoveAsserts
+    from python_minifier.transforms.remove_dead_branches import \
+        RemoveDeadBranches
+    from python_minifier.transforms.remove_debug import RemoveDebug
+    from python_minifier.transforms.remove_exception_brackets import \
+        remove_no_arg_exception_call
+    from python_minifier.transforms.remove_explicit_return_none import \
+        RemoveExplicitReturnNone
+    from python_minifier.transforms.remove_literal_statements import \
+        RemoveLiteralStatements
+    from python_minifier.transforms.remove_object_base import RemoveObject
+    from python_minifier.transforms.remove_pass import RemovePass
+    from python_minifier.transforms.remove_posargs import remove_posargs
+except ImportError:
+    _CAN_MINIFY_AST = False
+else:
+    _CAN_MINIFY_AST = True
+
+
+def _minify_module(
+    module: Module,
+    remove_annotations: Any = None,
+    remove_pass: bool = True,
+    remove_literal_statements: bool = False,
+    combine_imports: bool = True,
+    hoist_literals: bool = True,
+    rename_locals: bool = True,
+    preserve_locals: list[str] | str | None = None,
+    rename_globals: bool = False,
+    preserve_globals: list[str] | str | None = None,
+    remove_object_base: bool = True,
+    convert_posargs_to_args: bool = True,
+    remove_asserts: bool = False,
+    remove_debug: bool = False,
+    remove_explicit_return_none: bool = True,
+    remove_builtin_exception_brackets: bool = True,
+    constant_folding: bool = True,
+    prefer_single_line: bool = False,
+    remove_dead_branches: bool = True
+) -> str:
+    """
+    does what `python_minifier.minify` does after parsing its source, taking
+    the same options (except for `preserve_shebang`, since an AST has no
+    shebang). `module` is modified. the minified code is still parsed again to
+    check it matches the module.
+    """
+    if remove_annotations is None:
+        remove_annotations = RemoveAnnotationsOptions()
+
+    add_parent(module)
+    add_namespace(module)
+
+    if remove_literal_statements:
+        module = RemoveLiteralStatements()(module)
+    if combine_imports:
+        module = CombineImports()(module)
+
+    if isinstance(remove_annotations, bool):
+        remove_annotations_options = RemoveAnnotationsOptions(
+            remove_variable_annotations=remove_annotations,
+            remove_return_annotations=remove_annotations,
+            remove_argument_annotations=remove_annotations,
+            remove_class_attribute_annotations=remove_annotations,
+        )
+    elif isinstance(remove_annotations, RemoveAnnotationsOptions):
+        remove_annotations_options = remove_annotations
+    else:
+        raise TypeError(
+            "remove_annotations must be a bool or RemoveAnnotationsOptions")
+    if remove_annotations_options:
+        module = RemoveAnnotations(remove_annotations_options)(module)
+
+    if remove_pass:
+        module = RemovePass()(module)
+    if remove_object_base:
+        module = RemoveObject()(module)
+    if remove_asserts:
+        module = RemoveAsserts()(module)
+    if remove_debug:
+        module = RemoveDebug()(module)
+    if constant_folding:
+        module = FoldConstants()(module)
+    if remove_dead_branches:
+        module = RemoveDeadBranches()(module)
+    if remove_explicit_return_none:
+        module = RemoveExplicitReturnNone()(module)
+
+    bind_names(module)
+    resolve_names(module)
+
+    if remove_builtin_exception_brackets and not module.tainted:
+        remove_no_arg_exception_call(module)
+
+    if module.tainted:
+        rename_globals = False
+        rename_locals = False
+
+    # copied since the same options are used for every statement
+    if preserve_locals is None:
+        preserve_locals = []
+    elif isinstance(preserve_locals, str):
+        preserve_locals = [preserve_locals]
+    else:
+        preserve_locals = list(preserve_locals)
+    if preserve_globals is None:
+        preserve_globals = []
+    elif isinstance(preserve_globals, str):
+        preserve_globals = [preserve_globals]
+    else:
+        preserve_globals = list(preserve_globals)
+    preserve_locals.extend(module.preserved)
+    preserve_globals.extend(module.preserved)
+
+    allow_rename_locals(module, rename_locals, preserve_locals)
+    allow_rename_globals(module, rename_globals, preserve_globals)
+
+    if hoist_literals:
+        rename_literals(module)
+
+    rename(module, prefix_globals=not rename_globals,
+           preserved_globals=preserve_globals)
+
+    if convert_posargs_to_args:
+        module = remove_posargs(module)
+
+    return _minifier_unparse(module, prefer_single_line=prefer_single_line)
+
+
+# the options `_minify_module` understands, other ones go through `minify`
+_AST_MINIFY_OPTIONS = set(inspect.signature(
+    _minify_module).parameters) - {"module"}
+
+
+def _minify(module: Module, minify_kwargs: dict[str, Any]) -> str:
+    """ minifies `module` without modifying it """
+    fix_missing_locations(module)
+    if _CAN_MINIFY_AST and minify_kwargs.keys() <= _AST_MINIFY_OPTIONS:
+        # minifying works in place, and the module factories in the output
+        # are shared with other builds. a pickle round trip is the fastest way
+        # to copy an AST
+        copied = pickle.loads(pickle.dumps(
+            module, protocol=pickle.HIGHEST_PROTOCOL))
+        try:
+            return _minify_module(copied, **minify_kwargs)
+        except Exception:
+            # python-minifier's checks expect ASTs it parsed itself, and its
+            # internals may not work with ASTs it didn't parse (or may have
+            # changed), so let it parse the source instead
+            pass
+    return minify(source=ast.unparse(module), **minify_kwargs)
+
+
+# the options of the minification a worker process is working for, set once
+# when the worker starts so they aren't sent along with every statement
+_worker_minify_kwargs: dict[str, Any] = {}
+
+
+def _initialize_worker(minify_kwargs: dict[str, Any]) -> None:
+    global _worker_minify_kwargs
+    _worker_minify_kwargs = minify_kwargs
+
+
+def _minify_in_worker(statement: ast.stmt) -> str:
+    return _minify(Module(body=[statement], type_ignores=[]), _worker_minify_kwargs)
+
 
 class MinifyPlugin(Plugin):
     minify_kwargs: dict[str, Any]
+    jobs: int | None
+
+    def __init__(self, jobs: int | None = None, **minify_kwargs) -> None:
+        """
+        `minify_kwargs` are passed to `python_minifier.minify`, overriding the
+        defaults. The output's AST is given straight to python-minifier's
+        transforms instead of being unparsed for `minify` to parse again.
 
-    def __init__(self, **minify_kwargs) -> None:
+        By default the whole output is minified at once, which is
+        single-threaded and slows down more than linearly with the size of the
+        output. If `jobs` is given, each top-level statement of the output
+        (i.e. each module factory) is minified separately by a pool of `jobs`
+        processes (or in this process if it's 1) and the results are joined.
+        Global names and literals are shared between statements, so then
+        globals aren't renamed and literals aren't hoisted; names local to a
+        factory (including the globals of the module it runs) still are.
+        """
         self.minify_kwargs = minify_kwargs
+        self.jobs = jobs
         return super().__init__()
 
-    def hook_unparse(self, module: Module) -> str:
-        source = unparse(fix_missing_locations(module))
-        source = minify(
+    def _get_minify_kwargs(self) -> dict[str, Any]:
+        kwargs: dict[str, Any] = dict(
             remove_annotations=True,
             combine_imports=True,
             hoist_literals=True,
@@ -28,9 +229,31 @@ class MinifyPlugin(Plugin):
             convert_posargs_to_args=True,
             remove_explicit_return_none=True,
             remove_debug=True,
-            # user overrides
-            **self.minify_kwargs,
-            # input source
-            source=source,
         )
-        return source
+        # user overrides
+        kwargs.update(self.minify_kwargs)
+        return kwargs
+
+    def hook_unparse(self, module: Module) -> str:
+        if self.jobs is not None:
+            return self._minify_statements(module)
+        return _minify(module, self._get_minify_kwargs())
+
+    def _minify_statements(self, module: Module) -> str:
+        assert self.jobs is not None
+        kwargs = self._get_minify_kwargs()
+        # a name defined by one statement can be used by any other, and
+        # hoisted literals would be defined once per statement
+        kwargs.update(rename_globals=False, hoist_literals=False)
+        if self.jobs > 1 and len(module.body) > 1:
+            with ProcessPoolExecutor(self.jobs, initializer=_initialize_worker, initargs=(kwargs,)) as executor:
+                minified = list(executor.map(
+                    _minify_in_worker, module.body,
+                    chunksize=max(len(module.body) // (self.jobs * 4), 1)))
+        else:
+            minified = [_minify(Module(body=[statement], type_ignores=[]), kwargs)
+                        for statement in module.body]
+        # statements which were removed entirely (e.g. the docstring) leave
+        # nothing behind
+        return "\n".join(source.strip("\n") for source in minified
+                         if source.strip() != "")
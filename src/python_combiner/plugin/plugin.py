@@ -6,6 +6,7 @@ if TYPE_CHECKING:
     # `options.py` which depends on this file
     from ..processedmodule import ModuleUniqueIdentifierGenerator
     from ..transformers import FoundImport
+    from ..visitor import NodeCallbacks
 
 
 class Plugin:
@@ -21,6 +22,40 @@ class Plugin:
         """
         return module
 
+    def hook_module_callbacks(self, path: str) -> "NodeCallbacks | None":
+        """ An alternative to `hook_module` run in a single traversal shared with other plugins
+
+        Return a dictionary mapping node types to callbacks, which are called
+        with each node of that type (after its children were visited) and a
+        `VisitContext`, and return what to replace the node with like a
+        `NodeTransformer` visit method would. The callbacks of consecutive
+        plugins are run in one traversal of the module instead of one per
+        plugin. If this returns callbacks, `hook_module` isn't called. Return
+        None (the default) to use `hook_module` instead.
+
+        Since the traversal is shared, a node's children have already been
+        through the callbacks of every plugin when a callback sees it. If a
+        callback replaces a node with one of a different type, the callbacks of
+        later plugins for the new type are run on it, but its children aren't
+        visited again: later plugins never see nodes created inside a
+        replacement. Plugins needing that should use `hook_module`.
+        """
+        return None
+
+    def cache_key(self) -> str | None:
+        """ Identifies the configuration of this plugin for the parse cache
+
+        Modules are cached after `hook_module` has run, keyed on (among other
+        things) the cache keys of all plugins, so this must change whenever
+        `hook_module` would produce a different result. Returning None disables
+        the cache, which is the default for plugins overriding `hook_module` or
+        `hook_module_callbacks`.
+        """
+        if (type(self).hook_module is Plugin.hook_module
+                and type(self).hook_module_callbacks is Plugin.hook_module_callbacks):
+            return ""
+        return None
+
     def hook_module_post_transform(self, path: str, module: list[ast.stmt], name_generator: "ModuleUniqueIdentifierGenerator") -> list[ast.stmt]:
         """ A hook run after name translation is performed but before modules are bundled
 
@@ -46,11 +81,31 @@ class Plugin:
         element is the path of the imported module or the string "built-in" if it's
         generated or a stdlib module or b) None to fall back to the default
         resolution.
+
+        The result is reused for later imports of the same module from the same
+        file. When any plugin overrides this hook, resolutions aren't shared
+        between files in the same directory, so the answer may depend on `path`.
         """
         return None
 
+    async def hook_import_resolution_async(self, path: str, module: str) -> tuple[str, str] | None:
+        """ `hook_import_resolution` for builds run with `Compiler.generate_async`
+
+        Override this with a coroutine to resolve modules without blocking the
+        event loop, e.g. to fetch their sources from a store. It returns the
+        same thing as `hook_import_resolution`, which it calls by default.
+        Synchronous builds only call `hook_import_resolution`, so plugins which
+        should work in both need to implement both.
+        """
+        return self.hook_import_resolution(path, module)
+
     def hook_output(self, module: ast.Module) -> ast.Module:
-        """ A hook called just prior to the end of code generation. """
+        """ A hook called just prior to the end of code generation.
+
+        The generated module factories are shared by every output built with
+        the same `ResolutionCache` (e.g. by `BatchCompiler`), so replace
+        statements instead of modifying them in place.
+        """
         return module
 
     def hook_unparse(self, module: ast.Module) -> str | None:
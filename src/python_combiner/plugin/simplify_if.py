@@ -1,20 +1,22 @@
 import ast
 import typing
+import unittest
 from ast import Module
 from typing import Any
 
+from ..visitor import NodeCallbacks
 from .plugin import Plugin
 
+# the folding functions below expect the children of the node to have been
+# simplified already
 
-class SimplifyIfTransformer(ast.NodeTransformer):
-    def __init__(self) -> None:
-        super().__init__()
 
-    def visit_BinOp(self, node: ast.BinOp) -> Any:
-        left = super().visit(node.left)
-        right = super().visit(node.right)
-        if isinstance(left, ast.Constant) and isinstance(right, ast.Constant):
-            result = None
+def fold_bin_op(node: ast.BinOp) -> ast.expr:
+    left = node.left
+    right = node.right
+    if isinstance(left, ast.Constant) and isinstance(right, ast.Constant):
+        result = None
+        try:
             match type(node.op):
                 case ast.Add:
                     result = left.value + right.value
@@ -42,44 +44,40 @@ class SimplifyIfTransformer(ast.NodeTransformer):
                     result = left.value & right.value
                 case ast.MatMult:
                     result = left.value @ right.value
-            if result is None:
+        except (ArithmeticError, TypeError, ValueError):
+            # e.g. dividing by zero, which has to fail when it's run instead
+            return node
+        if result is None:
+            raise Exception(
+                f"unsupported binary operation {type(node.op).__name__}. this is a bug.")
+        return ast.Constant(value=result)
+    return node
+
+
+def fold_bool_op(node: ast.BoolOp) -> ast.expr:
+    values = node.values
+    if all([isinstance(value, ast.Constant) for value in values]):
+        values = typing.cast(list[ast.Constant], values)
+        result = values[0].value
+        match type(node.op):
+            case ast.And:
+                for value in values[1:]:
+                    result = result and value.value
+            case ast.Or:
+                for value in values[1:]:
+                    result = result or value.value
+            case _:
                 raise Exception(
-                    f"unsupported binary operation {type(node.op).__name__}. this is a bug.")
-            return ast.Constant(value=result)
-        else:
-            return ast.BinOp(
-                left=left,
-                right=right,
-                op=node.op
-            )
+                    f"unsupported boolean operation {type(node.op).__name__}. this is a bug.")
+        return ast.Constant(value=result)
+    return node
 
-    def visit_BoolOp(self, node: ast.BoolOp) -> Any:
-        visit = super().visit
-        values = [visit(value) for value in node.values]
-        if all([isinstance(value, ast.Constant) for value in values]):
-            values = typing.cast(list[ast.Constant], values)
-            result = values[0].value
-            match type(node.op):
-                case ast.And:
-                    for value in values[1:]:
-                        result = result and value.value
-                case ast.Or:
-                    for value in values[1:]:
-                        result = result or value.value
-                case _:
-                    raise Exception(
-                        f"unsupported boolean operation {type(node.op).__name__}. this is a bug.")
-            return ast.Constant(value=result)
-        else:
-            return ast.BoolOp(
-                values=values,
-                op=node.op
-            )
 
-    def visit_UnaryOp(self, node: ast.UnaryOp) -> Any:
-        operand = super().visit(node.operand)
-        if isinstance(operand, ast.Constant):
-            result = None
+def fold_unary_op(node: ast.UnaryOp) -> ast.expr:
+    operand = node.operand
+    if isinstance(operand, ast.Constant):
+        result = None
+        try:
             match type(node.op):
                 case ast.UAdd:
                     result = +operand.value
@@ -89,50 +87,129 @@ class SimplifyIfTransformer(ast.NodeTransformer):
                     result = not operand.value
                 case ast.Invert:
                     result = ~operand.value
-            if result is None:
-                raise Exception(
-                    f"unsupported unary operation {type(node.op).__name__}. this is a bug.")
-            return ast.Constant(value=result)
+        except (ArithmeticError, TypeError, ValueError):
+            # e.g. dividing by zero, which has to fail when it's run instead
+            return node
+        if result is None:
+            raise Exception(
+                f"unsupported unary operation {type(node.op).__name__}. this is a bug.")
+        return ast.Constant(value=result)
+    return node
+
+
+def fold_if(node: ast.If) -> ast.If | list[ast.stmt]:
+    if isinstance(node.test, ast.Constant):
+        branch = node.body if node.test.value else node.orelse
+        # the statement may be the only one in its block, which can't be empty
+        return branch if len(branch) > 0 else [ast.Pass()]
+    return node
+
+
+def fold_if_exp(node: ast.IfExp) -> ast.expr:
+    if isinstance(node.test, ast.Constant):
+        if node.test.value:
+            return node.body
         else:
-            return ast.UnaryOp(
-                op=node.op,
-                operand=operand
-            )
+            return node.orelse
+    return node
 
-    def visit_If(self, node: ast.If) -> Any:
+
+class SimplifyIfTransformer(ast.NodeTransformer):
+    def __init__(self) -> None:
+        super().__init__()
+
+    def visit_BinOp(self, node: ast.BinOp) -> Any:
+        return fold_bin_op(ast.BinOp(
+            left=super().visit(node.left),
+            right=super().visit(node.right),
+            op=node.op
+        ))
+
+    def visit_BoolOp(self, node: ast.BoolOp) -> Any:
         visit = super().visit
-        test = visit(node.test)
-        body = [visit(stmt) for stmt in node.body]
-        orelse = [visit(stmt) for stmt in node.orelse]
-        if isinstance(test, ast.Constant):
-            if test.value:
-                return body
-            else:
-                return orelse
-        else:
-            return ast.If(
-                test=test,
-                body=body,
-                orelse=orelse
-            )
+        return fold_bool_op(ast.BoolOp(
+            values=[visit(value) for value in node.values],
+            op=node.op
+        ))
+
+    def visit_UnaryOp(self, node: ast.UnaryOp) -> Any:
+        return fold_unary_op(ast.UnaryOp(
+            op=node.op,
+            operand=super().visit(node.operand)
+        ))
+
+    def _visit_block(self, block: list[ast.stmt]) -> list[ast.stmt]:
+        # folded `if` statements are replaced with the statements of a branch
+        result: list[ast.stmt] = []
+        for stmt in block:
+            visited = super().visit(stmt)
+            if isinstance(visited, list):
+                result.extend(visited)
+            elif visited is not None:
+                result.append(visited)
+        return result
+
+    def visit_If(self, node: ast.If) -> Any:
+        return fold_if(ast.If(
+            test=super().visit(node.test),
+            body=self._visit_block(node.body),
+            orelse=self._visit_block(node.orelse)
+        ))
 
     def visit_IfExp(self, node: ast.IfExp) -> Any:
-        test = super().visit(node.test)
-        body = super().visit(node.body)
-        orelse = super().visit(node.orelse)
-        if isinstance(test, ast.Constant):
-            if test.value:
-                return body
-            else:
-                return orelse
-        else:
-            return ast.IfExp(
-                test=test,
-                body=body,
-                orelse=orelse
-            )
+        return fold_if_exp(ast.IfExp(
+            test=super().visit(node.test),
+            body=super().visit(node.body),
+            orelse=super().visit(node.orelse)
+        ))
 
 
 class SimplifyIfPlugin(Plugin):
+    def cache_key(self) -> str | None:
+        return ""
+
     def hook_module(self, path: str, module: Module) -> Module:
         return SimplifyIfTransformer().visit(module)
+
+    def hook_module_callbacks(self, path: str) -> NodeCallbacks:
+        def callback(fold: typing.Callable[[Any], Any]):
+            return lambda node, context: fold(node)
+        return {
+            ast.BinOp: callback(fold_bin_op),
+            ast.BoolOp: callback(fold_bool_op),
+            ast.UnaryOp: callback(fold_unary_op),
+            ast.If: callback(fold_if),
+            ast.IfExp: callback(fold_if_exp),
+        }
+
+
+class SimplifyIfTestMethods(unittest.TestCase):
+    def simplify(self, source: str) -> list[str]:
+        """ returns `source` simplified by the plugin's pass and by its fused callbacks """
+        from ..visitor import run_module_hooks
+        plugin = SimplifyIfPlugin()
+        return [
+            ast.unparse(plugin.hook_module("<test>", ast.parse(source))),
+            ast.unparse(run_module_hooks(
+                "<test>", ast.parse(source), [plugin])),
+        ]
+
+    def test_nested_ifs(self):
+        # the statements of folded inner `if`s end up in the outer block
+        for simplified in self.simplify("if True:\n    if True:\n        x = 1\n    y = 2"):
+            self.assertEqual(simplified, "x = 1\ny = 2")
+
+    def test_failing_operations(self):
+        # they have to fail when they're run instead
+        for simplified in self.simplify("a = 1 / 0\nb = 'a' + 1\nc = -'a'\nd = 1 + 2"):
+            self.assertEqual(simplified, "a = 1 / 0\nb = 'a' + 1\nc = -'a'\nd = 3")
+
+    def test_empty_branch(self):
+        for simplified in self.simplify("def f():\n    if False:\n        x = 1"):
+            self.assertEqual(simplified, "def f():\n    pass")
+            # still valid
+            ast.parse(simplified)
+
+
+if __name__ == "__main__":
+    unittest.main()
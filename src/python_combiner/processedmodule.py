@@ -1,20 +1,34 @@
 import ast
+import asyncio
 import hashlib
 import os
 import sys
-from importlib import util as import_utils
+from collections.abc import Callable
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from importlib.machinery import ModuleSpec
 
-from .errors import ImportResolutionError, ModuleSyntaxError, TransformError
-from .exporthelper import EXPORT_HELPER_NAME
+from .cache import factory_cache_key, module_cache_key
+from .errors import (CompilerError, ImportResolutionError, ModuleSyntaxError,
+                     TransformError)
+from .exporthelper import (DEFER_HELPER_NAME, EXPORT_HELPER_NAME,
+                           LAZY_HELPER_NAME, POPULATE_HELPER_NAME,
+                           RUN_HELPER_NAME)
 from .options import CompilerOptions
+from .plugin import Plugin
+from .resolver import ModuleResolver
+from .sources import SourceProvider
+from .stats import CompilerStats, measure
 from .transformers import (FoundImport, ImportVisitor, ModuleTransformer,
                            purify_identifier)
+from .visitor import run_module_hooks
 
 BUILTIN_EXPORT_INTERNAL_NAME = "exports_builtin"
 CLASS_EXPORT_CLASS_NAME = "exports"
 
 
 class ModuleUniqueIdentifierGenerator:
+    __slots__ = ("unique_module_name", "id", "minified")
     unique_module_name: str
     id: str
     minified: bool
@@ -51,86 +65,305 @@ class ModuleUniqueIdentifierGenerator:
         return self.get_internal_name(f"export_{name}")
 
 
+def parse_module(source: str, path: str, name: str, options: CompilerOptions, stats: CompilerStats | None = None) -> tuple[ast.Module, str | None]:
+    """
+    parses a module and runs the `hook_module` plugins on it, going through the
+    parse cache if there is one. returns the module and the key it's cached
+    under, or None if it can't be cached.
+    """
+    parse_cache = options.parse_cache
+    cache_key = None
+    module = None
+    if parse_cache is not None:
+        with measure(stats, "parse_cache_load"):
+            cache_key = module_cache_key(source, path, options.plugins)
+            if cache_key is not None:
+                module = parse_cache.load(cache_key)
+        if stats is not None:
+            stats.count("parse_cache_hits" if module is not None
+                        else "parse_cache_misses")
+    if module is None:
+        try:
+            with measure(stats, "parse"):
+                module = ast.parse(source, name)
+            # let plugins do their thing
+            module = run_module_hooks(path, module, options.plugins, stats)
+        except SyntaxError as err:
+            raise ModuleSyntaxError(path, err)
+        if parse_cache is not None and cache_key is not None:
+            with measure(stats, "parse_cache_store"):
+                parse_cache.store(cache_key, module)
+    if stats is not None:
+        stats.record_module(path, source, module)
+    return module, cache_key
+
+
+@dataclass(slots=True)
+class ModuleLocation:
+    """ Where the source of an imported module comes from """
+    module: str
+    context_path: str
+    # the resolved path, or "built-in" for modules without a source
+    path: str
+    # the source, if it was provided by a plugin
+    source: str | None = None
+    # the file to read the source from
+    origin: str | None = None
+
+    @property
+    def processed_path(self) -> str:
+        """ the path the `ProcessedModule` for this location will have """
+        return f"built-in:{self.module}" if self.path == "built-in" else self.path
+
+    def read(self, provider: SourceProvider) -> str | None:
+        if self.origin is None:
+            return self.source
+        try:
+            return provider.read(self.origin)
+        except OSError:
+            raise ImportResolutionError(
+                path=self.context_path, module=self.module, os_error_read_path=self.origin)
+
+
+def resolution_key(module: str, context_path: str, options: CompilerOptions) -> tuple[str, str]:
+    """
+    returns the key the resolution of `module` imported from `context_path` is
+    memoized under. modules imported from the same directory under the same
+    name are found in the same place, but plugins resolving imports are given
+    the importing file and may answer differently for each, so when there are
+    any resolutions are only shared by imports from the same file.
+    """
+    for plugin in options.plugins:
+        if (type(plugin).hook_import_resolution is not Plugin.hook_import_resolution
+                or type(plugin).hook_import_resolution_async is not Plugin.hook_import_resolution_async):
+            return (context_path, module)
+    return (os.path.dirname(context_path), module)
+
+
+class ResolutionCache:
+    """ Memoizes import resolution and module processing for a compilation
+
+    Resolution results are keyed on the imported module name and the importing
+    directory (or file, see `resolution_key`), and processed modules are keyed
+    on their resolved path, so each distinct module is only read, parsed and
+    passed through the plugins once no matter how many times it's imported.
+    """
+    resolved_paths: dict[tuple[str, str], str]
+    # where imports which were located but couldn't be processed ahead of
+    # discovery (e.g. by an async prefetch) resolved to, so discovery
+    # processes the same location again and raises the error
+    locations: dict[tuple[str, str], ModuleLocation]
+    modules: dict[str, "ProcessedModule"]
+    parse_count: int
+    stats: CompilerStats | None
+    resolver: ModuleResolver
+
+    def __init__(self, stats: CompilerStats | None = None, source_provider: SourceProvider | None = None) -> None:
+        """
+        `source_provider` is where the resolver searches for modules, which
+        should be the one in the options of the compilations using the cache.
+        """
+        self.resolved_paths = {}
+        self.locations = {}
+        self.modules = {}
+        # the number of modules whose source has been processed through this
+        # cache, either by parsing it or by loading it from the parse cache
+        self.parse_count = 0
+        # where the compilations using this cache record what they spend time on
+        self.stats = stats
+        self.resolver = ModuleResolver(provider=source_provider)
+
+    def get_or_create(self, key: tuple[str, str], path: str, factory: "Callable[[], ProcessedModule]") -> "ProcessedModule":
+        self.resolved_paths[key] = path
+        processed_module = self.modules.get(path)
+        if processed_module is None:
+            processed_module = factory()
+            if processed_module.module is not None:
+                self.parse_count += 1
+            self.modules[path] = processed_module
+        return processed_module
+
+    def refresh(self) -> set[tuple[str, str]]:
+        """
+        picks up files added to or removed from the directories modules are
+        searched in, forgetting where imports resolved to if any changed.
+        returns the keys of the resolutions which were forgotten.
+        """
+        if not self.resolver.refresh():
+            return set()
+        dropped = set(self.resolved_paths.keys())
+        self.resolved_paths.clear()
+        self.locations.clear()
+        return dropped
+
+    def forget(self, path: str) -> None:
+        """ drops the processed module at `path` so it's processed again when next resolved """
+        self.modules.pop(path, None)
+
+
 class ProcessedModule:
+    # there's one of these for every module of the project, so they're kept
+    # small
+    __slots__ = ("name", "module", "has_source", "imports", "path", "name_generator",
+                 "options", "cache_key", "factory_ast", "factory_source", "factory_error")
     name: str
+    # None for built-in modules, or once the AST was released (see
+    # `release_ast`)
     module: ast.Module | None
+    # whether the module has a source, i.e. isn't built-in
+    has_source: bool
     imports: list[FoundImport]
     path: str
     name_generator: ModuleUniqueIdentifierGenerator
     options: CompilerOptions
+    # the key the module is stored under in the parse cache
+    cache_key: str | None
+    factory_ast: ast.FunctionDef | ast.Import | None
+    factory_source: str | None
+    # the error generating the factory raised, raised again if it's generated
+    # again since the module's AST was transformed partway
+    factory_error: CompilerError | None
 
-    def __init__(self, source: str | None, path: str, imported_name: str, options: CompilerOptions) -> None:
+    def __init__(self, source: str | None, path: str, imported_name: str, options: CompilerOptions, module: ast.Module | None = None, stats: CompilerStats | None = None, cache_key: str | None = None) -> None:
+        """
+        processes a module. `module` (and the `cache_key` it's stored under)
+        can be passed to use a module which was already parsed with
+        `parse_module` (e.g. in a worker process) instead of parsing `source`.
+        the time spent is recorded in `stats` if given.
+        """
         self.options = options
-        if path == "built-in":
-            self.name = f"built-in:{imported_name}"
-        elif imported_name == "__main__":
-            self.name = "__main__"
-        else:
-            self.name = os.path.splitext(os.path.basename(path))[0]
+        self.name = self.module_name(path, imported_name)
         self.path = f"built-in:{imported_name}" if path == "built-in" else path
-        try:
-            if source is None:
-                # module is probably built-in or for some reason we don't have
-                # its raw Python source
-                self.module = None
-            else:
-                self.module = ast.parse(source, self.name)
-                # let plugins do their thing
-                for plugin in self.options.plugins:
-                    self.module = plugin.hook_module(self.path, self.module)
-        except SyntaxError as err:
-            raise ModuleSyntaxError(path, err)
+        self.cache_key = cache_key
+        if module is not None:
+            self.module = module
+        elif source is None:
+            # module is probably built-in or for some reason we don't have
+            # its raw Python source
+            self.module = None
+        else:
+            self.module, self.cache_key = parse_module(
+                source, self.path, self.name, options, stats)
+        self.has_source = self.module is not None
         self.imports = []
         self.name_generator = ModuleUniqueIdentifierGenerator(
             self.name, self.path, options.short_generated_names, options.hash_length)
+        self.factory_ast = None
+        self.factory_source = None
+        self.factory_error = None
         if self.module is not None:
-            for item in ImportVisitor.find_imports(self.module, self.path):
-                if item.module not in self.options.ignore_imports and item.module not in self.options.remove_imports:
+            with measure(stats, "find_imports"):
+                found_imports = ImportVisitor.find_imports(
+                    self.module, self.path)
+            # each module is passed to the factory once, however many times
+            # it's imported
+            imported_modules: set[str] = set()
+            for item in found_imports:
+                if item.module not in self.options.ignore_imports_set and item.module not in self.options.remove_imports_set:
                     # ask plugins for their take on this import
                     for plugin in self.options.plugins:
-                        item = plugin.hook_import(item)
-                    self.imports.append(item)
+                        with measure(stats, f"hook_import:{type(plugin).__name__}"):
+                            item = plugin.hook_import(item)
+                    if item.module not in imported_modules:
+                        imported_modules.add(item.module)
+                        self.imports.append(item)
+
+    @staticmethod
+    def module_name(path: str, imported_name: str) -> str:
+        if path == "built-in":
+            return f"built-in:{imported_name}"
+        elif imported_name == "__main__":
+            return "__main__"
+        else:
+            return os.path.splitext(os.path.basename(path))[0]
 
     @classmethod
-    def resolve(cls, module: str, context_path: str, options: CompilerOptions):
-        old_path = sys.path.copy()
-        # this assumes that the directory of this current file is always the first
-        # search path
-        sys.path[0] = os.path.dirname(context_path)
-        spec = import_utils.find_spec(module)
-        sys.path = old_path
+    def locate(cls, module: str, context_path: str, options: CompilerOptions, cache: "ResolutionCache | None" = None) -> ModuleLocation:
+        """ finds where the source of `module` imported from `context_path` comes from without reading it """
+        if cache is None:
+            cache = ResolutionCache(source_provider=options.source_provider)
+        stats = cache.stats
+        with measure(stats, "find_spec"):
+            spec = cache.resolver.find_spec(module, context_path)
 
-        # resolve stdlib modules and add a stub for ignored modules
-        if (spec is not None and (spec.origin == "built-in"
-                                  or module in options.ignore_imports
-                                  or module in options.remove_imports
-                                  or module in sys.stdlib_module_names)):
-            return cls(None, "built-in", module, options)
+        location = cls._locate_builtin(module, context_path, options, spec)
+        if location is not None:
+            return location
 
         # ask plugins for a resolution
         for plugin in options.plugins:
-            maybe_resolved = plugin.hook_import_resolution(
-                context_path, module)
+            with measure(stats, f"hook_import_resolution:{type(plugin).__name__}"):
+                maybe_resolved = plugin.hook_import_resolution(
+                    context_path, module)
             # if the plugin didn't delegate resolution to us, then use it
             # maybe_resolved[0] is source, maybe_resolved[1] is path
             if maybe_resolved is not None:
-                return cls(
-                    maybe_resolved[0],
-                    maybe_resolved[1],
-                    module,
-                    options
-                )
+                return ModuleLocation(module, context_path, maybe_resolved[1], source=maybe_resolved[0])
 
+        return cls._locate_spec(module, context_path, spec)
+
+    @classmethod
+    async def locate_async(cls, module: str, context_path: str, options: CompilerOptions, cache: "ResolutionCache", executor: Executor | None = None) -> ModuleLocation:
+        """
+        like `locate`, but searches the filesystem in `executor` and awaits the
+        plugins' `hook_import_resolution_async` instead of calling
+        `hook_import_resolution`.
+        """
+        loop = asyncio.get_running_loop()
+        spec = await loop.run_in_executor(executor, cache.resolver.find_spec, module, context_path)
+
+        location = cls._locate_builtin(module, context_path, options, spec)
+        if location is not None:
+            return location
+
+        for plugin in options.plugins:
+            maybe_resolved = await plugin.hook_import_resolution_async(
+                context_path, module)
+            if maybe_resolved is not None:
+                return ModuleLocation(module, context_path, maybe_resolved[1], source=maybe_resolved[0])
+
+        return cls._locate_spec(module, context_path, spec)
+
+    @staticmethod
+    def _locate_builtin(module: str, context_path: str, options: CompilerOptions, spec: ModuleSpec | None) -> ModuleLocation | None:
+        # resolve stdlib modules and add a stub for ignored modules
+        if (spec is not None and (spec.origin == "built-in"
+                                  or module in options.ignore_imports_set
+                                  or module in options.remove_imports_set
+                                  or module in sys.stdlib_module_names)):
+            return ModuleLocation(module, context_path, "built-in")
+        return None
+
+    @staticmethod
+    def _locate_spec(module: str, context_path: str, spec: ModuleSpec | None) -> ModuleLocation:
         # use find_spec's resolution or error if not found
         if spec is None or spec.origin is None:
             raise ImportResolutionError(path=context_path, module=module)
-        else:
-            try:
-                with open(spec.origin, "r") as file:
-                    return cls(file.read(), spec.origin, module, options)
-            except OSError:
-                raise ImportResolutionError(
-                    path=context_path, module=module, os_error_read_path=spec.origin)
+        return ModuleLocation(module, context_path, spec.origin, origin=spec.origin)
+
+    @classmethod
+    def resolve(cls, module: str, context_path: str, options: CompilerOptions, cache: "ResolutionCache | None" = None):
+        if cache is None:
+            cache = ResolutionCache(source_provider=options.source_provider)
+        # modules imported from the same directory under the same name always
+        # resolve to the same module, so skip the lookup entirely
+        key = resolution_key(module, context_path, options)
+        resolved_path = cache.resolved_paths.get(key)
+        stats = cache.stats
+        if resolved_path is not None and resolved_path in cache.modules:
+            if stats is not None:
+                stats.count("resolution_cache_hits")
+            return cache.modules[resolved_path]
+
+        location = cache.locations.pop(key, None)
+        if location is None:
+            location = cls.locate(module, context_path, options, cache)
+
+        def create() -> ProcessedModule:
+            with measure(stats, "read"):
+                source = location.read(options.source_provider)
+            return cls(source, location.path, module, options, stats=stats)
+        return cache.get_or_create(key, location.processed_path, create)
 
     def _globals_names(self, module: ast.Module) -> list[str]:
         names: list[str] = []
@@ -162,7 +395,103 @@ class ProcessedModule:
         )
 
     def generate_factory_ast(self) -> ast.FunctionDef | ast.Import:
-        if self.module is None:
+        """
+        generates the function which runs the module and returns its exports.
+        the module's AST is transformed in place, so the result is cached and
+        shared by every output including this module.
+        """
+        if self.factory_error is not None:
+            raise self.factory_error
+        if self.factory_ast is None:
+            if self.module is None and self.has_source:
+                # the AST was released, so all that's left is the unparsed
+                # factory. the line numbers are those of the factory's source
+                # instead of the module's now
+                assert self.factory_source is not None
+                self.factory_ast = ast.parse(self.factory_source).body[0]  # type: ignore
+            else:
+                try:
+                    self.factory_ast = self._generate_factory_ast()
+                except CompilerError as err:
+                    self.factory_error = err
+                    raise
+        return self.factory_ast
+
+    def release_ast(self) -> None:
+        """
+        drops the module's AST (and its factory's) once the factory was
+        unparsed with `store_factory_source`. only the source is needed to
+        write the output, and on large projects the ASTs of every module take
+        up most of the compiler's memory.
+
+        with tree shaking or constant propagation, the AST is kept, since they
+        go through the ASTs of every module again when it's built again.
+        """
+        if (self.factory_source is not None
+                and not self.options.tree_shaking and not self.options.constant_propagation):
+            self.module = None
+            self.factory_ast = None
+
+    def _factory_cache_key(self) -> str | None:
+        """
+        computes the key the unparsed factory is stored under in the parse
+        cache, or returns None if it can't be cached.
+        """
+        options = self.options
+        if (not self.has_source or self.cache_key is None
+                # names are numbered in the order they're generated
+                or options.short_generated_names
+                # modules are shaken differently depending on what uses them
+                or options.tree_shaking
+                # and the constants inlined depend on the modules around them
+                or options.constant_propagation):
+            return None
+        for plugin in options.plugins:
+            # these change the factory without being covered by `cache_key`
+            if (type(plugin).hook_import is not Plugin.hook_import
+                    or type(plugin).hook_module_post_transform is not Plugin.hook_module_post_transform):
+                return None
+        return factory_cache_key(
+            self.cache_key,
+            self.name,
+            options.ignore_imports,
+            options.remove_imports,
+            options.export_dictionary_mode,
+            options.export_names_mode,
+            options.hash_length)
+
+    def load_factory_source(self, stats: CompilerStats | None = None) -> str | None:
+        """
+        returns the unparsed factory if it was already generated for this
+        module, or for the same module with the same options in an earlier
+        build (through the parse cache). returns None if it needs to be
+        generated.
+        """
+        if self.factory_source is not None:
+            return self.factory_source
+        parse_cache = self.options.parse_cache
+        if parse_cache is None:
+            return None
+        key = self._factory_cache_key()
+        if key is None:
+            return None
+        self.factory_source = parse_cache.load_fragment(key)
+        if stats is not None:
+            stats.count("factory_cache_hits" if self.factory_source is not None
+                        else "factory_cache_misses")
+        return self.factory_source
+
+    def store_factory_source(self, source: str) -> None:
+        """ keeps the unparsed factory to be returned by `load_factory_source` """
+        self.factory_source = source
+        parse_cache = self.options.parse_cache
+        if parse_cache is not None:
+            key = self._factory_cache_key()
+            if key is not None:
+                parse_cache.store_fragment(key, source)
+
+    def _generate_factory_ast(self) -> ast.FunctionDef | ast.Import:
+        if not self.has_source:
             # we don't have the code for the module, so it must be built-in
             return ast.FunctionDef(
                 name=self.name_generator.get_factory(),
@@ -240,7 +569,7 @@ class ProcessedModule:
                                 ],
                                 value=ast.Name(id=self.name_generator.get_export_property_name(
                                     name), ctx=ast.Load())
-                            ) for name in globals_names]
+                            ) for name in globals_names] or [ast.Pass()]
                         ),
                         decorator_list=[],
                         type_params=[]
@@ -272,13 +601,13 @@ class ProcessedModule:
                                     targets=[
                                         ast.Attribute(
                                             value=ast.Name(
-                                                id="self", ctx=ast.Store()),
+                                                id="self", ctx=ast.Load()),
                                             attr=name,
                                             ctx=ast.Store()
                                         )
                                     ],
                                     value=ast.Name(id=name, ctx=ast.Load())
-                                ) for name in globals_names],
+                                ) for name in globals_names] or [ast.Pass()],
                                 decorator_list=[],
                                 type_params=[]
                             )
@@ -332,7 +661,60 @@ class ProcessedModule:
                 type_params=[]
             )
 
-    def generate_evaluated_factory_ast(self, argument_imports: list[str]) -> ast.stmt:
+    def generate_preallocated_module_ast(self) -> ast.stmt:
+        """
+        generates the statement creating the (empty) module object of a module
+        which is part of a cycle, before any module of the cycle runs
+        """
+        return ast.Assign(
+            targets=[
+                ast.Name(
+                    id=self.name_generator.get_evaluated_factory(), ctx=ast.Store())
+            ],
+            value=ast.Call(
+                func=ast.Name(id=EXPORT_HELPER_NAME, ctx=ast.Load()),
+                args=[ast.Dict(keys=[], values=[])],
+                keywords=[]
+            )
+        )
+
+    def generate_deferred_factory_ast(self, argument_imports: list[str]) -> ast.stmt:
+        """
+        generates the statement holding back the factory of a module which is
+        part of a cycle (but isn't the module the cycle is entered through)
+        until it's first imported, see `generate_run_deferred_ast`
+        """
+        return ast.Expr(value=ast.Call(
+            func=ast.Name(id=DEFER_HELPER_NAME, ctx=ast.Load()),
+            args=[
+                ast.Name(
+                    id=self.name_generator.get_evaluated_factory(), ctx=ast.Load()),
+                ast.Name(id=self.name_generator.get_factory(), ctx=ast.Load()),
+                *[ast.Name(id=name, ctx=ast.Load()) for name in argument_imports]
+            ],
+            keywords=[]
+        ))
+
+    def generate_run_deferred_ast(self) -> ast.stmt:
+        """
+        generates the statement running the factory held back by
+        `generate_deferred_factory_ast`, unless it already started
+        """
+        return ast.Expr(value=ast.Call(
+            func=ast.Name(id=RUN_HELPER_NAME, ctx=ast.Load()),
+            args=[ast.Name(
+                id=self.name_generator.get_evaluated_factory(), ctx=ast.Load())],
+            keywords=[]
+        ))
+
+    def generate_evaluated_factory_ast(self, argument_imports: list[str], deferred: bool = False) -> ast.stmt:
+        """
+        generates the statement running the factory. with `deferred`, the
+        module is the one a cycle is entered through, and its exports are
+        copied into the module object created by
+        `generate_preallocated_module_ast` instead, which is what the other
+        modules of the cycle were given.
+        """
         if self.name == "__main__":
             return ast.Expr(value=ast.Call(
                 func=ast.Name(
@@ -346,21 +728,48 @@ class ProcessedModule:
                 keywords=[]
             ))
         else:
-            return ast.Assign(
-                targets=[
+            value: ast.expr = ast.Call(
+                func=ast.Name(
+                    id=self.name_generator.get_factory(),
+                    ctx=ast.Load()
+                ),
+                args=[
                     ast.Name(
-                        id=self.name_generator.get_evaluated_factory(), ctx=ast.Store())
-                ],
-                value=ast.Call(
-                    func=ast.Name(
-                        id=self.name_generator.get_factory(),
+                        id=name,
                         ctx=ast.Load()
-                    ),
+                    ) for name in argument_imports],
+                keywords=[]
+            )
+            if deferred:
+                return ast.Expr(value=ast.Call(
+                    func=ast.Name(id=POPULATE_HELPER_NAME, ctx=ast.Load()),
                     args=[
                         ast.Name(
-                            id=name,
-                            ctx=ast.Load()
-                        ) for name in argument_imports],
+                            id=self.name_generator.get_evaluated_factory(), ctx=ast.Load()),
+                        value
+                    ],
+                    keywords=[]
+                ))
+            if self.options.evaluation_mode == "lazy":
+                # defer calling the factory until the module is first used
+                value = ast.Call(
+                    func=ast.Name(id=LAZY_HELPER_NAME, ctx=ast.Load()),
+                    args=[ast.Lambda(
+                        args=ast.arguments(
+                            posonlyargs=[],
+                            args=[],
+                            kwonlyargs=[],
+                            kw_defaults=[],
+                            defaults=[]
+                        ),
+                        body=value
+                    )],
                     keywords=[]
                 )
+            return ast.Assign(
+                targets=[
+                    ast.Name(
+                        id=self.name_generator.get_evaluated_factory(), ctx=ast.Store())
+                ],
+                value=value
             )
@@ -0,0 +1,245 @@
+import os
+import sys
+import tempfile
+import unittest
+from dataclasses import dataclass
+from importlib.machinery import (BYTECODE_SUFFIXES, EXTENSION_SUFFIXES,
+                                 SOURCE_SUFFIXES, BuiltinImporter,
+                                 FrozenImporter, ModuleSpec, PathFinder)
+
+from .sources import DiskSourceProvider, MemorySourceProvider, SourceProvider
+
+# the order `FileFinder` tries file suffixes in
+MODULE_SUFFIXES = EXTENSION_SUFFIXES + SOURCE_SUFFIXES + BYTECODE_SUFFIXES
+
+
+@dataclass
+class _DirectoryListing:
+    stat: tuple[int, int]
+    files: set[str]
+    directories: set[str]
+
+
+# what searching a single directory found: a spec, a namespace package portion
+# (the directory it would be in) or nothing
+_SearchResult = ModuleSpec | str | None
+
+
+class ModuleResolver:
+    """ Finds the spec of a module like `importlib.util.find_spec`, but faster
+
+    Each search directory is listed once with `os.scandir` and the listing is
+    reused for every lookup, so finding a module is mostly set lookups instead
+    of a `stat` per directory and suffix. Specs are cached per importing
+    directory. Unlike `importlib.util.find_spec`, `sys.path` isn't modified to
+    search the importing module's directory, so a resolver can be used from
+    several threads.
+
+    Parent packages of dotted modules aren't imported to find their
+    submodules, and modules already in `sys.modules` aren't treated specially.
+    Search path entries which aren't directories (e.g. zip files) fall back to
+    `PathFinder`. Call `refresh` to pick up changes to the filesystem.
+
+    Directories are listed by `provider`, so modules can be found in memory or
+    in an archive as well as on disk. Providers which don't search the
+    filesystem don't fall back to importlib, and treat the standard library
+    modules they don't have as built-in.
+    """
+    search_path: list[str]
+    provider: SourceProvider
+    _listings: dict[str, _DirectoryListing | None]
+    _specs: dict[tuple[str, str], ModuleSpec | None]
+
+    def __init__(self, search_path: list[str] | None = None, provider: SourceProvider | None = None) -> None:
+        """
+        `search_path` is where modules are searched for after the directory of
+        the importing module, defaulting to `sys.path` without its first entry
+        (the directory of the running script). `provider` defaults to the
+        filesystem.
+        """
+        self.search_path = sys.path[1:] if search_path is None else search_path
+        self.provider = provider if provider is not None else DiskSourceProvider()
+        self._listings = {}
+        self._specs = {}
+
+    def refresh(self) -> bool:
+        """
+        forgets listings of directories which changed since they were listed,
+        returning whether there were any
+        """
+        changed = False
+        for directory, listing in list(self._listings.items()):
+            stat = self.provider.stat(directory)
+            if stat != (listing.stat if listing is not None else None):
+                del self._listings[directory]
+                changed = True
+        if changed:
+            self._specs.clear()
+        return changed
+
+    def _list(self, directory: str) -> _DirectoryListing | None:
+        if directory in self._listings:
+            return self._listings[directory]
+        listing = None
+        stat = self.provider.stat(directory)
+        if stat is not None:
+            contents = self.provider.list_directory(directory)
+            if contents is not None:
+                listing = _DirectoryListing(stat, *contents)
+        self._listings[directory] = listing
+        return listing
+
+    def _search_directory(self, name: str, tail: str, directory: str) -> _SearchResult:
+        """ looks for the module `name` (ending in `tail`) in `directory` like `FileFinder` """
+        listing = self._list(directory)
+        if listing is None:
+            # not a directory we can list, so let importlib deal with it
+            if self.provider.searches_filesystem:
+                return PathFinder.find_spec(name, [directory])
+            return None
+        namespace_portion = None
+        if tail in listing.directories:
+            package_directory = os.path.join(directory, tail)
+            package_listing = self._list(package_directory)
+            if package_listing is not None:
+                for suffix in MODULE_SUFFIXES:
+                    if f"__init__{suffix}" in package_listing.files:
+                        spec = ModuleSpec(
+                            name, None,
+                            origin=os.path.join(
+                                package_directory, f"__init__{suffix}"),
+                            is_package=True)
+                        spec.submodule_search_locations = [package_directory]
+                        return spec
+            namespace_portion = package_directory
+        for suffix in MODULE_SUFFIXES:
+            if f"{tail}{suffix}" in listing.files:
+                return ModuleSpec(name, None, origin=os.path.join(directory, f"{tail}{suffix}"))
+        return namespace_portion
+
+    def _search(self, name: str, directories: list[str]) -> ModuleSpec | None:
+        tail = name.rpartition(".")[2]
+        namespace_portions: list[str] = []
+        for directory in directories:
+            result = self._search_directory(name, tail, directory or ".")
+            if isinstance(result, ModuleSpec):
+                if result.loader is None and result.origin is None:
+                    # a namespace package found by `PathFinder`
+                    namespace_portions.extend(
+                        result.submodule_search_locations or [])
+                    continue
+                return result
+            elif result is not None:
+                namespace_portions.append(result)
+        if len(namespace_portions) > 0:
+            spec = ModuleSpec(name, None, is_package=True)
+            spec.submodule_search_locations = namespace_portions
+            return spec
+        return None
+
+    def find_spec(self, module: str, context_path: str) -> ModuleSpec | None:
+        """
+        finds the spec of `module` imported from the file `context_path`, or
+        returns None if it doesn't exist. the spec's origin is the path of the
+        module's file, "built-in" or "frozen", or None for namespace packages.
+        """
+        context_directory = os.path.dirname(context_path)
+        key = (context_directory, module)
+        if key in self._specs:
+            return self._specs[key]
+
+        spec = None
+        parent, _, _ = module.rpartition(".")
+        if parent != "":
+            parent_spec = self.find_spec(parent, context_path)
+            if parent_spec is not None and parent_spec.submodule_search_locations is not None:
+                spec = self._search(
+                    module, parent_spec.submodule_search_locations)
+        else:
+            # the same order as `sys.meta_path`
+            spec = BuiltinImporter.find_spec(module)
+            if spec is None:
+                spec = FrozenImporter.find_spec(module)
+            if spec is None:
+                spec = self._search(
+                    module, [context_directory, *self.search_path])
+            if spec is None and self.provider.searches_filesystem:
+                for finder in sys.meta_path:
+                    if finder in (BuiltinImporter, FrozenImporter, PathFinder):
+                        continue
+                    find_spec = getattr(finder, "find_spec", None)
+                    if find_spec is not None:
+                        spec = find_spec(module, None)
+                        if spec is not None:
+                            break
+        if (spec is None and not self.provider.searches_filesystem
+                and module.partition(".")[0] in sys.stdlib_module_names):
+            # the standard library isn't in the provider, and it isn't
+            # bundled anyway
+            spec = ModuleSpec(module, None, origin="built-in")
+        self._specs[key] = spec
+        return spec
+
+
+class ModuleResolverTestMethods(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        root = self.directory.name
+        for path in ["main.py", "module.py", "package/__init__.py",
+                     "package/submodule.py", "namespace/inner.py"]:
+            os.makedirs(os.path.join(root, os.path.dirname(path)),
+                        exist_ok=True)
+            with open(os.path.join(root, path), "w"):
+                pass
+        self.context_path = os.path.join(root, "main.py")
+        self.resolver = ModuleResolver([])
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def origin(self, module: str) -> str | None:
+        spec = self.resolver.find_spec(module, self.context_path)
+        return spec.origin if spec is not None else None
+
+    def test_modules(self):
+        root = self.directory.name
+        self.assertEqual(self.origin("module"),
+                         os.path.join(root, "module.py"))
+        self.assertEqual(self.origin("package"),
+                         os.path.join(root, "package", "__init__.py"))
+        self.assertEqual(self.origin("package.submodule"),
+                         os.path.join(root, "package", "submodule.py"))
+        self.assertEqual(self.origin("namespace.inner"),
+                         os.path.join(root, "namespace", "inner.py"))
+        self.assertEqual(self.origin("sys"), "built-in")
+        self.assertIsNone(self.origin("namespace"))
+        self.assertIsNone(self.origin("module.attribute"))
+        self.assertIsNone(self.origin("missing"))
+
+    def test_refresh(self):
+        self.assertIsNone(self.origin("added"))
+        with open(os.path.join(self.directory.name, "added.py"), "w"):
+            pass
+        # make sure the directory's modification time changes
+        os.utime(self.directory.name, ns=(0, 0))
+        self.resolver.refresh()
+        self.assertEqual(self.origin("added"),
+                         os.path.join(self.directory.name, "added.py"))
+
+    def test_memory_provider(self):
+        self.resolver = ModuleResolver(["/site"], MemorySourceProvider({
+            "/app/main.py": "",
+            "/app/package/__init__.py": "",
+            "/site/library.py": "",
+        }))
+        self.context_path = "/app/main.py"
+        self.assertEqual(self.origin("package"), "/app/package/__init__.py")
+        self.assertEqual(self.origin("library"), "/site/library.py")
+        # the standard library isn't searched for
+        self.assertEqual(self.origin("json"), "built-in")
+        self.assertEqual(self.origin("os.path"), "built-in")
+        self.assertIsNone(self.origin("module"))
+
+
+if __name__ == "__main__":
+    unittest.main()
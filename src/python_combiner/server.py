@@ -0,0 +1,265 @@
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import socket
+import stat
+import sys
+import tempfile
+import time
+import traceback
+import unittest
+import unittest.mock
+import warnings
+from typing import BinaryIO
+
+from . import errors
+from .cache import MemoryParseCache, ParseCache
+from .client import (check_private, get_default_socket_directory,
+                     get_default_socket_path, request)
+from .processedmodule import ResolutionCache
+from .resolver import ModuleResolver
+
+
+class Session:
+    """ What a server keeps warm between the builds it runs
+
+    Resolution (per search path) and parsed modules are kept in memory.
+    Processed modules aren't shared between builds, since the files they come
+    from may change in between.
+    """
+    parse_cache: MemoryParseCache
+    resolvers: dict[tuple[str, ...], ModuleResolver]
+    search_path: list[str] | None
+
+    def __init__(self) -> None:
+        self.parse_cache = MemoryParseCache()
+        self.resolvers = {}
+        # the search path of the build currently running
+        self.search_path = None
+
+    def create_parse_cache(self, fallback: ParseCache | None) -> ParseCache:
+        """ returns the parse cache for a build using `fallback` for modules not in memory """
+        self.parse_cache.fallback = fallback
+        return self.parse_cache
+
+    def create_resolution_cache(self) -> ResolutionCache:
+        cache = ResolutionCache()
+        key = tuple(
+            self.search_path if self.search_path is not None else sys.path[1:])
+        resolver = self.resolvers.get(key)
+        if resolver is None:
+            resolver = self.resolvers[key] = ModuleResolver(list(key))
+        else:
+            resolver.refresh()
+        cache.resolver = resolver
+        return cache
+
+
+class _StreamWriter(io.TextIOBase):
+    """ Sends everything written to it to a client as messages """
+
+    def __init__(self, name: str, stream: BinaryIO) -> None:
+        self.stream_name = name
+        self.stream = stream
+
+    @property
+    def name(self) -> str:
+        return f"<{self.stream_name}>"
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: str) -> int:
+        if len(data) > 0:
+            _send(self.stream, {"stream": self.stream_name, "data": data})
+        return len(data)
+
+
+def _send(stream: BinaryIO, message: dict) -> None:
+    stream.write(json.dumps(message).encode() + b"\n")
+    stream.flush()
+
+
+def _run(request: dict, stream: BinaryIO, session: Session) -> int:
+    """ runs the CLI for a request with its output going to `stream`, returning the exit code """
+    from .cli import main
+
+    stdout = _StreamWriter("stdout", stream)
+    stderr = _StreamWriter("stderr", stream)
+    stdin = io.StringIO(request.get("stdin") or "")
+    stdin.name = "<stdin>"
+    old_streams = (sys.stdin, sys.stdout, sys.stderr)
+    old_cwd = os.getcwd()
+    sys.stdin, sys.stdout, sys.stderr = stdin, stdout, stderr
+    errors._terminal_colors.set_isatty(bool(request.get("isatty")))
+    session.search_path = request.get("search_path")
+    try:
+        os.chdir(request["cwd"])
+        with warnings.catch_warnings():
+            main(list(request["argv"]), session)
+        return 0
+    except SystemExit as err:
+        if err.code is None:
+            return 0
+        return err.code if isinstance(err.code, int) else 1
+    except Exception:
+        traceback.print_exc()
+        return 1
+    finally:
+        sys.stdin, sys.stdout, sys.stderr = old_streams
+        os.chdir(old_cwd)
+        session.search_path = None
+
+
+def _handle(connection: socket.socket, session: Session) -> None:
+    with connection, connection.makefile("rwb") as stream:
+        line = stream.readline()
+        if not line:
+            return
+        try:
+            request = json.loads(line)
+        except json.JSONDecodeError:
+            return
+        exit_code = _run(request, stream, session)
+        _send(stream, {"exit": exit_code})
+
+
+def _prepare_socket_path(socket_path: str) -> None:
+    """
+    creates the directory of the default socket if needed and removes a socket
+    left behind by a server which is no longer running
+    """
+    directory = os.path.dirname(socket_path)
+    if directory == get_default_socket_directory():
+        try:
+            os.mkdir(directory, 0o700)
+        except FileExistsError:
+            pass
+        # someone else might have created it first
+        check_private(directory, stat.S_IFDIR)
+    try:
+        if not stat.S_ISSOCK(os.lstat(socket_path).st_mode):
+            raise OSError(f"{socket_path} exists and isn't a socket")
+    except FileNotFoundError:
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+    except OSError:
+        os.remove(socket_path)
+        return
+    finally:
+        probe.close()
+    raise OSError(f"a server is already listening on {socket_path}")
+
+
+def serve(socket_path: str | None = None, session: Session | None = None) -> None:
+    """
+    listens for builds on a Unix socket at `socket_path` until interrupted,
+    running them one at a time with the caches of `session`.
+    """
+    if socket_path is None:
+        socket_path = get_default_socket_path()
+    if session is None:
+        session = Session()
+    _prepare_socket_path(socket_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        # only the user running the server may use it, from the moment it's
+        # created
+        umask = os.umask(0o177)
+        try:
+            server.bind(socket_path)
+        finally:
+            os.umask(umask)
+        os.chmod(socket_path, 0o600)
+        server.listen()
+        while True:
+            connection, _ = server.accept()
+            try:
+                _handle(connection, session)
+            except OSError:
+                # the client went away
+                pass
+    finally:
+        server.close()
+        try:
+            os.remove(socket_path)
+        except OSError:
+            pass
+
+
+class ServerTestMethods(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.socket_path = os.path.join(self.directory.name, "server.sock")
+        with open(os.path.join(self.directory.name, "main.py"), "w") as file:
+            file.write("import lib\nprint(lib.x)")
+        with open(os.path.join(self.directory.name, "lib.py"), "w") as file:
+            file.write("x = 1")
+        self.server = multiprocessing.Process(
+            target=serve, args=(self.socket_path,), daemon=True)
+        self.server.start()
+        for _ in range(500):
+            if os.path.exists(self.socket_path):
+                break
+            time.sleep(0.01)
+
+    def tearDown(self):
+        self.server.terminate()
+        self.server.join()
+        self.directory.cleanup()
+
+    def run_client(self, argv: list[str]) -> tuple[int | None, str]:
+        stdout = io.StringIO()
+        old_cwd = os.getcwd()
+        os.chdir(self.directory.name)
+        try:
+            with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(io.StringIO()):
+                exit_code = request(argv, self.socket_path)
+        finally:
+            os.chdir(old_cwd)
+        return exit_code, stdout.getvalue()
+
+    def test_round_trip(self):
+        exit_code, output = self.run_client(["-i", "main.py"])
+        self.assertEqual(exit_code, 0)
+        self.assertIn("x = 1", output)
+        # the output goes where the client asked for it
+        exit_code, output = self.run_client(["-i", "main.py", "-o", "out.py"])
+        self.assertEqual(exit_code, 0)
+        with open(os.path.join(self.directory.name, "out.py")) as file:
+            self.assertIn("x = 1", file.read())
+
+    def test_failed_build(self):
+        exit_code, _ = self.run_client(["-i", "missing.py"])
+        self.assertNotEqual(exit_code, 0)
+
+    def test_socket_permissions(self):
+        self.assertEqual(os.stat(self.socket_path).st_mode & 0o777, 0o600)
+        # a client won't talk to a socket others can use
+        os.chmod(self.socket_path, 0o666)
+        exit_code, _ = self.run_client(["-i", "main.py"])
+        self.assertIsNone(exit_code)
+
+    def test_default_socket_directory(self):
+        environment = {"XDG_RUNTIME_DIR": self.directory.name,
+                       "PYTHON_COMBINER_SOCKET": ""}
+        with unittest.mock.patch.dict(os.environ, environment):
+            socket_path = get_default_socket_path()
+            _prepare_socket_path(socket_path)
+            directory = os.path.dirname(socket_path)
+            self.assertEqual(os.stat(directory).st_mode & 0o777, 0o700)
+            # a client won't use a directory others can put a socket in
+            os.chmod(directory, 0o777)
+            os.symlink(self.socket_path, socket_path)
+            with contextlib.redirect_stderr(io.StringIO()):
+                self.assertIsNone(request(["-i", "main.py"]))
+            with self.assertRaises(OSError):
+                _prepare_socket_path(socket_path)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,373 @@
+import abc
+import io
+import mmap
+import os
+import tarfile
+import tempfile
+import threading
+import unittest
+import zipfile
+from importlib.util import decode_source
+
+# the files and subdirectories of a directory
+DirectoryContents = tuple[set[str], set[str]]
+
+
+class SourceProvider(abc.ABC):
+    """ Where the compiler lists directories and reads the sources of modules from
+
+    `ModuleResolver` searches for modules in the directories listed by the
+    provider, and the sources of the modules it finds are read from it. The
+    default, `DiskSourceProvider`, uses the filesystem. Providers may be used
+    from several threads at once. Subclasses implement `list_directory`, `read`
+    and `stat`.
+    """
+    # whether the directories the provider can't list (e.g. zip files on
+    # `sys.path`) and the finders on `sys.meta_path` are searched too. if not,
+    # modules which aren't found and whose top-level package is in the
+    # standard library are treated as built-in
+    searches_filesystem: bool = False
+
+    @abc.abstractmethod
+    def list_directory(self, directory: str) -> DirectoryContents | None:
+        """ returns the files and subdirectories of `directory`, or None if it isn't a directory """
+
+    @abc.abstractmethod
+    def read(self, path: str) -> str:
+        """ returns the source of the file at `path`, raising `OSError` if it can't be read """
+
+    @abc.abstractmethod
+    def stat(self, path: str) -> tuple[int, int] | None:
+        """
+        returns the modification time (in nanoseconds) and size of `path`, or
+        None if it doesn't exist. these are only compared to find out whether
+        a file or directory changed.
+        """
+
+
+class DiskSourceProvider(SourceProvider):
+    searches_filesystem = True
+
+    def list_directory(self, directory: str) -> DirectoryContents | None:
+        files: set[str] = set()
+        directories: set[str] = set()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir():
+                            directories.add(entry.name)
+                        else:
+                            files.add(entry.name)
+                    except OSError:
+                        continue
+        except OSError:
+            return None
+        return files, directories
+
+    def read(self, path: str) -> str:
+        with open(path, "r") as file:
+            return file.read()
+
+    def stat(self, path: str) -> tuple[int, int] | None:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+
+class _IndexedSourceProvider(SourceProvider):
+    """ A provider whose files are known up front, indexed by directory """
+    _files: dict[str, int]
+    _directories: dict[str, DirectoryContents]
+
+    def _index(self, files: dict[str, int]) -> None:
+        """ `files` maps the absolute path of every file to its size """
+        self._files = files
+        self._directories = {}
+        for path in files:
+            child = path
+            parent = os.path.dirname(child)
+            contents = self._directories.setdefault(parent, (set(), set()))
+            contents[0].add(os.path.basename(child))
+            while parent != child:
+                child, parent = parent, os.path.dirname(parent)
+                contents = self._directories.setdefault(
+                    parent, (set(), set()))
+                if os.path.basename(child) in contents[1]:
+                    break
+                contents[1].add(os.path.basename(child))
+
+    def list_directory(self, directory: str) -> DirectoryContents | None:
+        return self._directories.get(os.path.abspath(directory))
+
+    def stat(self, path: str) -> tuple[int, int] | None:
+        # the contents never change
+        path = os.path.abspath(path)
+        if path in self._files:
+            return (0, self._files[path])
+        return (0, 0) if path in self._directories else None
+
+
+class MemorySourceProvider(_IndexedSourceProvider):
+    """ Serves modules from a dictionary mapping their paths to their sources
+
+    Sources given as bytes are decoded like Python decodes source files,
+    honoring encoding declarations. Nothing is read from the filesystem, so
+    the directories of every module (and of the libraries it uses) need to be
+    included, though standard library modules don't.
+    """
+    sources: dict[str, str | bytes]
+
+    def __init__(self, sources: dict[str, str | bytes]) -> None:
+        self.sources = {os.path.abspath(path): source
+                        for path, source in sources.items()}
+        self._index({path: len(source)
+                    for path, source in self.sources.items()})
+
+    def read(self, path: str) -> str:
+        source = self.sources.get(os.path.abspath(path))
+        if source is None:
+            raise FileNotFoundError(path)
+        return decode_source(source) if isinstance(source, bytes) else source
+
+
+class _MappedFile(io.RawIOBase):
+    """ A read-only file over a memory mapping, which `zipfile` can't use directly before Python 3.13 """
+    mapping: mmap.mmap
+    position: int
+
+    def __init__(self, mapping: mmap.mmap) -> None:
+        super().__init__()
+        self.mapping = mapping
+        self.position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += len(self.mapping)
+        self.position = offset
+        return offset
+
+    def tell(self) -> int:
+        return self.position
+
+    def readinto(self, buffer) -> int:  # type: ignore
+        data = self.mapping[self.position:self.position + len(buffer)]
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+
+class ArchiveSourceProvider(_IndexedSourceProvider):
+    """ Serves modules from a zip or tar archive (which may be compressed)
+
+    The archive's contents appear under `root`, which defaults to the path of
+    the archive itself like `zipimport` does, so `package/module.py` in
+    `/srv/sources.zip` is found at `/srv/sources.zip/package/module.py`. Only
+    the archive's index is read up front and members are read when the
+    compiler asks for them.
+
+    With `memory_map`, the archive is mapped into memory instead of being read
+    through a file, and the members of uncompressed tar archives are sliced
+    straight out of the mapping.
+
+    The archive stays open until `close` is called, the provider is used as a
+    context manager, or it's garbage collected.
+    """
+    archive_path: str
+    root: str
+    memory_map: bool
+    _lock: threading.Lock
+    _map: mmap.mmap | None
+    _zip: zipfile.ZipFile | None
+    _tar: tarfile.TarFile | None
+    # the member of each path, in the archive's format
+    _members: dict[str, zipfile.ZipInfo | tarfile.TarInfo]
+
+    def __init__(self, archive_path: str, root: str | None = None, memory_map: bool = False) -> None:
+        self.archive_path = archive_path
+        self.root = os.path.abspath(root if root is not None else archive_path)
+        self.memory_map = memory_map
+        self._open()
+        self._members = {}
+        if self._zip is not None:
+            for info in self._zip.infolist():
+                if not info.is_dir():
+                    self._members[self._member_path(info.filename)] = info
+        elif self._tar is not None:
+            for member in self._tar.getmembers():
+                if member.isfile():
+                    self._members[self._member_path(member.name)] = member
+        self._index({path: member.file_size if isinstance(member, zipfile.ZipInfo) else member.size
+                     for path, member in self._members.items()})
+
+    def _member_path(self, name: str) -> str:
+        return os.path.abspath(os.path.join(self.root, name))
+
+    def _open(self) -> None:
+        self._lock = threading.Lock()
+        self._map = None
+        self._zip = None
+        self._tar = None
+        try:
+            if self.memory_map:
+                with open(self.archive_path, "rb") as file:
+                    self._map = mmap.mmap(
+                        file.fileno(), 0, access=mmap.ACCESS_READ)
+                archive: _MappedFile | str = _MappedFile(self._map)
+            else:
+                archive = self.archive_path
+            if zipfile.is_zipfile(archive):
+                self._zip = zipfile.ZipFile(archive)
+            elif isinstance(archive, _MappedFile):
+                archive.seek(0)
+                self._tar = tarfile.open(fileobj=archive)  # type: ignore
+            else:
+                self._tar = tarfile.open(archive)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self) -> None:
+        """ closes the archive. the provider can't be read from afterwards """
+        if self._zip is not None:
+            self._zip.close()
+            self._zip = None
+        if self._tar is not None:
+            self._tar.close()
+            self._tar = None
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def __enter__(self) -> "ArchiveSourceProvider":
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
+
+    def __del__(self) -> None:
+        # the constructor may have failed before the archive was opened
+        if "_map" in self.__dict__:
+            self.close()
+
+    def __getstate__(self) -> dict[str, object]:
+        # the open archive can't be sent to other processes, so they open it
+        # again
+        state = self.__dict__.copy()
+        for name in ("_lock", "_map", "_zip", "_tar"):
+            del state[name]
+        return state
+
+    def __setstate__(self, state: dict[str, object]) -> None:
+        self.__dict__.update(state)
+        self._open()
+
+    def _read_bytes(self, member: zipfile.ZipInfo | tarfile.TarInfo) -> bytes:
+        if isinstance(member, zipfile.ZipInfo):
+            assert self._zip is not None
+            return self._zip.read(member)
+        if self._map is not None and self._tar is not None and isinstance(self._tar.fileobj, _MappedFile):
+            # uncompressed, so the member's data is in the mapping as is
+            return self._map[member.offset_data:member.offset_data + member.size]
+        assert self._tar is not None
+        with self._lock:
+            file = self._tar.extractfile(member)
+            assert file is not None
+            return file.read()
+
+    def read(self, path: str) -> str:
+        member = self._members.get(os.path.abspath(path))
+        if member is None:
+            raise FileNotFoundError(path)
+        if self._zip is None and self._tar is None:
+            raise ValueError("read from a closed ArchiveSourceProvider")
+        return decode_source(self._read_bytes(member))
+
+
+class SourceProviderTestMethods(unittest.TestCase):
+    SOURCES = {
+        "package/__init__.py": b"",
+        "package/module.py": b"# -*- coding: latin-1 -*-\nx = '\xe9'\n",
+        "main.py": b"import package.module\n",
+    }
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def check(self, provider: SourceProvider, root: str):
+        self.assertEqual(provider.list_directory(root),
+                         ({"main.py"}, {"package"}))
+        self.assertEqual(provider.list_directory(os.path.join(root, "package")),
+                         ({"__init__.py", "module.py"}, set()))
+        self.assertIsNone(provider.list_directory(
+            os.path.join(root, "missing")))
+        self.assertEqual(provider.read(os.path.join(root, "package", "module.py")),
+                         "# -*- coding: latin-1 -*-\nx = 'é'\n")
+        self.assertIsNone(provider.stat(os.path.join(root, "missing.py")))
+        with self.assertRaises(OSError):
+            provider.read(os.path.join(root, "missing.py"))
+
+    def test_incomplete_provider(self):
+        class Provider(SourceProvider):
+            def read(self, path: str) -> str:
+                return ""
+
+        with self.assertRaises(TypeError):
+            Provider()
+
+    def test_memory(self):
+        self.check(MemorySourceProvider({f"/app/{path}": source for path, source in self.SOURCES.items()}),
+                   "/app")
+
+    def test_zip(self):
+        path = os.path.join(self.directory.name, "sources.zip")
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+            for name, source in self.SOURCES.items():
+                archive.writestr(name, source)
+        self.check(ArchiveSourceProvider(path), path)
+        self.check(ArchiveSourceProvider(
+            path, "/app", memory_map=True), "/app")
+
+    def test_tar(self):
+        for mode in ("w", "w:gz"):
+            path = os.path.join(self.directory.name, f"sources.tar.{mode}")
+            with tarfile.open(path, mode) as archive:
+                for name, source in self.SOURCES.items():
+                    info = tarfile.TarInfo(name)
+                    info.size = len(source)
+                    archive.addfile(info, io.BytesIO(source))
+            self.check(ArchiveSourceProvider(path, "/app"), "/app")
+            self.check(ArchiveSourceProvider(
+                path, "/app", memory_map=True), "/app")
+
+    def test_close(self):
+        path = os.path.join(self.directory.name, "sources.zip")
+        with zipfile.ZipFile(path, "w") as archive:
+            for name, source in self.SOURCES.items():
+                archive.writestr(name, source)
+        with ArchiveSourceProvider(path, "/app", memory_map=True) as provider:
+            self.check(provider, "/app")
+            mapping = provider._map
+            assert mapping is not None
+        self.assertTrue(mapping.closed)
+        with self.assertRaises(ValueError):
+            provider.read("/app/main.py")
+        # closing again does nothing
+        provider.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
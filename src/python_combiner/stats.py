@@ -0,0 +1,102 @@
+import ast
+import time
+from contextlib import nullcontext
+from dataclasses import asdict, dataclass
+from typing import Any
+
+_NOT_MEASURED = nullcontext()
+
+
+@dataclass
+class PhaseStats:
+    # total wall time spent in the phase, in seconds
+    time: float = 0.0
+    count: int = 0
+
+
+@dataclass
+class ModuleStats:
+    source_size: int
+    node_count: int
+
+
+class _PhaseTimer:
+    def __init__(self, phase: PhaseStats) -> None:
+        self.phase = phase
+
+    def __enter__(self) -> None:
+        self.start = time.perf_counter()
+
+    def __exit__(self, *args) -> None:
+        self.phase.time += time.perf_counter() - self.start
+        self.phase.count += 1
+
+
+class CompilerStats:
+    """ Wall time and call counts of each phase of a compilation
+
+    Phases are named after what the compiler is doing (e.g. `parse`,
+    `find_spec`, `unparse`), and plugin hooks are recorded as
+    `<hook name>:<plugin class name>`. Phases can contain other phases, e.g.
+    `discover` includes the `parse` of every module. Modules processed in
+    worker processes have their phases added up, so the total time of a phase
+    can be more than the wall time of the build when using several jobs.
+    """
+    phases: dict[str, PhaseStats]
+    counters: dict[str, int]
+    modules: dict[str, ModuleStats]
+
+    def __init__(self) -> None:
+        self.phases = {}
+        self.counters = {}
+        self.modules = {}
+
+    def measure(self, phase: str) -> _PhaseTimer:
+        """ returns a context manager recording the time spent in `phase` """
+        phase_stats = self.phases.get(phase)
+        if phase_stats is None:
+            phase_stats = self.phases[phase] = PhaseStats()
+        return _PhaseTimer(phase_stats)
+
+    def count(self, counter: str, amount: int = 1) -> None:
+        self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def record_module(self, path: str, source: str, module: ast.Module) -> None:
+        self.modules[path] = ModuleStats(
+            source_size=len(source.encode()),
+            node_count=sum(1 for _ in ast.walk(module)))
+
+    def merge(self, other: "CompilerStats") -> None:
+        """ adds the stats collected by `other` (e.g. in a worker process) to these """
+        for name, phase in other.phases.items():
+            own = self.phases.setdefault(name, PhaseStats())
+            own.time += phase.time
+            own.count += phase.count
+        for name, amount in other.counters.items():
+            self.count(name, amount)
+        self.modules.update(other.modules)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "phases": {name: asdict(phase) for name, phase in self.phases.items()},
+            "counters": dict(self.counters),
+            "modules": {path: asdict(module) for path, module in self.modules.items()},
+        }
+
+    def format_table(self) -> str:
+        """ formats the phases as a table sorted by time, for people to read """
+        width = max([len(name) for name in [*self.phases, *self.counters, "phase"]])
+        lines = [f"{'phase':<{width}} {'time (ms)':>10} {'calls':>8}"]
+        for name, phase in sorted(self.phases.items(), key=lambda item: -item[1].time):
+            lines.append(
+                f"{name:<{width}} {phase.time * 1000:>10.1f} {phase.count:>8}")
+        for name, amount in self.counters.items():
+            lines.append(f"{name:<{width}} {amount:>19}")
+        return "\n".join(lines)
+
+
+def measure(stats: CompilerStats | None, phase: str) -> Any:
+    """ like `CompilerStats.measure`, but does nothing if `stats` is None """
+    if stats is None:
+        return _NOT_MEASURED
+    return stats.measure(phase)
@@ -0,0 +1,38 @@
+import asyncio
+
+from .plugin import Plugin
+
+# plugins the tests of the other modules build from, which aren't part of the
+# public API
+
+
+class VirtualModulesPlugin(Plugin):
+    """ Resolves the modules in `sources` to `/virtual/<module>.py` """
+    sources: dict[str, str]
+
+    def __init__(self, sources: dict[str, str]) -> None:
+        self.sources = sources
+
+    def hook_import_resolution(self, path: str, module: str) -> tuple[str, str] | None:
+        if module in self.sources:
+            return self.sources[module], f"/virtual/{module}.py"
+        return None
+
+
+class AsyncVirtualModulesPlugin(Plugin):
+    """ Like `VirtualModulesPlugin`, but resolves modules asynchronously """
+    sources: dict[str, str]
+    resolving: asyncio.Event | None
+
+    def __init__(self, sources: dict[str, str], resolving: asyncio.Event | None = None) -> None:
+        self.sources = sources
+        # if given, resolution waits until it's set
+        self.resolving = resolving
+
+    async def hook_import_resolution_async(self, path: str, module: str) -> tuple[str, str] | None:
+        if self.resolving is not None:
+            await self.resolving.wait()
+        await asyncio.sleep(0)
+        if module in self.sources:
+            return self.sources[module], f"/virtual/{module}.py"
+        return None
@@ -4,10 +4,11 @@ import os
 import re
 from _ast import Global
 from dataclasses import dataclass
-from typing import Any
+from typing import Any, ClassVar
 
 from .errors import (AsteriskImportError, GlobalError, InternalCompilerError,
                      RelativeImportError, ReservedIdentifierError)
+from .exporthelper import RUN_HELPER_NAME, SYNC_HELPER_NAME
 from .options import CompilerOptions
 
 python_invalid_character_re = re.compile(r"[^A-Za-z0-9_]")
@@ -17,7 +18,7 @@ def purify_identifier(name: str):
     return python_invalid_character_re.sub("", name)
 
 
-@dataclass
+@dataclass(slots=True)
 class FoundImport:
     module: str
     module_alias: str | None
@@ -26,7 +27,7 @@ class FoundImport:
     is_asterisk_import: bool
     is_module_import: bool
 
-    _ident_index: int = -1
+    _ident_index: ClassVar[int] = -1
 
     def generate_unique_identifier(self, minified: bool, hash_length: int):
         if minified:
@@ -85,6 +86,8 @@ class ImportVisitor(ast.NodeVisitor):
 class ModuleTransformer(ast.NodeTransformer):
     imports: list[FoundImport]
     argument_import_names: list[str]
+    # module name -> the name of the factory argument it's passed as
+    argument_import_names_by_module: dict[str, str]
     name: str
     path: str
     options: CompilerOptions
@@ -92,25 +95,30 @@ class ModuleTransformer(ast.NodeTransformer):
     def __init__(self, path: str, imports: list[FoundImport], argument_import_names: list[str], name: str, options: CompilerOptions) -> None:
         self.imports = imports
         self.argument_import_names = argument_import_names
+        self.argument_import_names_by_module = {}
+        for item, argument_name in zip(imports, argument_import_names):
+            # the first import of a module wins, like the lookup always did
+            self.argument_import_names_by_module.setdefault(
+                item.module, argument_name)
         self.name = name
         self.options = options
         self.path = path
         super().__init__()
 
     def _resolve_module_argument_identifier(self, module_name: str) -> str:
-        for i, item in enumerate(self.imports):
-            if item.module == module_name:
-                return self.argument_import_names[i]
-        raise InternalCompilerError(
-            f"can't find '{module_name}' import in mapping")
+        argument_name = self.argument_import_names_by_module.get(module_name)
+        if argument_name is None:
+            raise InternalCompilerError(
+                f"can't find '{module_name}' import in mapping")
+        return argument_name
 
     def visit_Import(self, node: ast.Import) -> Any:
         output: list[ast.Assign | ast.Import] = []
         for alias in node.names:
-            if alias.name in self.options.ignore_imports:
+            if alias.name in self.options.ignore_imports_set:
                 # don't process, just ignore
                 output.append(ast.Import(names=[alias]))
-            elif alias.name in self.options.remove_imports:
+            elif alias.name in self.options.remove_imports_set:
                 # don't emit removed imports
                 pass
             else:
@@ -129,10 +137,10 @@ class ModuleTransformer(ast.NodeTransformer):
 
     def visit_ImportFrom(self, node: ast.ImportFrom) -> Any:
         module = node.module
-        if node.module in self.options.ignore_imports:
+        if node.module in self.options.ignore_imports_set:
             # don't process
             return node
-        elif node.module in self.options.remove_imports:
+        elif node.module in self.options.remove_imports_set:
             # don't emit anything
             return None
         if module is None:
@@ -182,3 +190,64 @@ class ModuleTransformer(ast.NodeTransformer):
 
     def visit_Global(self, node: Global) -> Any:
         raise GlobalError(self.path, node.lineno, node.col_offset)
+
+
+class DeferredImportTransformer(ast.NodeTransformer):
+    """ Makes a module factory run the modules of its cycle when it imports them
+
+    Used with deferred circular imports. Before every import of one of the
+    factory's `deferred_arguments` (the modules of its cycle), the top-level
+    names the module has bound so far are copied into its module object
+    `module_name`, and the imported module is run if it hasn't started yet.
+    Imports inside functions and classes only run the imported module.
+    """
+    module_name: str
+    deferred_arguments: set[str]
+    # how many functions and classes the visited node is in
+    _depth: int
+
+    def __init__(self, module_name: str, deferred_arguments: set[str]) -> None:
+        self.module_name = module_name
+        self.deferred_arguments = deferred_arguments
+        self._depth = 0
+        super().__init__()
+
+    def transform(self, factory: ast.FunctionDef) -> ast.FunctionDef:
+        # the factory's own body is the module's top level
+        return self.generic_visit(factory)  # type: ignore
+
+    def _visit_scope(self, node: ast.AST) -> Any:
+        self._depth += 1
+        try:
+            return self.generic_visit(node)
+        finally:
+            self._depth -= 1
+
+    visit_FunctionDef = visit_AsyncFunctionDef = visit_ClassDef = _visit_scope
+
+    def visit_Assign(self, node: ast.Assign) -> Any:
+        # imports are assignments from the factory's arguments (see
+        # `ModuleTransformer`)
+        value = node.value
+        if isinstance(value, ast.Attribute):
+            value = value.value
+        if not isinstance(value, ast.Name) or value.id not in self.deferred_arguments:
+            return node
+        output: list[ast.stmt] = []
+        if self._depth == 0:
+            output.append(ast.Expr(value=ast.Call(
+                func=ast.Name(id=SYNC_HELPER_NAME, ctx=ast.Load()),
+                args=[
+                    ast.Name(id=self.module_name, ctx=ast.Load()),
+                    ast.Call(func=ast.Name(id="locals", ctx=ast.Load()),
+                             args=[], keywords=[])
+                ],
+                keywords=[]
+            )))
+        output.append(ast.Expr(value=ast.Call(
+            func=ast.Name(id=RUN_HELPER_NAME, ctx=ast.Load()),
+            args=[ast.Name(id=value.id, ctx=ast.Load())],
+            keywords=[]
+        )))
+        output.append(node)
+        return output
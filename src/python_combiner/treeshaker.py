@@ -0,0 +1,390 @@
+import ast
+from collections import deque
+
+from .processedmodule import ProcessedModule
+from .transformers import ImportVisitor
+
+# names which let code access variables without naming them, making it
+# impossible to tell what a module uses
+DYNAMIC_ACCESS_NAMES = {"eval", "exec", "globals",
+                        "locals", "vars", "__import__", "__dict__"}
+# decorators which are known not to have side effects when applied to methods
+PURE_METHOD_DECORATORS = {"property", "staticmethod", "classmethod"}
+PURE_PROPERTY_DECORATORS = {"setter", "getter", "deleter"}
+
+
+def _is_pure_expression(node: ast.expr | None) -> bool:
+    """
+    whether evaluating `node` can't have side effects (other than failing).
+    attribute access, subscripts and operators can run arbitrary code through
+    descriptors, `__getitem__` and operator overloads, so they aren't pure
+    """
+    if node is None or isinstance(node, (ast.Constant, ast.Name)):
+        return True
+    elif isinstance(node, (ast.Tuple, ast.List, ast.Set)):
+        return all(_is_pure_expression(element) for element in node.elts)
+    elif isinstance(node, ast.Dict):
+        return all(_is_pure_expression(key) for key in node.keys) and all(
+            _is_pure_expression(value) for value in node.values)
+    elif isinstance(node, ast.BinOp) and isinstance(node.op, ast.BitOr):
+        # unions in annotations
+        return _is_pure_expression(node.left) and _is_pure_expression(node.right)
+    elif isinstance(node, ast.UnaryOp):
+        # negative numbers are parsed as the negation of a constant
+        return isinstance(node.operand, ast.Constant)
+    return False
+
+
+def _is_pure_signature(node: ast.FunctionDef | ast.AsyncFunctionDef) -> bool:
+    args = node.args
+    all_args = args.posonlyargs + args.args + args.kwonlyargs
+    if args.vararg is not None:
+        all_args.append(args.vararg)
+    if args.kwarg is not None:
+        all_args.append(args.kwarg)
+    return (all(_is_pure_expression(default) for default in args.defaults)
+            and all(_is_pure_expression(default) for default in args.kw_defaults)
+            and all(_is_pure_expression(arg.annotation) for arg in all_args)
+            and _is_pure_expression(node.returns))
+
+
+def _is_pure_method_decorator(node: ast.expr) -> bool:
+    if isinstance(node, ast.Name):
+        return node.id in PURE_METHOD_DECORATORS
+    return (isinstance(node, ast.Attribute)
+            and isinstance(node.value, ast.Name)
+            and node.attr in PURE_PROPERTY_DECORATORS)
+
+
+def _is_pure_class_body_statement(node: ast.stmt) -> bool:
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+        return (all(_is_pure_method_decorator(decorator) for decorator in node.decorator_list)
+                and _is_pure_signature(node))
+    elif isinstance(node, ast.ClassDef):
+        return _is_pure_class(node)
+    elif isinstance(node, ast.Assign):
+        return _is_pure_expression(node.value) and all(isinstance(target, ast.Name) for target in node.targets)
+    elif isinstance(node, ast.AnnAssign):
+        return _is_pure_expression(node.value) and _is_pure_expression(node.annotation)
+    return isinstance(node, ast.Pass) or (isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant))
+
+
+def _is_pure_class(node: ast.ClassDef) -> bool:
+    # defining a subclass runs the `__init_subclass__` of its bases or their
+    # metaclass, which may e.g. register it somewhere
+    return (len(node.decorator_list) == 0
+            and len(node.keywords) == 0
+            and all(isinstance(base, ast.Name) and base.id == "object" for base in node.bases)
+            and all(_is_pure_class_body_statement(stmt) for stmt in node.body))
+
+
+def _definition_names(node: ast.stmt) -> list[str] | None:
+    """
+    returns the names a top-level statement defines if it only defines them
+    without side effects, meaning it can be removed if they're unused.
+    """
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+        if len(node.decorator_list) == 0 and _is_pure_signature(node):
+            return [node.name]
+    elif isinstance(node, ast.ClassDef):
+        if _is_pure_class(node):
+            return [node.name]
+    elif isinstance(node, ast.Assign):
+        if (all(isinstance(target, ast.Name) for target in node.targets)
+                and _is_pure_expression(node.value)):
+            return [target.id for target in node.targets]  # type: ignore
+    elif isinstance(node, ast.AnnAssign):
+        if (isinstance(node.target, ast.Name)
+                and _is_pure_expression(node.value)
+                and _is_pure_expression(node.annotation)):
+            return [node.target.id]
+    return None
+
+
+def _is_dunder(name: str) -> bool:
+    return name.startswith("__") and name.endswith("__")
+
+
+def _is_main_guard(node: ast.stmt) -> bool:
+    """ whether `node` is an `if __name__ == "__main__":` block """
+    if not isinstance(node, ast.If) or len(node.orelse) > 0:
+        return False
+    test = node.test
+    return (isinstance(test, ast.Compare)
+            and len(test.ops) == 1
+            and isinstance(test.ops[0], ast.Eq)
+            and isinstance(test.left, ast.Name)
+            and test.left.id == "__name__"
+            and isinstance(test.comparators[0], ast.Constant)
+            and test.comparators[0].value == "__main__")
+
+
+class _ModuleShakeInfo:
+    module: ProcessedModule
+    body: list[ast.stmt]
+    # imported module names to the path of the module they resolve to
+    dependencies: dict[str, str]
+    # names to the indexes of the removable top-level statements defining them
+    definitions: dict[str, list[int]]
+    # names to the (statement index, alias index, module path, imported name)
+    # of the top-level imports binding them. the imported name is None for
+    # `import x` statements
+    import_bindings: dict[str, list[tuple[int, int, str, str | None]]]
+    roots: list[int]
+    # whether running the top-level statements which are always kept can have
+    # side effects
+    has_side_effects: bool
+    dynamic: bool
+
+    kept_statements: set[int]
+    kept_aliases: set[tuple[int, int]]
+    fully_used: bool
+
+    def __init__(self, module: ProcessedModule, dependency_paths: list[str]) -> None:
+        assert module.module is not None
+        self.module = module
+        self.body = module.module.body
+        self.dependencies = {item.module: path for item,
+                             path in zip(module.imports, dependency_paths)}
+        self.definitions = {}
+        self.import_bindings = {}
+        self.roots = []
+        self.has_side_effects = False
+        self.dynamic = False
+        self.kept_statements = set()
+        self.kept_aliases = set()
+        self.fully_used = False
+
+        for i, stmt in enumerate(self.body):
+            if module.name != "__main__" and _is_main_guard(stmt):
+                # dead code when the module is imported, so it's dropped
+                continue
+            if isinstance(stmt, (ast.Import, ast.ImportFrom)) and self._add_import_bindings(i, stmt):
+                continue
+            names = _definition_names(stmt)
+            if names is not None and not any(_is_dunder(name) for name in names):
+                for name in names:
+                    self.definitions.setdefault(name, []).append(i)
+                continue
+            self.roots.append(i)
+            if (names is None
+                    and not isinstance(stmt, ast.Pass)
+                    and not (isinstance(stmt, ast.Expr) and isinstance(stmt.value, ast.Constant))):
+                self.has_side_effects = True
+
+        for node in ast.walk(module.module):
+            if ((isinstance(node, ast.Name) and node.id in DYNAMIC_ACCESS_NAMES)
+                    or (isinstance(node, ast.Attribute) and node.attr == "__dict__")):
+                self.dynamic = True
+                break
+
+    def _add_import_bindings(self, i: int, stmt: ast.Import | ast.ImportFrom) -> bool:
+        """ records the names bound by an import, or returns False if it can't be removed """
+        if isinstance(stmt, ast.Import):
+            for alias in stmt.names:
+                # `import a.b` binds `a`, which isn't something we can track
+                if alias.name not in self.dependencies or (alias.asname is None and "." in alias.name):
+                    return False
+            for j, alias in enumerate(stmt.names):
+                name = alias.asname if alias.asname is not None else alias.name
+                self.import_bindings.setdefault(name, []).append(
+                    (i, j, self.dependencies[alias.name], None))
+        else:
+            # star imports are rejected when the module is transformed, so
+            # they're kept for that to happen
+            if (stmt.level > 0 or stmt.module not in self.dependencies
+                    or any(alias.name == "*" for alias in stmt.names)):
+                return False
+            for j, alias in enumerate(stmt.names):
+                name = alias.asname if alias.asname is not None else alias.name
+                self.import_bindings.setdefault(name, []).append(
+                    (i, j, self.dependencies[stmt.module], alias.name))
+        return True
+
+    def imported_paths(self) -> list[tuple[int, int, str]]:
+        return [(i, j, path) for bindings in self.import_bindings.values()
+                for i, j, path, _ in bindings]
+
+
+class TreeShaker:
+    """ Removes unused top-level definitions and modules from a dependency tree
+
+    Starting from the main module, every top-level statement which may have
+    side effects is kept, and the names those statements reference (including
+    `x.name` for imported modules `x`) mark the definitions they refer to as
+    used, transitively across modules. Functions, classes and assignments
+    which can be removed without changing behaviour are dropped if nothing uses
+    them, along with imports of modules which are unused and side-effect-free.
+
+    Built-in modules are considered to be free of side effects. Modules which
+    access their namespace dynamically (`eval`, `globals()`, ...) or whose
+    module object is used as a value are kept whole.
+    """
+    main_path: str
+    dependency_tree_modules: dict[str, ProcessedModule]
+    dependency_tree_edges: dict[str, list[str]]
+    infos: dict[str, _ModuleShakeInfo]
+    included: set[str]
+    has_side_effects: set[str]
+
+    def __init__(self, main_path: str, dependency_tree_modules: dict[str, ProcessedModule], dependency_tree_edges: dict[str, list[str]]) -> None:
+        self.main_path = main_path
+        self.dependency_tree_modules = dependency_tree_modules
+        self.dependency_tree_edges = dependency_tree_edges
+        self.infos = {
+            path: _ModuleShakeInfo(module, dependency_tree_edges[path])
+            for path, module in dependency_tree_modules.items()
+            if module.module is not None
+        }
+        self.included = set()
+        self.has_side_effects = self._find_modules_with_side_effects()
+        self._queue: deque[tuple[str, str, str | int | None]] = deque()
+
+    def _find_modules_with_side_effects(self) -> set[str]:
+        """
+        a module has side effects when importing it does something other than
+        defining things, which includes importing a module with side effects.
+        """
+        importers: dict[str, set[str]] = {}
+        for path, info in self.infos.items():
+            for _, _, dependency in info.imported_paths():
+                importers.setdefault(dependency, set()).add(path)
+        result = {path for path, info in self.infos.items()
+                  if info.has_side_effects}
+        queue = list(result)
+        while len(queue) > 0:
+            for importer in importers.get(queue.pop(), ()):
+                if importer not in result:
+                    result.add(importer)
+                    queue.append(importer)
+        return result
+
+    def shake(self) -> None:
+        """ removes everything unused from the dependency tree, modifying the modules in place """
+        self._queue.append(("include", self.main_path, None))
+        while len(self._queue) > 0:
+            action, path, argument = self._queue.popleft()
+            if action == "include":
+                self._include(path)
+            elif action == "keep":
+                assert isinstance(argument, int)
+                self._keep_statement(path, argument)
+            elif action == "use":
+                assert isinstance(argument, str)
+                self._use(path, argument)
+            else:
+                self._use_fully(path)
+        self._apply()
+
+    def _include(self, path: str) -> None:
+        if path in self.included:
+            return
+        self.included.add(path)
+        info = self.infos.get(path)
+        if info is None:
+            return
+        for i in info.roots:
+            self._queue.append(("keep", path, i))
+        # importing a module with side effects can't be removed
+        for i, j, dependency in info.imported_paths():
+            if dependency in self.has_side_effects:
+                self._keep_alias(info, i, j, dependency)
+        if info.dynamic:
+            self._queue.append(("full", path, None))
+
+    def _keep_statement(self, path: str, i: int) -> None:
+        info = self.infos[path]
+        if i in info.kept_statements:
+            return
+        info.kept_statements.add(i)
+        stmt = info.body[i]
+        # names used as `name.attribute` only need that attribute from the
+        # module `name` is bound to. any other use needs all of it
+        attribute_values: set[int] = set()
+        for node in ast.walk(stmt):
+            if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name):
+                attribute_values.add(id(node.value))
+                self._reference(info, node.value.id, node.attr)
+            elif isinstance(node, (ast.Import, ast.ImportFrom)):
+                # imports nested in the code we keep need the whole module
+                names = [node.module] if isinstance(
+                    node, ast.ImportFrom) else [alias.name for alias in node.names]
+                for name in names:
+                    if name in info.dependencies:
+                        self._queue.append(
+                            ("full", info.dependencies[name], None))
+        for node in ast.walk(stmt):
+            if isinstance(node, ast.Name) and id(node) not in attribute_values:
+                self._reference(info, node.id, None)
+
+    def _reference(self, info: _ModuleShakeInfo, name: str, attribute: str | None) -> None:
+        path = info.module.path
+        for i in info.definitions.get(name, ()):
+            self._queue.append(("keep", path, i))
+        for i, j, dependency, imported_name in info.import_bindings.get(name, ()):
+            self._keep_alias(info, i, j, dependency)
+            if imported_name is not None:
+                self._queue.append(("use", dependency, imported_name))
+            elif attribute is not None:
+                self._queue.append(("use", dependency, attribute))
+            else:
+                self._queue.append(("full", dependency, None))
+
+    def _keep_alias(self, info: _ModuleShakeInfo, i: int, j: int, dependency: str) -> None:
+        if (i, j) not in info.kept_aliases:
+            info.kept_aliases.add((i, j))
+            self._queue.append(("include", dependency, None))
+
+    def _use(self, path: str, name: str) -> None:
+        """ marks the export `name` of the module at `path` as used """
+        self._include(path)
+        info = self.infos.get(path)
+        if info is not None and not info.fully_used:
+            self._reference(info, name, None)
+
+    def _use_fully(self, path: str) -> None:
+        self._include(path)
+        info = self.infos.get(path)
+        if info is None or info.fully_used:
+            return
+        info.fully_used = True
+        for name in list(info.definitions.keys()) + list(info.import_bindings.keys()):
+            self._reference(info, name, None)
+
+    def _apply(self) -> None:
+        for path in list(self.dependency_tree_modules.keys()):
+            if path not in self.included:
+                del self.dependency_tree_modules[path]
+                del self.dependency_tree_edges[path]
+        for path, info in self.infos.items():
+            if path not in self.included:
+                continue
+            body: list[ast.stmt] = []
+            for i, stmt in enumerate(info.body):
+                if isinstance(stmt, ast.Import) and i not in info.roots:
+                    stmt.names = [alias for j, alias in enumerate(stmt.names)
+                                  if (i, j) in info.kept_aliases]
+                    if len(stmt.names) > 0:
+                        body.append(stmt)
+                elif isinstance(stmt, ast.ImportFrom) and i not in info.roots:
+                    stmt.names = [alias for j, alias in enumerate(stmt.names)
+                                  if (i, j) in info.kept_aliases]
+                    if len(stmt.names) > 0:
+                        body.append(stmt)
+                elif i in info.kept_statements:
+                    body.append(stmt)
+            if len(body) == 0:
+                # keep the generated factory valid
+                body.append(ast.Pass())
+            assert info.module.module is not None
+            info.module.module.body = body
+
+            # drop the imports which were removed along with their edges
+            remaining_imports = {item.module for item in ImportVisitor.find_imports(
+                info.module.module, path)}
+            kept = [(item, dependency) for item, dependency
+                    in zip(info.module.imports, self.dependency_tree_edges[path])
+                    if item.module in remaining_imports]
+            info.module.imports = [item for item, _ in kept]
+            self.dependency_tree_edges[path] = [
+                dependency for _, dependency in kept]
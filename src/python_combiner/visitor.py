@@ -0,0 +1,182 @@
+import ast
+import copy
+import unittest
+from collections.abc import Callable
+from typing import TYPE_CHECKING, Any
+
+from .stats import CompilerStats, measure
+
+if TYPE_CHECKING:
+    # only import this for the types because `plugin.py` depends on this file
+    from .plugin import Plugin
+
+
+class VisitContext:
+    """ Information about where in the module the node being visited is """
+    path: str
+    parents: list[ast.AST]
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.parents = []
+
+    @property
+    def parent(self) -> ast.AST | None:
+        return self.parents[-1] if len(self.parents) > 0 else None
+
+
+# a callback receives a node (whose children have already been visited) and
+# returns what to replace it with, like a `NodeTransformer` visit method: a node,
+# a list of nodes or None to remove it
+NodeCallback = Callable[[Any, VisitContext], Any]
+NodeCallbacks = dict[type[ast.AST], NodeCallback]
+
+
+class FusedTransformer:
+    """ Runs the node callbacks of several plugins in one traversal of a module
+
+    The traversal is post-order, so each callback sees a node whose children
+    have already been transformed by every plugin. For each node, the callbacks
+    run in plugin order, each one receiving the node returned by the previous
+    one. When a callback replaces a node with a list or removes it, the callbacks
+    of later plugins aren't run for that node, since the nodes in the list were
+    already visited as children. The children of a node replaced by a
+    different kind of node aren't visited again.
+    """
+    callbacks: dict[type[ast.AST], list[tuple[int, NodeCallback]]]
+    context: VisitContext
+
+    def __init__(self, path: str, callback_sets: list[NodeCallbacks]) -> None:
+        self.context = VisitContext(path)
+        # merge the callbacks per node type so nodes nobody is interested in
+        # only cost a dictionary lookup. the index of the plugin is kept for
+        # ordering the callbacks for replaced nodes
+        self.callbacks = {}
+        for i, callbacks in enumerate(callback_sets):
+            for node_type, callback in callbacks.items():
+                self.callbacks.setdefault(node_type, []).append((i, callback))
+
+    def visit(self, node: ast.AST) -> Any:
+        parents = self.context.parents
+        parents.append(node)
+        for field, old_value in ast.iter_fields(node):
+            if isinstance(old_value, list):
+                new_values = []
+                for value in old_value:
+                    if isinstance(value, ast.AST):
+                        value = self.visit(value)
+                        if value is None:
+                            continue
+                        elif not isinstance(value, ast.AST):
+                            new_values.extend(value)
+                            continue
+                    new_values.append(value)
+                old_value[:] = new_values
+            elif isinstance(old_value, ast.AST):
+                new_node = self.visit(old_value)
+                if new_node is None:
+                    delattr(node, field)
+                else:
+                    setattr(node, field, new_node)
+        parents.pop()
+        return self._apply_callbacks(node, 0)
+
+    def _apply_callbacks(self, node: ast.AST, first_plugin: int) -> Any:
+        callbacks = self.callbacks.get(type(node))
+        if callbacks is None:
+            return node
+        result: Any = node
+        for i, callback in callbacks:
+            if i < first_plugin:
+                continue
+            result = callback(result, self.context)
+            if not isinstance(result, ast.AST):
+                return result
+            if type(result) is not type(node):
+                # the node was replaced by a different kind of node, so run the
+                # callbacks of the later plugins for the new node's type
+                return self._apply_callbacks(result, i + 1)
+        return result
+
+
+def run_module_hooks(path: str, module: ast.Module, plugins: "list[Plugin]", stats: CompilerStats | None = None) -> ast.Module:
+    """
+    runs the `hook_module` step of every plugin on `module`. consecutive plugins
+    providing node callbacks are fused into a single traversal, and plugins
+    which don't are run separately in between.
+    """
+    pending: list[NodeCallbacks] = []
+    pending_names: list[str] = []
+
+    def run_pending(module: ast.Module) -> ast.Module:
+        with measure(stats, f"hook_module_callbacks:{'+'.join(pending_names)}"):
+            return FusedTransformer(path, pending).visit(module)
+
+    for plugin in plugins:
+        callbacks = plugin.hook_module_callbacks(path)
+        if callbacks is not None:
+            pending.append(callbacks)
+            pending_names.append(type(plugin).__name__)
+        else:
+            if len(pending) > 0:
+                module = run_pending(module)
+                pending = []
+                pending_names = []
+            with measure(stats, f"hook_module:{type(plugin).__name__}"):
+                module = plugin.hook_module(path, module)
+    if len(pending) > 0:
+        module = run_pending(module)
+    return module
+
+
+class FusedTransformerTestMethods(unittest.TestCase):
+    SOURCE = "if not DEBUG:\n    print('a')\nelse:\n    print('b')\nx = DEBUG"
+
+    def plugins(self) -> "list[Plugin]":
+        from .plugin import Plugin
+
+        class InlineDebugPlugin(Plugin):
+            def hook_module_callbacks(self, path: str) -> NodeCallbacks:
+                def visit_Name(node: ast.Name, context: VisitContext) -> ast.AST:
+                    if node.id == "DEBUG" and isinstance(node.ctx, ast.Load):
+                        # replaced by a node of a different type
+                        return ast.Constant(False)
+                    return node
+                return {ast.Name: visit_Name}
+
+        class FoldPlugin(Plugin):
+            def hook_module_callbacks(self, path: str) -> NodeCallbacks:
+                def visit_Constant(node: ast.Constant, context: VisitContext) -> ast.AST:
+                    if isinstance(node.value, bool):
+                        return ast.Constant(int(node.value))
+                    return node
+
+                def visit_UnaryOp(node: ast.UnaryOp, context: VisitContext) -> ast.AST:
+                    if isinstance(node.op, ast.Not) and isinstance(node.operand, ast.Constant):
+                        return ast.Constant(not node.operand.value)
+                    return node
+
+                def visit_If(node: ast.If, context: VisitContext) -> Any:
+                    if isinstance(node.test, ast.Constant):
+                        return node.body if node.test.value else node.orelse
+                    return node
+                return {ast.Constant: visit_Constant, ast.UnaryOp: visit_UnaryOp, ast.If: visit_If}
+
+        return [InlineDebugPlugin(), FoldPlugin()]
+
+    def test_matches_separate_passes(self):
+        plugins = self.plugins()
+        module = ast.parse(self.SOURCE)
+        separate = copy.deepcopy(module)
+        for plugin in plugins:
+            separate = run_module_hooks("<test>", separate, [plugin])
+        stats = CompilerStats()
+        fused = run_module_hooks("<test>", module, plugins, stats)
+        self.assertEqual(list(stats.phases),
+                         ["hook_module_callbacks:InlineDebugPlugin+FoldPlugin"])
+        self.assertEqual(ast.dump(fused), ast.dump(separate))
+        self.assertEqual(ast.unparse(fused), "print('a')\nx = 0")
+
+
+if __name__ == "__main__":
+    unittest.main()